@@ -0,0 +1,375 @@
+import sys
+import threading
+import time
+import zlib
+
+import cv2
+
+
+def open_usb_camera(index=0, width=1920, height=1080):
+    """เปิดกล้อง USB แบบ MJPG ตามค่าที่ตู้ใช้อยู่"""
+    cap = cv2.VideoCapture(index)
+    cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc('M', 'J', 'P', 'G'))
+    # ตั้งค่าความกว้าง/ความสูงของเฟรมวิดีโอ
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+    return cap
+
+
+class CameraSupervisor:
+    """ดูแลกล้องใน thread แยก: ตรวจจับอ่านภาพไม่ได้/ภาพค้าง แล้วเปิดกล้องใหม่เอง
+
+    check() ควรเรียก latest() เพื่อเอาเฟรมล่าสุด ถ้าได้ None แปลว่ากล้องไม่พร้อม
+    และต้องปฏิเสธ trigger นั้นไป
+
+    ถ้าตั้ง preview_fps > 0 จะย่อภาพสำหรับ live preview ใน capture thread นี้เลย
+    (ไม่ส่งเฟรม 1080p เต็มไปให้ UI) โดยใช้ CPU ไม่เกิน preview_budget ของหนึ่ง core
+    """
+
+    def __init__(self, open_camera=None, index=0, width=1920, height=1080,
+                 stale_after=2.0, frozen_after=45, backoff_min=0.5, backoff_max=30.0,
+                 read_interval=0.03, preview_fps=0, preview_size=(320, 180), preview_budget=0.05,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.open_camera = open_camera or (lambda: open_usb_camera(index, width, height))
+        self.stale_after = stale_after        # วินาที: เฟรมเก่ากว่านี้ถือว่าใช้ไม่ได้
+        self.frozen_after = frozen_after      # จำนวนเฟรมติดกันที่ hash เหมือนเดิม = กล้องค้าง
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.read_interval = read_interval
+        self.clock = clock
+        self.sleep = sleep
+
+        self.cap = None
+        self.running = False
+        self._thread = None
+        self._lock = threading.Lock()
+        self._frame = None
+        self._frame_ts = None
+        self._last_hash = None
+        self._same_hash_count = 0
+
+        # live preview
+        self.preview_fps = preview_fps
+        self.preview_size = preview_size
+        self.preview_budget = preview_budget
+        self._preview = None
+        self._preview_ts = None
+        self._next_preview = 0.0
+        self._preview_paused = threading.Event()
+
+        # สถิติ downtime
+        self.camera_ok = False
+        self.outages = 0
+        self.reopen_attempts = 0
+        self._down_since = None
+        self._downtime_total = 0.0
+        self.last_error = "ยังไม่เริ่มกล้อง"
+
+    # ---- public ----
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self._down_since = self.clock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=2.0):
+        """หยุด thread อ่านภาพ กล้องจะถูกปิดใน thread นั้นเองตอนออกจาก loop
+
+        ถ้า join หมดเวลา (cap.read() ยังค้างอยู่) จะไม่ปิดกล้องจากที่นี่ ไม่ให้ release ชนกับ read
+        """
+        self.running = False
+        thread = self._thread
+        if thread is None:
+            self._release()
+            return
+        if thread is not threading.current_thread():
+            thread.join(timeout)
+            if thread.is_alive():
+                print("⚠️ กล้องยังค้างอยู่ใน read() — จะปิดเองเมื่อ read() คืนค่า")
+
+    def latest(self):
+        """คืน (frame, timestamp) ของเฟรมล่าสุดที่ยังสดอยู่ หรือ (None, None) ถ้ากล้องไม่พร้อม"""
+        with self._lock:
+            frame, ts = self._frame, self._frame_ts
+        if not self.camera_ok or frame is None:
+            return None, None
+        if self.clock() - ts > self.stale_after:
+            return None, None
+        return frame, ts
+
+    def latest_preview(self):
+        """คืน (ภาพย่อ BGR, timestamp) สำหรับ live preview หรือ (None, None)"""
+        with self._lock:
+            img, ts = self._preview, self._preview_ts
+        if img is None or not self.camera_ok or self.clock() - ts > self.stale_after:
+            return None, None
+        return img, ts
+
+    def pause_preview(self):
+        """หยุดทำ preview ชั่วคราวระหว่าง inference ไม่ให้แย่ง CPU"""
+        self._preview_paused.set()
+
+    def resume_preview(self):
+        self._preview_paused.clear()
+
+    @property
+    def available(self):
+        return self.latest()[0] is not None
+
+    def downtime(self):
+        """เวลารวม (วินาที) ที่กล้องใช้งานไม่ได้ นับรวมช่วงที่กำลังเสียอยู่"""
+        total = self._downtime_total
+        if self._down_since is not None:
+            total += self.clock() - self._down_since
+        return total
+
+    def status_text(self):
+        state = "OK" if self.available else f"ไม่พร้อม ({self.last_error})"
+        return (f"กล้อง: {state} | หลุด {self.outages} ครั้ง | "
+                f"downtime {self.downtime():.1f} s | เปิดใหม่ {self.reopen_attempts} ครั้ง")
+
+    # ---- internal ----
+    def _release(self):
+        cap, self.cap = self.cap, None
+        if cap is not None:
+            try:
+                cap.release()
+            except Exception:
+                pass
+
+    def _mark_down(self, reason):
+        self.last_error = reason
+        with self._lock:
+            self._frame = None
+            self._frame_ts = None
+            self._preview = None
+            self._preview_ts = None
+        if self.camera_ok:
+            self.camera_ok = False
+            self.outages += 1
+            self._down_since = self.clock()
+            print(f"❌ กล้องมีปัญหา: {reason}")
+
+    def _mark_up(self):
+        if not self.camera_ok:
+            if self._down_since is not None:
+                self._downtime_total += self.clock() - self._down_since
+                self._down_since = None
+            self.camera_ok = True
+            self.last_error = ""
+            print("✅ กล้องพร้อมใช้งาน")
+
+    def _open(self):
+        self.reopen_attempts += 1
+        try:
+            cap = self.open_camera()
+        except Exception as e:
+            self.last_error = f"เปิดกล้องไม่ได้: {e}"
+            return False
+        if cap is None or not cap.isOpened():
+            self.last_error = "ไม่พบกล้อง"
+            if cap is not None:
+                cap.release()
+            return False
+        self.cap = cap
+        self._last_hash = None
+        self._same_hash_count = 0
+        return True
+
+    def _frame_hash(self, frame):
+        # hash จากภาพที่ย่อแบบ stride ก็พอจะจับภาพค้างได้ ไม่ต้องแตะทุก pixel
+        return zlib.crc32(frame[::16, ::16].tobytes())
+
+    def _handle_frame(self, frame, ts):
+        """เรียกทุกครั้งที่ได้เฟรมใหม่ (ใน capture thread)"""
+        with self._lock:
+            self._frame = frame
+            self._frame_ts = ts
+        if self.preview_fps and ts >= self._next_preview and not self._preview_paused.is_set():
+            self._make_preview(frame, ts)
+
+    def _make_preview(self, frame, ts):
+        cpu = time.thread_time()
+        small = cv2.resize(frame, self.preview_size, interpolation=cv2.INTER_AREA)
+        cost = time.thread_time() - cpu
+        with self._lock:
+            self._preview = small
+            self._preview_ts = ts
+        # ถ้าการย่อภาพกิน CPU เกินงบ ให้เว้นระยะห่างขึ้นเอง (fps จริงจะต่ำกว่าที่ตั้ง)
+        self._next_preview = ts + max(1.0 / self.preview_fps, cost / self.preview_budget)
+
+    def _run(self):
+        backoff = self.backoff_min
+        while self.running:
+            if self.cap is None:
+                if not self._open():
+                    print(f"❌ {self.last_error} — ลองใหม่ใน {backoff:.1f} วินาที")
+                    self.sleep(backoff)
+                    backoff = min(self.backoff_max, backoff * 2)
+                    continue
+
+            ret, frame = self.cap.read()
+            fault = None
+            if not ret or frame is None:
+                fault = "ไม่สามารถอ่านภาพจากกล้องได้"
+            else:
+                h = self._frame_hash(frame)
+                if h == self._last_hash:
+                    self._same_hash_count += 1
+                    if self._same_hash_count >= self.frozen_after:
+                        fault = "ภาพจากกล้องค้าง"
+            if fault:
+                # ปิดแล้วเปิดใหม่ โดยรอแบบ exponential backoff กันวนเปิด/ปิดถี่เกินไป
+                self._mark_down(fault)
+                self._release()
+                self.sleep(backoff)
+                backoff = min(self.backoff_max, backoff * 2)
+                continue
+            if h != self._last_hash:
+                # เฟรมซ้ำไม่อัปเดต timestamp ทำให้ latest() มองว่าภาพเก่าเองหลัง stale_after
+                self._last_hash = h
+                self._same_hash_count = 0
+                self._handle_frame(frame, self.clock())
+                self._mark_up()
+                backoff = self.backoff_min
+
+            if self.read_interval:
+                self.sleep(self.read_interval)  # ประมาณ 30 FPS
+        self._release()
+
+
+class FakeCapture:
+    """กล้องปลอมสำหรับทดสอบ CameraSupervisor โดยไม่ต้องมีฮาร์ดแวร์
+
+    faults: dict เลขเฟรม -> "fail" (อ่านไม่ได้) หรือ "freeze" (ส่งภาพเดิมซ้ำตั้งแต่เฟรมนั้น)
+    jpeg=True: ถอดรหัส JPEG ทุกเฟรมเหมือนกล้อง MJPEG จริง (ใช้วัดประสิทธิภาพ)
+    """
+
+    def __init__(self, width=64, height=48, faults=None, opened=True, jpeg=False, fps=0):
+        import numpy as np
+        self._np = np
+        self.width = width
+        self.height = height
+        self.faults = dict(faults or {})
+        self.opened = opened
+        self.count = 0
+        self.frozen = None
+        self.fps = fps
+        self._next_read = time.monotonic()
+        self._jpeg = None
+        if jpeg:
+            noise = np.random.default_rng(0).integers(0, 255, (height, width, 3), dtype=np.uint8)
+            noise = cv2.GaussianBlur(noise, (0, 0), 3)
+            self._jpeg = cv2.imencode(".jpg", noise, [cv2.IMWRITE_JPEG_QUALITY, 90])[1]
+
+    def isOpened(self):
+        return self.opened
+
+    def read(self):
+        if not self.opened:
+            return False, None
+        if self.fps:
+            # จำลองกล้องที่ส่งภาพตามจังหวะ fps
+            self._next_read += 1.0 / self.fps
+            time.sleep(max(0.0, self._next_read - time.monotonic()))
+        i = self.count
+        self.count += 1
+        fault = self.faults.get(i)
+        if fault == "fail":
+            return False, None
+        if fault == "freeze" or self.frozen is not None:
+            if self.frozen is None:
+                self.frozen = self._make(i)
+            return True, self.frozen.copy()
+        return True, self._make(i)
+
+    def release(self):
+        self.opened = False
+
+    def _make(self, i):
+        if self._jpeg is not None:
+            frame = cv2.imdecode(self._jpeg, cv2.IMREAD_COLOR)
+            frame[0, 0, 0] = i % 256
+            frame[0, 0, 1] = (i // 256) % 256
+            return frame
+        frame = self._np.zeros((self.height, self.width, 3), dtype=self._np.uint8)
+        frame[:, :, 0] = i % 256
+        frame[:, :, 1] = (i // 256) % 256
+        return frame
+
+
+def self_test():
+    """ตรวจการกู้คืนกล้องด้วย FakeCapture: หลุด/ค้าง/เปิดไม่ได้, backoff และการปิดตอน stop()"""
+    # 1) อ่านไม่ได้ที่เฟรม 20 แล้วภาพค้างที่เฟรม 10 ของกล้องตัวถัดไป: ต้องเปิดใหม่เองทั้งสองครั้ง
+    sources = [FakeCapture(faults={20: "fail"}), FakeCapture(faults={10: "freeze"}), FakeCapture()]
+    opened = []
+
+    def next_source():
+        cap = sources.pop(0) if sources else FakeCapture()
+        opened.append(cap)
+        return cap
+
+    sup = CameraSupervisor(open_camera=next_source, frozen_after=5, backoff_min=0.01, read_interval=0.001)
+    sup.start()
+    deadline = time.monotonic() + 5
+    while (sup.outages < 2 or not sup.available) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert sup.outages == 2, sup.status_text()
+    assert sup.available and len(opened) >= 3, sup.status_text()
+    sup.stop()
+    assert not sup._thread.is_alive() and sup.cap is None
+    assert not any(cap.opened for cap in opened), "กล้องที่เลิกใช้ต้องถูก release"
+
+    # 2) เปิดไม่ได้ติดกัน: รอแบบ exponential backoff ไม่เกิน backoff_max แล้วกลับไปเริ่มที่ backoff_min
+    waits = []
+    sources = [FakeCapture(opened=False) for _ in range(5)] + [FakeCapture(faults={3: "fail"})]
+    sup = CameraSupervisor(open_camera=lambda: sources.pop(0) if sources else FakeCapture(),
+                           backoff_min=0.001, backoff_max=0.004, read_interval=0,
+                           sleep=lambda s: (waits.append(s), time.sleep(s)))
+    sup.start()
+    deadline = time.monotonic() + 5
+    while sup.outages < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    sup.stop()
+    assert waits[:6] == [0.001, 0.002, 0.004, 0.004, 0.004, 0.001], waits[:6]
+    assert sup.reopen_attempts >= 6
+
+    # 3) stop() ระหว่างที่ read() ค้าง: ห้าม release จากนอก thread จนกว่า read() จะคืนค่า
+    gate = threading.Event()
+
+    class BlockingCapture(FakeCapture):
+        def read(self):
+            gate.wait()
+            return super().read()
+
+    cap = BlockingCapture()
+    sup = CameraSupervisor(open_camera=lambda: cap, read_interval=0)
+    sup.start()
+    time.sleep(0.05)
+    sup.stop(timeout=0.05)
+    assert cap.opened, "release ชนกับ read() ที่ยังค้างอยู่"
+    gate.set()
+    sup._thread.join(1.0)
+    assert not cap.opened and sup.cap is None
+    print("CameraSupervisor self-test: OK")
+
+
+if __name__ == "__main__":
+    if "--check" in sys.argv:
+        self_test()
+        sys.exit(0)
+    # จำลองกล้องหลุด 1 ครั้ง และค้าง 1 ครั้ง แล้วดูว่า supervisor กู้คืนเองได้
+    sources = [FakeCapture(faults={20: "fail"}), FakeCapture(faults={10: "freeze"}),
+               FakeCapture(opened=False), FakeCapture()]
+
+    def next_source():
+        return sources.pop(0) if sources else FakeCapture()
+
+    sup = CameraSupervisor(open_camera=next_source, frozen_after=5, backoff_min=0.05,
+                           read_interval=0.005)
+    sup.start()
+    time.sleep(1.5)
+    print(sup.status_text())
+    sup.stop()
@@ -0,0 +1,103 @@
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+from PIL import Image, ImageTk
+
+SCREEN_SIZE = (800, 450)
+
+
+def _new_block_image(mode, size):
+    """PIL image ที่หน่วยความจำเป็นก้อนเดียว ให้ PhotoImage.paste() ส่งเข้า Tk ได้ตรงๆ ไม่ต้องแปลง/จองใหม่"""
+    try:
+        im = Image.Image()._new(Image.core.new_block(mode, size))
+        if im.im.isblock():
+            return im
+    except (AttributeError, TypeError):
+        pass
+    return Image.new(mode, size)
+
+
+class DisplaySurface:
+    """พื้นที่แสดงภาพขนาดคงที่ จอง buffer/PhotoImage ครั้งเดียวแล้วเขียนทับทุกเฟรม
+
+    ใช้แทนการสร้าง Image.fromarray + ImageTk.PhotoImage ใหม่ทุกครั้ง
+    ต้องสร้างหลังจากมี tk.Tk() แล้ว
+    """
+
+    def __init__(self, width=SCREEN_SIZE[0], height=SCREEN_SIZE[1]):
+        self.size = (width, height)
+        # buffer ขนาดจอ (BGR ตาม OpenCV) ใช้วาด overlay ที่ความละเอียดจอได้ด้วย
+        self.buffer = np.zeros((height, width, 3), dtype=np.uint8)
+        self._pil = _new_block_image("RGB", self.size)
+        self.photo = ImageTk.PhotoImage("RGB", self.size)
+
+    def fill(self, frame_bgr):
+        """ย่อ/คัดลอกเฟรมลง buffer เดิม คืนค่า (scale_x, scale_y) จากพิกัดเฟรมไปพิกัดจอ"""
+        h, w = frame_bgr.shape[:2]
+        if (w, h) == self.size:
+            np.copyto(self.buffer, frame_bgr)
+        else:
+            cv2.resize(frame_bgr, self.size, dst=self.buffer, interpolation=cv2.INTER_AREA)
+        return self.size[0] / w, self.size[1] / h
+
+    def present(self):
+        """ส่ง buffer ขึ้นจอ: raw decoder สลับ BGR->RGB ระหว่างคัดลอกเข้า PIL image เดิม"""
+        self._pil.frombytes(self.buffer, "raw", "BGR")
+        self.photo.paste(self._pil)
+        return self.photo
+
+    def show(self, frame_bgr):
+        self.fill(frame_bgr)
+        return self.present()
+
+
+def _legacy_update(frame):
+    # เส้นทางเดิมใน check(): resize -> cvtColor -> fromarray -> PhotoImage ใหม่ทุกครั้ง
+    small = cv2.resize(frame, SCREEN_SIZE)
+    small = cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
+    return ImageTk.PhotoImage(image=Image.fromarray(small))
+
+
+def benchmark(n=200, src_size=(1920, 1080)):
+    """เทียบเวลาและหน่วยความจำที่จองต่อการอัปเดตภาพ ระหว่างแบบเดิมกับ DisplaySurface"""
+    import resource
+    import tkinter as tk
+
+    root = tk.Tk()
+    root.withdraw()
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 255, (src_size[1], src_size[0], 3), dtype=np.uint8)
+    surface = DisplaySurface()
+    label = tk.Label(root)
+
+    def run(name, update):
+        times = []
+        peaks = []
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        tracemalloc.start()
+        for _ in range(n):
+            base = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            t = time.perf_counter()
+            photo = update(frame)
+            label.config(image=photo)
+            label.image = photo
+            root.update_idletasks()
+            times.append(time.perf_counter() - t)
+            peaks.append(tracemalloc.get_traced_memory()[1] - base)
+        tracemalloc.stop()
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        times.sort()
+        print(f"{name:<16} mean {1000 * sum(times) / n:6.2f} ms  p95 {1000 * times[int(0.95 * n)]:6.2f} ms  "
+              f"จองชั่วคราว/ครั้ง {sum(peaks) / n / 1024:8.1f} KiB  maxrss +{(rss_after - rss_before) / 1024:.1f} MiB")
+
+    # แบบใหม่ก่อน เพราะ maxrss เป็นค่าสูงสุดสะสม
+    run("DisplaySurface", surface.show)
+    run("เดิม (new Photo)", _legacy_update)
+    root.destroy()
+
+
+if __name__ == "__main__":
+    benchmark()
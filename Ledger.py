@@ -0,0 +1,206 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from datetime import datetime
+
+import cv2
+
+LEDGER_PATH = './ledger/ledger.db'
+EVIDENCE_DIR = './ledger/evidence'
+
+BIN_NAMES = {
+    0: "Bottle Cap",
+    1: "Plastic Waste",
+    2: "General Waste",
+    3: "Glass/Metal Waste",
+    4: "ERROR",
+    5: "Camera unavailable",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    bin INTEGER NOT NULL,
+    classes TEXT NOT NULL,
+    confidences TEXT NOT NULL,
+    latency TEXT NOT NULL,
+    image_path TEXT
+);
+CREATE INDEX IF NOT EXISTS items_ts ON items(ts);
+CREATE INDEX IF NOT EXISTS items_bin_ts ON items(bin, ts);
+CREATE TABLE IF NOT EXISTS bin_emptied (
+    bin INTEGER NOT NULL,
+    ts REAL NOT NULL
+);
+"""
+
+
+class DecisionLedger:
+    """บันทึกทุกชิ้นที่คัดแยกแล้วลง SQLite (append-only) ผ่าน thread เขียนแยก
+
+    record() แค่ใส่คิวแล้วคืนทันที ตัวคัดแยกไม่ต้องรอ SD card
+    thread เขียนรวบหลายรายการเป็น transaction เดียว (WAL mode)
+    ภาพหลักฐานที่รอเขียนจำกัดไว้ max_images ภาพ (เฟรม 1080p ~6 MB) ถ้า SD card ค้าง
+    รายการใหม่ยังถูกบันทึกแต่ไม่มีภาพ แทนที่จะกินแรมจนเครื่องล่ม
+    """
+
+    def __init__(self, path=LEDGER_PATH, evidence_dir=EVIDENCE_DIR,
+                 batch_size=50, flush_interval=2.0, max_queue=1000, max_images=20):
+        self.path = path
+        self.evidence_dir = evidence_dir
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self.dropped_images = 0
+        self._image_slots = threading.BoundedSemaphore(max_images)
+        self._seq = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if evidence_dir:
+            os.makedirs(evidence_dir, exist_ok=True)
+        with closing(self._connect()) as con:
+            con.executescript(SCHEMA)
+        self._thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self._thread.start()
+
+    def _connect(self):
+        con = sqlite3.connect(self.path, timeout=10)
+        con.execute("PRAGMA journal_mode=WAL")
+        # NORMAL พอสำหรับ WAL: ไฟดับอาจเสีย batch สุดท้าย แต่ฐานข้อมูลไม่พัง
+        con.execute("PRAGMA synchronous=NORMAL")
+        return con
+
+    # ---- ฝั่งคัดแยก (ต้องไม่ block) ----
+    def record(self, bin_id, detections, latency, image=None, ts=None):
+        """detections: list ของ (class_name, confidence), latency: dict ชื่อขั้นตอน -> ms"""
+        if image is not None and not (self.evidence_dir and self._image_slots.acquire(blocking=False)):
+            if self.evidence_dir:
+                self.dropped_images += 1
+            image = None
+        item = (ts or time.time(), int(bin_id), list(detections), dict(latency), image)
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+            if image is not None:
+                self._image_slots.release()
+
+    def mark_emptied(self, bin_id, ts=None):
+        """เรียกเมื่อเทถังแล้ว ใช้เป็นจุดเริ่มนับ fill estimate ใหม่"""
+        with closing(self._connect()) as con, con:
+            con.execute("INSERT INTO bin_emptied(bin, ts) VALUES (?, ?)", (int(bin_id), ts or time.time()))
+
+    def close(self, timeout=5.0):
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    # ---- thread เขียน ----
+    def _writer_loop(self):
+        con = self._connect()
+        pending = []
+        last_flush = time.monotonic()
+        stop = False
+        while not stop:
+            wait = max(0.05, self.flush_interval - (time.monotonic() - last_flush))
+            try:
+                item = self._queue.get(timeout=wait)
+                if item is None:
+                    stop = True
+                else:
+                    pending.append(self._to_row(item))
+            except queue.Empty:
+                pass
+            if pending and (stop or len(pending) >= self.batch_size
+                            or time.monotonic() - last_flush >= self.flush_interval):
+                try:
+                    with con:
+                        con.executemany(
+                            "INSERT INTO items(ts, bin, classes, confidences, latency, image_path) "
+                            "VALUES (?, ?, ?, ?, ?, ?)", pending)
+                except sqlite3.Error as e:
+                    print(f"❌ เขียน ledger ไม่สำเร็จ: {e}")
+                pending = []
+                last_flush = time.monotonic()
+        con.close()
+
+    def _to_row(self, item):
+        ts, bin_id, detections, latency, image = item
+        image_path = None
+        if image is not None:
+            # เขียนภาพหลักฐานใน thread นี้ ไม่ใช่ใน check()
+            try:
+                day = datetime.fromtimestamp(ts).strftime("%Y%m%d")
+                folder = os.path.join(self.evidence_dir, day)
+                os.makedirs(folder, exist_ok=True)
+                self._seq += 1
+                name = datetime.fromtimestamp(ts).strftime("%H%M%S_%f")[:-3] + f"_{self._seq}_bin{bin_id}.jpg"
+                image_path = os.path.join(folder, name)
+                if not cv2.imwrite(image_path, image):
+                    image_path = None
+            except (OSError, cv2.error) as e:
+                print(f"❌ เขียนภาพหลักฐานไม่สำเร็จ: {e}")
+                image_path = None
+            finally:
+                self._image_slots.release()
+        classes = [c for c, _ in detections]
+        confidences = [round(float(p), 3) for _, p in detections]
+        latency = {k: round(float(v), 1) for k, v in latency.items()}
+        return (ts, bin_id, json.dumps(classes, ensure_ascii=False), json.dumps(confidences),
+                json.dumps(latency), image_path)
+
+    # ---- query helpers (เปิด connection ใหม่ อ่านพร้อมกับ writer ได้เพราะเป็น WAL) ----
+    def bin_counts(self, since=None):
+        sql = "SELECT bin, COUNT(*) FROM items"
+        args = ()
+        if since is not None:
+            sql += " WHERE ts >= ?"
+            args = (since,)
+        with closing(self._connect()) as con:
+            return dict(con.execute(sql + " GROUP BY bin", args).fetchall())
+
+    def fill_estimates(self, capacity):
+        """capacity: dict bin -> จำนวนชิ้นที่ถังรับได้ คืน dict bin -> (จำนวนตั้งแต่เทล่าสุด, สัดส่วน 0..1)"""
+        out = {}
+        with closing(self._connect()) as con:
+            for bin_id, cap in capacity.items():
+                row = con.execute("SELECT MAX(ts) FROM bin_emptied WHERE bin = ?", (bin_id,)).fetchone()
+                since = row[0] or 0.0
+                n = con.execute("SELECT COUNT(*) FROM items WHERE bin = ? AND ts > ?",
+                                (bin_id, since)).fetchone()[0]
+                out[bin_id] = (n, min(1.0, n / cap) if cap else 0.0)
+        return out
+
+    def hourly_throughput(self, hours=24, now=None):
+        """คืน list ของ (เวลาเริ่มชั่วโมง, จำนวนชิ้น) ย้อนหลัง `hours` ชั่วโมง"""
+        now = now or time.time()
+        start = (int(now) // 3600 - hours + 1) * 3600
+        with closing(self._connect()) as con:
+            rows = dict(con.execute(
+                "SELECT CAST(ts / 3600 AS INTEGER) * 3600 AS h, COUNT(*) FROM items "
+                "WHERE ts >= ? GROUP BY h", (start,)).fetchall())
+        return [(datetime.fromtimestamp(h), rows.get(h, 0)) for h in range(start, start + hours * 3600, 3600)]
+
+    def latency_summary(self, last=200):
+        """ค่าเฉลี่ย latency แต่ละขั้นตอนของ `last` รายการล่าสุด"""
+        with closing(self._connect()) as con:
+            rows = con.execute("SELECT latency FROM items ORDER BY id DESC LIMIT ?", (last,)).fetchall()
+        sums = {}
+        for (raw,) in rows:
+            for k, v in json.loads(raw).items():
+                sums[k] = sums.get(k, 0.0) + v
+        return {k: v / len(rows) for k, v in sums.items()} if rows else {}
+
+
+if __name__ == "__main__":
+    ledger = DecisionLedger()
+    print("ต่อถัง:", {BIN_NAMES.get(k, k): v for k, v in ledger.bin_counts().items()})
+    print("ความจุ:", ledger.fill_estimates({1: 200, 2: 200, 3: 150}))
+    for hour, n in ledger.hourly_throughput(hours=12):
+        print(f"{hour:%Y-%m-%d %H:00}  {n}")
+    print("latency เฉลี่ย (ms):", ledger.latency_summary())
+    ledger.close()
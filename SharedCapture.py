@@ -0,0 +1,346 @@
+import os
+import subprocess
+import sys
+import time
+
+import cv2
+import numpy as np
+from multiprocessing import shared_memory
+
+from CameraSupervisor import CameraSupervisor, FakeCapture, open_usb_camera
+
+# ตำแหน่งใน ctrl (int64) ที่อยู่ต้น shared memory
+NEWEST = 0          # slot ล่าสุดที่เขียนเสร็จ (-1 = ยังไม่มี)
+RUNNING = 1         # ฝั่งหลักตั้งเป็น 0 เพื่อสั่งให้ process กล้องปิดตัว
+CAMERA_OK = 2
+OUTAGES = 3
+REOPENS = 4
+DOWNTIME_MS = 5
+PREVIEW_PAUSED = 6
+PINNED = 7          # slot ที่ฝั่งหลักกำลังใช้อยู่ ห้ามเขียนทับ
+PREVIEW_IDX = 8     # buffer preview ล่าสุด (-1 = ยังไม่มี)
+HEARTBEAT_MS = 9
+FRAMES = 10         # จำนวนเฟรมที่ส่งออกมาแล้ว
+CTRL_LEN = 16
+
+
+class FrameRing:
+    """ring ของเฟรมใน multiprocessing.shared_memory พร้อม header seq/timestamp ต่อ slot
+
+    ผู้เขียน (process กล้อง) เขียน slot ถัดไปเสมอ ไม่เขียน slot ล่าสุดและ slot ที่ถูก pin
+    ผู้อ่านจึงใช้ view ของ slot ล่าสุดได้เลยโดยไม่ต้องคัดลอก
+    มี PINNED ช่องเดียว: ผู้อ่านได้ทีละคนเท่านั้น ถ้าสองคนเรียก newest() สลับกัน
+    เฟรมของคนแรกจะถูกปลด pin และอาจถูกเขียนทับระหว่างใช้งาน
+    """
+
+    def __init__(self, shm, width, height, preview_size, slots):
+        self.shm = shm
+        self.width, self.height = width, height
+        self.preview_size = preview_size
+        self.slots = slots
+        buf = shm.buf
+        off = 0
+        self.ctrl = np.ndarray((CTRL_LEN,), np.int64, buf, off)
+        off += self.ctrl.nbytes
+        self.seq = np.ndarray((slots,), np.int64, buf, off)
+        off += self.seq.nbytes
+        self.ts = np.ndarray((slots,), np.float64, buf, off)
+        off += self.ts.nbytes
+        self.preview_ts = np.ndarray((2,), np.float64, buf, off)
+        off += self.preview_ts.nbytes
+        self.frames = np.ndarray((slots, height, width, 3), np.uint8, buf, off)
+        off += self.frames.nbytes
+        pw, ph = preview_size
+        self.previews = np.ndarray((2, ph, pw, 3), np.uint8, buf, off)
+        self._counter = 0
+
+    @staticmethod
+    def nbytes(width, height, preview_size, slots):
+        pw, ph = preview_size
+        return 8 * (CTRL_LEN + 2 * slots + 2) + slots * width * height * 3 + 2 * pw * ph * 3
+
+    @classmethod
+    def create(cls, width, height, preview_size, slots=4):
+        shm = shared_memory.SharedMemory(create=True, size=cls.nbytes(width, height, preview_size, slots))
+        ring = cls(shm, width, height, preview_size, slots)
+        ring.ctrl[:] = 0
+        ring.ctrl[NEWEST] = -1
+        ring.ctrl[PINNED] = -1
+        ring.ctrl[PREVIEW_IDX] = -1
+        ring.ctrl[RUNNING] = 1
+        ring.seq[:] = 0
+        return ring
+
+    @classmethod
+    def attach(cls, name, width, height, preview_size, slots=4):
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+        except TypeError:
+            shm = shared_memory.SharedMemory(name=name)
+            # ให้ฝั่งที่สร้างเป็นคน unlink ไม่ใช่ resource tracker ของ process ลูก
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return cls(shm, width, height, preview_size, slots)
+
+    # ---- ฝั่งเขียน (process กล้อง) ----
+    def publish_frame(self, frame, ts):
+        newest = int(self.ctrl[NEWEST])
+        pinned = int(self.ctrl[PINNED])
+        slot = (newest + 1) % self.slots
+        while slot == pinned:
+            slot = (slot + 1) % self.slots
+        self.seq[slot] = -1  # กำลังเขียน
+        h, w = frame.shape[:2]
+        if (w, h) == (self.width, self.height):
+            np.copyto(self.frames[slot], frame)
+        else:
+            cv2.resize(frame, (self.width, self.height), dst=self.frames[slot], interpolation=cv2.INTER_AREA)
+        self._counter += 1
+        self.ts[slot] = ts
+        self.seq[slot] = self._counter
+        self.ctrl[NEWEST] = slot
+        self.ctrl[FRAMES] = self._counter
+
+    def publish_preview(self, img, ts):
+        idx = 1 - max(0, int(self.ctrl[PREVIEW_IDX]))
+        np.copyto(self.previews[idx], img)
+        self.preview_ts[idx] = ts
+        self.ctrl[PREVIEW_IDX] = idx
+
+    # ---- ฝั่งอ่าน (process หลัก) ----
+    def newest(self):
+        """pin slot ล่าสุดแล้วคืน (view, seq, ts) โดยไม่คัดลอก หรือ (None, 0, None)"""
+        for _ in range(3):
+            slot = int(self.ctrl[NEWEST])
+            if slot < 0:
+                return None, 0, None
+            self.ctrl[PINNED] = slot
+            seq = int(self.seq[slot])
+            if seq > 0:
+                return self.frames[slot], seq, float(self.ts[slot])
+        return None, 0, None
+
+    def close(self, unlink=False):
+        # ปล่อย view ทั้งหมดก่อน ไม่งั้น shm.close() จะ error เพราะยังมี buffer export อยู่
+        self.ctrl = self.seq = self.ts = self.preview_ts = self.frames = self.previews = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+class _PublishingSupervisor(CameraSupervisor):
+    """CameraSupervisor ที่ส่งทุกเฟรม/preview เข้า FrameRing (ทำงานใน process กล้อง)"""
+
+    def __init__(self, ring, **kwargs):
+        super().__init__(**kwargs)
+        self.ring = ring
+
+    def _handle_frame(self, frame, ts):
+        self.ring.publish_frame(frame, ts)
+        if self.ring.ctrl[PREVIEW_PAUSED]:
+            self._preview_paused.set()
+        else:
+            self._preview_paused.clear()
+        super()._handle_frame(frame, ts)
+
+    def _make_preview(self, frame, ts):
+        super()._make_preview(frame, ts)
+        self.ring.publish_preview(self._preview, ts)
+
+    # สถานะกล้องส่งทันทีที่เปลี่ยน ไม่รอ loop ใน _serve (ฝั่งหลักต้องปฏิเสธเฟรมทันทีที่กล้องเสีย)
+    def _mark_down(self, reason):
+        self.ring.ctrl[CAMERA_OK] = 0
+        super()._mark_down(reason)
+
+    def _mark_up(self):
+        super()._mark_up()
+        self.ring.ctrl[CAMERA_OK] = 1
+
+
+def _serve(name, index, width, height, preview_fps, pw, ph, budget, slots, fake):
+    """main ของ process กล้อง"""
+    ring = FrameRing.attach(name, width, height, (pw, ph), slots)
+    if fake:
+        open_camera = lambda: FakeCapture(width, height, jpeg=True, fps=30)
+    else:
+        open_camera = lambda: open_usb_camera(index, width, height)
+    sup = _PublishingSupervisor(ring, open_camera=open_camera, preview_fps=preview_fps,
+                                preview_size=(pw, ph), preview_budget=budget,
+                                read_interval=0 if fake else 0.03)
+    parent = os.getppid()
+    sup.start()
+    try:
+        while ring.ctrl[RUNNING] and os.getppid() == parent:
+            ring.ctrl[CAMERA_OK] = int(sup.camera_ok)
+            ring.ctrl[OUTAGES] = sup.outages
+            ring.ctrl[REOPENS] = sup.reopen_attempts
+            ring.ctrl[DOWNTIME_MS] = int(sup.downtime() * 1000)
+            ring.ctrl[HEARTBEAT_MS] = int(time.monotonic() * 1000)
+            time.sleep(0.05)
+    finally:
+        sup.stop()
+        ring.close()
+
+
+class SharedCameraSource:
+    """แทน CameraSupervisor ได้ทันที แต่อ่าน/ถอดรหัสกล้องใน process แยก (ไม่แย่ง GIL กับ inference/Tk)
+
+    latest() คืน view ของเฟรมใน shared memory (ไม่คัดลอก) และ slot นั้นจะไม่ถูกเขียนทับ
+    จนกว่าจะเรียก latest() ครั้งถัดไป ถ้าจะวาดทับภาพต้อง copy() เอง
+    pin มีช่องเดียว: ต้องมีผู้เรียก latest() ได้ทีละคน (check() ห้ามรันซ้อนกันจากสอง thread)
+    """
+
+    def __init__(self, index=0, width=1920, height=1080, stale_after=2.0, preview_fps=0,
+                 preview_size=(320, 180), preview_budget=0.05, slots=4, fake=False):
+        self.index = index
+        self.width, self.height = width, height
+        self.stale_after = stale_after
+        self.preview_fps = preview_fps
+        self.preview_size = preview_size
+        self.preview_budget = preview_budget
+        self.slots = slots
+        self.fake = fake
+        self.ring = None
+        self._proc = None
+        self.restarts = 0
+
+    def start(self):
+        if self.ring is None:
+            self.ring = FrameRing.create(self.width, self.height, self.preview_size, self.slots)
+        self.ring.ctrl[RUNNING] = 1
+        pw, ph = self.preview_size
+        args = [sys.executable, os.path.abspath(__file__), "--serve", self.ring.shm.name, str(self.index),
+                str(self.width), str(self.height), str(self.preview_fps), str(pw), str(ph),
+                str(self.preview_budget), str(self.slots), "1" if self.fake else "0"]
+        self._proc = subprocess.Popen(args)
+
+    def stop(self, timeout=3.0):
+        if self.ring is None:
+            return
+        self.ring.ctrl[RUNNING] = 0
+        if self._proc is not None:
+            try:
+                self._proc.wait(timeout)
+            except subprocess.TimeoutExpired:
+                self._proc.kill()
+        self.ring.close(unlink=True)
+        self.ring = None
+
+    def _ensure_alive(self):
+        # process กล้องตายเอง (เช่น driver crash) ให้เปิดใหม่
+        if self._proc is not None and self._proc.poll() is not None and self.ring is not None:
+            print("❌ process กล้องหยุดทำงาน — เปิดใหม่")
+            self.restarts += 1
+            self.ring.ctrl[CAMERA_OK] = 0
+            self.start()
+
+    def latest(self):
+        if self.ring is None:
+            return None, None
+        self._ensure_alive()
+        if not self.ring.ctrl[CAMERA_OK]:
+            # เหมือน CameraSupervisor: กล้องเสียแล้วไม่คืนเฟรมสุดท้าย แม้จะยังไม่เกิน stale_after
+            return None, None
+        frame, seq, ts = self.ring.newest()
+        if frame is None or time.monotonic() - ts > self.stale_after:
+            return None, None
+        return frame, ts
+
+    def latest_preview(self):
+        if self.ring is None:
+            return None, None
+        idx = int(self.ring.ctrl[PREVIEW_IDX])
+        if idx < 0 or not self.ring.ctrl[CAMERA_OK]:
+            return None, None
+        ts = float(self.ring.preview_ts[idx])
+        if time.monotonic() - ts > self.stale_after:
+            return None, None
+        return self.ring.previews[idx], ts
+
+    def pause_preview(self):
+        if self.ring is not None:
+            self.ring.ctrl[PREVIEW_PAUSED] = 1
+
+    def resume_preview(self):
+        if self.ring is not None:
+            self.ring.ctrl[PREVIEW_PAUSED] = 0
+
+    @property
+    def camera_ok(self):
+        return self.ring is not None and bool(self.ring.ctrl[CAMERA_OK])
+
+    @property
+    def available(self):
+        # ดูแค่ความสดของ slot ล่าสุด ไม่ pin (ไม่ไปปลด pin ของเฟรมที่ check() ใช้อยู่)
+        if self.ring is None or not self.ring.ctrl[CAMERA_OK]:
+            return False
+        slot = int(self.ring.ctrl[NEWEST])
+        return slot >= 0 and time.monotonic() - float(self.ring.ts[slot]) <= self.stale_after
+
+    def frames_published(self):
+        return int(self.ring.ctrl[FRAMES]) if self.ring is not None else 0
+
+    def downtime(self):
+        return self.ring.ctrl[DOWNTIME_MS] / 1000.0 if self.ring is not None else 0.0
+
+    def status_text(self):
+        if self.ring is None:
+            return "กล้อง: ปิดอยู่"
+        state = "OK" if self.available else "ไม่พร้อม"
+        return (f"กล้อง (process แยก): {state} | หลุด {int(self.ring.ctrl[OUTAGES])} ครั้ง | "
+                f"downtime {self.downtime():.1f} s | เปิดใหม่ {int(self.ring.ctrl[REOPENS])} ครั้ง | "
+                f"process เริ่มใหม่ {self.restarts} ครั้ง")
+
+
+def benchmark(model_path="./model/All.pt", n=30, fake=True):
+    """วัด latency ตั้งแต่ trigger จนได้ผลตัดสิน ขณะ inference รันต่อเนื่อง เทียบกล้องแบบ thread กับ process แยก"""
+    from ultralytics import YOLO
+
+    model = YOLO(model_path)
+    if fake:
+        open_camera = lambda: FakeCapture(1920, 1080, jpeg=True, fps=30)
+    else:
+        open_camera = lambda: open_usb_camera(0, 1920, 1080)
+    sources = [
+        ("thread", CameraSupervisor(open_camera=open_camera, read_interval=0 if fake else 0.03)),
+        ("process", SharedCameraSource(fake=fake)),
+    ]
+    for name, source in sources:
+        source.start()
+        deadline = time.monotonic() + 15
+        while not source.available and time.monotonic() < deadline:
+            time.sleep(0.1)
+        frame, _ = source.latest()
+        if frame is None:
+            print(f"{name}: กล้องไม่พร้อม ข้ามการวัด")
+            source.stop()
+            continue
+        model(frame, verbose=False)  # warm up
+        lat, ages = [], []
+        start = time.monotonic()
+        for _ in range(n):
+            # trigger ติดกันแบบไม่พัก = inference เต็มกำลังตลอดการวัด
+            t0 = time.monotonic()
+            frame, ts = source.latest()
+            if frame is None:
+                continue
+            model(frame, conf=0.7, verbose=False)
+            frame.copy()  # สำเนาสำหรับวาดกรอบ/ภาพหลักฐานเหมือน check()
+            lat.append(time.monotonic() - t0)
+            ages.append(t0 - ts)
+        elapsed = time.monotonic() - start
+        lat.sort()
+        print(f"{name:<8} trigger->decision mean {1000 * sum(lat) / len(lat):7.1f} ms  "
+              f"p95 {1000 * lat[int(0.95 * (len(lat) - 1))]:7.1f} ms  "
+              f"อายุเฟรม {1000 * sum(ages) / len(ages):6.1f} ms  inference {len(lat) / elapsed:.2f}/s")
+        source.stop()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--serve":
+        a = sys.argv[2:]
+        _serve(a[0], int(a[1]), int(a[2]), int(a[3]), float(a[4]), int(a[5]), int(a[6]),
+               float(a[7]), int(a[8]), a[9] == "1")
+    else:
+        model_path = sys.argv[1] if len(sys.argv) > 1 else "./model/All.pt"
+        benchmark(model_path, fake="--camera" not in sys.argv)
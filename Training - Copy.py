@@ -5,18 +5,26 @@ import sys
 import time
 import json
 import math
-import glob
 import shutil
 import threading
+import multiprocessing
 import queue
 import csv
+import zlib
+import base64
+import hashlib
+import sqlite3
+from contextlib import closing
 from datetime import datetime
-from collections import defaultdict, deque
+from collections import OrderedDict, defaultdict, deque
+from collections.abc import MutableMapping
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import numpy as np
 from PIL import Image, ImageTk, ImageOps, ImageDraw
 import cv2
 import customtkinter as ctk
+import tkinter as tk
 from tkinter import filedialog, messagebox
 
 # Optional (used when training/testing)
@@ -34,13 +42,18 @@ import matplotlib.pyplot as plt
 # ---------- Helper utilities ----------
 APP_ROOT = os.path.abspath(os.path.dirname(__file__))
 PROJECTS_DIR = os.path.join(APP_ROOT, "projects")
+STAGING_DIR = os.path.join(PROJECTS_DIR, ".staging")  # ภาพที่ถ่ายแล้วแต่ยังไม่บันทึกเป็นโปรเจกต์
+STAGED_SOURCES_NAME = "staged_sources.json"  # ใน save_*: ภาพไหนย้ายมาจาก session ไหน (ใช้ย้ายกลับตอนกู้คืน)
 EXPORTS_DIR = os.path.join(APP_ROOT, "exports")
 RUNS_DIR = os.path.join(APP_ROOT, "runs")
 LOGS_DIR = os.path.join(APP_ROOT, "logs")
+CACHE_DIR = os.path.join(APP_ROOT, "cache")  # ข้อมูลที่สร้างใหม่ได้เสมอ ลบทิ้งได้
+CAMERA_CAPS_PATH = os.path.join(CACHE_DIR, "camera_caps.json")
 
 os.makedirs(PROJECTS_DIR, exist_ok=True)
 os.makedirs(EXPORTS_DIR, exist_ok=True)
 os.makedirs(LOGS_DIR, exist_ok=True)
+os.makedirs(CACHE_DIR, exist_ok=True)
 
 def safe_filename(name: str) -> str:
     return "".join(ch for ch in name if ch.isalnum() or ch in (" ", "_", "-", ".")).rstrip()
@@ -48,6 +61,15 @@ def safe_filename(name: str) -> str:
 def now_str():
     return datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
 
+def process_pool(workers=None):
+    """ProcessPoolExecutor แบบ spawn (เหมือนบน Windows)
+
+    ห้าม fork จาก process ของ Tk: ตอนนั้นมี thread ของ prefetch/thumbnail/journal ทำงานอยู่
+    และ thread pool ของ OpenCV ถูกใช้ไปแล้ว process ลูกที่ fork ออกมาอาจค้างใน cv2
+    """
+    return ProcessPoolExecutor(max_workers=workers or max(1, (os.cpu_count() or 2) - 1),
+                               mp_context=multiprocessing.get_context("spawn"))
+
 def pil_to_ctk_image(pil_img, size=None):
     if size:
         pil_img = pil_img.copy()
@@ -75,24 +97,52 @@ def rescale_points(pts, old_w, old_h, new_w, new_h):
     sy = new_h / max(1, old_h)
     return [(int(x * sx), int(y * sy)) for x, y in pts]
 
-def mask_to_polygons(mask):
+# ระดับการลดจุด polygon ตอน export: (IoU ขั้นต่ำเทียบกับ contour เดิม, พื้นที่ขั้นต่ำเป็น pixel)
+SIMPLIFY_PRESETS = {"ไม่ลด": (None, 0), "ละเอียด": (0.995, 4), "ปกติ": (0.98, 16), "หยาบ": (0.95, 64)}
+
+def _contour_iou(cnt, approx):
+    # IoU ของพื้นที่ภายใน 2 polygon วาดบน canvas เท่ากรอบของ contour
+    x, y, w, h = cv2.boundingRect(cnt)
+    a = np.zeros((h + 2, w + 2), np.uint8)
+    b = np.zeros_like(a)
+    cv2.fillPoly(a, [cnt - (x - 1, y - 1)], 1)
+    cv2.fillPoly(b, [approx - (x - 1, y - 1)], 1)
+    inter = np.count_nonzero(a & b)
+    return inter / max(1, np.count_nonzero(a | b))
+
+def simplify_contour(cnt, min_iou=0.98, steps=7):
+    """Douglas-Peucker (approxPolyDP) โดยหา epsilon ที่ใหญ่ที่สุดที่ IoU ยังไม่ต่ำกว่า min_iou (binary search)"""
+    if min_iou is None or len(cnt) <= 4:
+        return cnt
+    lo, hi = 0.0, 0.02 * cv2.arcLength(cnt, True)
+    best = cnt
+    for _ in range(steps):
+        eps = (lo + hi) / 2
+        approx = cv2.approxPolyDP(cnt, eps, True)
+        if len(approx) >= 3 and _contour_iou(cnt, approx) >= min_iou:
+            best, lo = approx, eps
+        else:
+            hi = eps
+    return best
+
+def mask_to_polygons(mask, min_iou=None, min_area=0):
     # mask: HxW, values 0 or 255
-    # returns list of polygons (each polygon is list of (x,y))
+    # returns list of polygons (each polygon is Nx2 int array of x,y)
+    # min_iou: ลดจุดด้วย simplify_contour, min_area: ตัด contour ที่เล็กกว่านี้ (pixel) ทิ้ง
     contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     polys = []
     for cnt in contours:
-        if len(cnt) >= 3:
-            poly = [(int(p[0][0]), int(p[0][1])) for p in cnt]
-            polys.append(poly)
+        if len(cnt) < 3 or (min_area and cv2.contourArea(cnt) < min_area):
+            continue
+        polys.append(simplify_contour(cnt, min_iou).reshape(-1, 2))
     return polys
 
 def normalize_polygon(poly, w, h):
     # YOLO segment expects x1 y1 x2 y2 ... normalized (0-1)
-    flat = []
-    for x, y in poly:
-        flat.append(str(round(x / w, 6)))
-        flat.append(str(round(y / h, 6)))
-    return flat
+    # คำนวณ/จัดรูปแบบทั้ง polygon ด้วย numpy ทีเดียว (ตัด 0 ท้ายทศนิยมเหมือน str(round(v, 6)))
+    pts = np.asarray(poly, dtype=np.float64).reshape(-1, 2) / (w, h)
+    text = np.char.mod("%.6f", np.clip(pts, 0.0, 1.0).ravel())
+    return list(np.char.rstrip(np.char.rstrip(text, "0"), "."))
 
 def draw_boxes_on_pil(pil_img, boxes, color=(0,255,0), width=2):
     img = pil_img.copy()
@@ -164,15 +214,234 @@ RESOLUTIONS = {
     "320x240": (320, 240)
 }
 
-def get_max_resolution(cap):
+# ---------- Camera capability probe ----------
+# โหมดที่กล้องรองรับ (fourcc + ขนาด) อ่านครั้งเดียวต่อกล้องแล้วเก็บใน CAMERA_CAPS_PATH
+# เปิดครั้งต่อไปเลือกโหมดได้ทันที ไม่ต้องลอง cap.set ทีละขนาด (ครั้งละหลายร้อย ms)
+
+def camera_backend():
+    # CAP_DSHOW ใช้ได้เฉพาะ Windows
+    if sys.platform.startswith("win"):
+        return cv2.CAP_DSHOW
+    if sys.platform.startswith("linux"):
+        return cv2.CAP_V4L2
+    if sys.platform == "darwin":
+        return cv2.CAP_AVFOUNDATION
+    return cv2.CAP_ANY
+
+def camera_identity(index):
+    """key ของกล้องใน cache: บน Linux ใช้ชื่อ + ตำแหน่งพอร์ต USB จาก sysfs"""
+    sysfs = f"/sys/class/video4linux/video{index}"
+    if os.path.isdir(sysfs):
+        try:
+            with open(os.path.join(sysfs, "name"), encoding="utf-8") as f:
+                name = f.read().strip()
+        except OSError:
+            name = "?"
+        return f"v4l2:{name}@{os.path.realpath(os.path.join(sysfs, 'device'))}"
+    return f"{sys.platform}:{index}"
+
+# ioctl ของ V4L2 (linux/videodev2.h): _IOWR('V', nr, sizeof(struct))
+_V4L2_BUF_TYPE_VIDEO_CAPTURE = 1
+_V4L2_FMTDESC = "<III32sII3I"         # struct v4l2_fmtdesc (64 bytes)
+_V4L2_FRMSIZEENUM = "<III6I2I"        # struct v4l2_frmsizeenum (44 bytes)
+
+def _iowr(nr, size):
+    return (3 << 30) | (size << 16) | (ord("V") << 8) | nr
+
+def v4l2_modes(index):
+    """อ่านรายการ fourcc/ขนาดภาพจาก driver โดยตรง ไม่ต้องเปิด stream"""
+    import fcntl
+    import struct
+    enum_fmt = _iowr(2, struct.calcsize(_V4L2_FMTDESC))
+    enum_sizes = _iowr(74, struct.calcsize(_V4L2_FRMSIZEENUM))
+    modes = []
+    fd = os.open(f"/dev/video{index}", os.O_RDWR | os.O_NONBLOCK)
+    try:
+        for i in range(64):
+            buf = bytearray(struct.pack(_V4L2_FMTDESC, i, _V4L2_BUF_TYPE_VIDEO_CAPTURE, 0, b"", 0, 0, 0, 0, 0))
+            try:
+                fcntl.ioctl(fd, enum_fmt, buf)
+            except OSError:
+                break
+            pixfmt = struct.unpack(_V4L2_FMTDESC, buf)[4]
+            fourcc = pixfmt.to_bytes(4, "little").decode("ascii", "replace")
+            for j in range(256):
+                buf = bytearray(struct.pack(_V4L2_FRMSIZEENUM, j, pixfmt, 0, *([0] * 8)))
+                try:
+                    fcntl.ioctl(fd, enum_sizes, buf)
+                except OSError:
+                    break
+                _, _, kind, *v = struct.unpack(_V4L2_FRMSIZEENUM, buf)
+                if kind == 1:  # DISCRETE
+                    modes.append({"fourcc": fourcc, "width": v[0], "height": v[1]})
+                    continue
+                # CONTINUOUS/STEPWISE: ใช้ขนาดใน RESOLUTIONS ที่อยู่ในช่วง
+                min_w, max_w, step_w, min_h, max_h, step_h = v[:6]
+                for w, h in RESOLUTIONS.values():
+                    if (min_w <= w <= max_w and min_h <= h <= max_h
+                            and (w - min_w) % max(1, step_w) == 0 and (h - min_h) % max(1, step_h) == 0):
+                        modes.append({"fourcc": fourcc, "width": w, "height": h})
+                break
+    finally:
+        os.close(fd)
+    return modes
+
+def trial_modes(cap):
+    # วิธีเดิม (ลองทีละขนาด) สำหรับระบบที่ไม่มี V4L2 ใช้แค่ครั้งแรกแล้วเก็บลง cache
+    modes = []
     for width, height in RESOLUTIONS.values():
         cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
         cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
-        actual_w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        actual_h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        if actual_w == width and actual_h == height:
-            return width, height
-    return 640, 480
+        if (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))) == (width, height):
+            modes.append({"fourcc": "", "width": width, "height": height})
+    return modes
+
+def _load_camera_caps():
+    try:
+        with open(CAMERA_CAPS_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_camera_caps(caps):
+    tmp = CAMERA_CAPS_PATH + ".part"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(caps, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, CAMERA_CAPS_PATH)
+
+def probe_camera_modes(index, cap=None):
+    """คืน (modes, from_cache) โหมดที่กล้องรองรับ ใช้ cache ถ้ามี"""
+    key = camera_identity(index)
+    caps = _load_camera_caps()
+    if caps.get(key):
+        return caps[key], True
+    modes = []
+    if key.startswith("v4l2:"):
+        try:
+            modes = v4l2_modes(index)
+        except OSError as e:
+            print(f"อ่านโหมดกล้องผ่าน V4L2 ไม่ได้: {e}")
+    if not modes and cap is not None:
+        modes = trial_modes(cap)
+    if modes:
+        caps[key] = modes
+        _save_camera_caps(caps)
+    return modes, False
+
+def forget_camera_modes(index):
+    # เรียกเมื่อโหมดใน cache ใช้ไม่ได้จริง (เช่น เปลี่ยนกล้องที่พอร์ตเดิม) รอบหน้าจะ probe ใหม่
+    caps = _load_camera_caps()
+    if caps.pop(camera_identity(index), None) is not None:
+        _save_camera_caps(caps)
+
+def best_mode(modes):
+    """ขนาดใหญ่สุด ถ้าเท่ากันเลือก MJPG ก่อน (ส่งผ่าน USB ได้ fps สูงกว่า YUYV)"""
+    if not modes:
+        return {"fourcc": "", "width": 640, "height": 480}
+    return max(modes, key=lambda m: (m["width"] * m["height"], m["fourcc"] == "MJPG"))
+
+def mode_for_size(modes, width, height):
+    candidates = [m for m in modes if (m["width"], m["height"]) == (width, height)]
+    return best_mode(candidates) if candidates else {"fourcc": "", "width": width, "height": height}
+
+def apply_camera_mode(cap, mode):
+    if mode.get("fourcc"):
+        cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*mode["fourcc"]))
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, mode["width"])
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, mode["height"])
+    return int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+
+class FrameMailbox:
+    """กล่องรับภาพช่องเดียวระหว่าง thread กล้องกับ Tk: ของใหม่ทับของเก่า ไม่มีคิวสะสม"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._item = None
+
+    def put(self, item):
+        with self._lock:
+            self._item = item
+
+    def take(self):
+        with self._lock:
+            item, self._item = self._item, None
+        return item
+
+    def empty(self):
+        with self._lock:
+            return self._item is None
+
+
+def fit_size(src_w, src_h, box_w, box_h):
+    # ขนาดที่ย่อให้พอดีกรอบโดยคงสัดส่วน (ไม่ขยายเกินขนาดจริง)
+    scale = min(box_w / max(1, src_w), box_h / max(1, src_h), 1.0)
+    return max(1, int(src_w * scale)), max(1, int(src_h * scale))
+
+
+def write_jpeg(path, frame_bgr, quality=95):
+    # เขียนไฟล์ชั่วคราวแล้ว rename: ถ้าโปรแกรมล่มกลางทางจะไม่มีไฟล์ jpg ครึ่งๆ
+    ok, buf = cv2.imencode(".jpg", frame_bgr, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise RuntimeError(f"encode JPEG ไม่สำเร็จ: {path}")
+    tmp = path + ".part"
+    with open(tmp, "wb") as f:
+        f.write(buf.tobytes())
+    os.replace(tmp, path)
+
+
+class ShotWriter:
+    """encode + เขียนภาพที่ถ่ายลงดิสก์ด้วย worker หลาย thread ผ่านคิวที่จำกัดขนาด
+
+    cv2.imencode ปล่อย GIL ระหว่าง encode จึงใช้ thread เป็น pool ได้จริง
+    on_done(path, frame) ถูกเรียกใน worker หลังเขียนไฟล์สำเร็จ
+    """
+    def __init__(self, quality=95, max_pending=16, workers=1):
+        self.quality = quality
+        self._queue = queue.Queue(maxsize=max_pending)
+        self.errors = []
+        self._threads = [threading.Thread(target=self._worker, daemon=True) for _ in range(workers)]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, path, frame_bgr, on_done=None):
+        # คิวเต็ม = ดิสก์ตามไม่ทัน รอให้ว่างก่อน (ไม่ทิ้งภาพที่ผู้ใช้กดถ่าย)
+        self._queue.put((path, frame_bgr, on_done))
+
+    def try_submit(self, path, frame_bgr, on_done=None):
+        """สำหรับถ่ายต่อเนื่อง: ถ้าคิวเต็มคืน False ทันที (ผู้เรียกนับเป็นเฟรมที่ทิ้ง) ไม่ block thread กล้อง"""
+        try:
+            self._queue.put_nowait((path, frame_bgr, on_done))
+            return True
+        except queue.Full:
+            return False
+
+    def pending(self):
+        return self._queue.unfinished_tasks
+
+    def flush(self):
+        self._queue.join()
+
+    def close(self):
+        self.flush()
+        for _ in self._threads:
+            self._queue.put(None)
+        for t in self._threads:
+            t.join()
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                path, frame, on_done = item
+                write_jpeg(path, frame, self.quality)
+                if on_done is not None:
+                    on_done(path, frame)
+            except Exception as e:
+                self.errors.append(str(e))
+            finally:
+                self._queue.task_done()
 
 
 class CaptureTab(ctk.CTkFrame):
@@ -189,11 +458,14 @@ class CaptureTab(ctk.CTkFrame):
         # Left: webcam feed
         self.video_label = ctk.CTkLabel(self, text="")
         self.video_label.grid(row=0, column=0, sticky="nsew", padx=8, pady=8)
+        self.video_label.bind("<Configure>", self._on_video_resize)
+        self.preview_stats = ctk.CTkLabel(self, text="Preview: -", anchor="w")
+        self.preview_stats.grid(row=1, column=0, sticky="ew", padx=12, pady=(0, 6))
 
         # Right: controls + list
         right = ctk.CTkFrame(self)
         right.grid(row=0, column=1, sticky="nsew", padx=8, pady=8)
-        right.grid_rowconfigure(3, weight=1)
+        right.grid_rowconfigure(4, weight=1)
         right.grid_columnconfigure(0, weight=1)
 
         # --- ปุ่มควบคุม ---
@@ -220,46 +492,256 @@ class CaptureTab(ctk.CTkFrame):
         )
         self.resolution_menu.grid(row=1, column=0, padx=6, pady=(6,0), sticky="ew")
 
+        # --- ถ่ายต่อเนื่อง (burst) / ถ่ายตามช่วงเวลา (interval) ---
+        burst_frame = ctk.CTkFrame(right)
+        burst_frame.grid(row=2, column=0, sticky="ew", padx=4, pady=(6,0))
+        burst_frame.grid_columnconfigure((1,3), weight=1)
+
+        ctk.CTkLabel(burst_frame, text="Burst N").grid(row=0, column=0, padx=4, pady=4, sticky="w")
+        self.burst_n_entry = ctk.CTkEntry(burst_frame, width=60)
+        self.burst_n_entry.insert(0, "20")
+        self.burst_n_entry.grid(row=0, column=1, padx=4, pady=4, sticky="ew")
+        ctk.CTkLabel(burst_frame, text="ภาพต่างกัน ≥ %").grid(row=0, column=2, padx=4, pady=4, sticky="w")
+        self.min_change_entry = ctk.CTkEntry(burst_frame, width=60)
+        self.min_change_entry.insert(0, "0")
+        self.min_change_entry.grid(row=0, column=3, padx=4, pady=4, sticky="ew")
+
+        ctk.CTkLabel(burst_frame, text="ทุก X ms").grid(row=1, column=0, padx=4, pady=4, sticky="w")
+        self.interval_ms_entry = ctk.CTkEntry(burst_frame, width=60)
+        self.interval_ms_entry.insert(0, "500")
+        self.interval_ms_entry.grid(row=1, column=1, padx=4, pady=4, sticky="ew")
+        ctk.CTkLabel(burst_frame, text="นาน T s").grid(row=1, column=2, padx=4, pady=4, sticky="w")
+        self.interval_t_entry = ctk.CTkEntry(burst_frame, width=60)
+        self.interval_t_entry.insert(0, "10")
+        self.interval_t_entry.grid(row=1, column=3, padx=4, pady=4, sticky="ew")
+
+        self.burst_btn = ctk.CTkButton(burst_frame, text="ถ่ายต่อเนื่อง", command=self.start_burst)
+        self.burst_btn.grid(row=2, column=0, columnspan=2, padx=4, pady=4, sticky="ew")
+        self.interval_btn = ctk.CTkButton(burst_frame, text="ถ่ายตามช่วงเวลา", command=self.start_interval)
+        self.interval_btn.grid(row=2, column=2, padx=4, pady=4, sticky="ew")
+        self.stop_job_btn = ctk.CTkButton(burst_frame, text="หยุด", width=60, fg_color="#A33", hover_color="#922",
+                                          command=self.stop_capture_job)
+        self.stop_job_btn.grid(row=2, column=3, padx=4, pady=4, sticky="ew")
+        self.job_stats = ctk.CTkLabel(burst_frame, text="", anchor="w", justify="left")
+        self.job_stats.grid(row=3, column=0, columnspan=4, padx=4, pady=(0,4), sticky="ew")
+
         self.count_label = ctk.CTkLabel(right, text="รูปทั้งหมด: 0")
-        self.count_label.grid(row=2, column=0, sticky="w", padx=6, pady=(6,0))
+        self.count_label.grid(row=3, column=0, sticky="w", padx=6, pady=(6,0))
 
         self.scroll = ctk.CTkScrollableFrame(right, label_text="รายการรูปที่ถ่าย")
-        self.scroll.grid(row=3, column=0, sticky="nsew", padx=4, pady=6)
+        self.scroll.grid(row=4, column=0, sticky="nsew", padx=4, pady=6)
         self.thumb_widgets = []
 
+        # แถบความคืบหน้าตอนบันทึก (ซ่อนไว้จนกว่าจะกดบันทึก)
+        self.save_bar = ctk.CTkProgressBar(right)
+        self.save_bar.grid(row=5, column=0, sticky="ew", padx=8, pady=(0,2))
+        self.save_label = ctk.CTkLabel(right, text="", anchor="w")
+        self.save_label.grid(row=6, column=0, sticky="ew", padx=8, pady=(0,6))
+        self.save_bar.grid_remove()
+        self.save_label.grid_remove()
+
         # Internal state
+        # captured: path ของภาพที่ถ่ายแล้ว (เขียนลง session ใน STAGING_DIR ทันทีที่ถ่าย)
+        # ในหน่วยความจำเก็บแค่ thumbnail
         self.captured = []
         self.cap = None
         self.running = True
+        self._last_frame = None
+        # worker หลายตัวเพื่อให้ burst ไม่ถูกจำกัดด้วยความเร็ว encode JPEG
+        self.writer = ShotWriter(quality=95, max_pending=32, workers=max(2, (os.cpu_count() or 2) - 1))
+        self._shot_no = 0
+        self._shot_lock = threading.Lock()
+        self.session_dir = self._new_session_dir()
+
+        # งานถ่ายต่อเนื่อง: Tk thread ตั้ง self._job แล้ว thread กล้องเป็นคนเลือกเฟรม
+        # ภาพที่เขียนเสร็จส่งกลับมาทาง _shot_events ให้ Tk thread ใส่ในรายการ
+        self._job = None
+        self._shot_events = queue.Queue()
+
+        # บันทึกโปรเจกต์ใน thread แยก: _save_worker เขียนผลลง _save_result แล้ว _poll_save อ่าน
+        self._saving = False
+        self._save_progress = [0, 0]
+        self._save_result = None
+
+        # Preview: thread กล้องย่อภาพเท่าขนาด widget แล้วส่งผ่าน mailbox ให้ Tk วาด
+        self._preview_box = (1280, 720)
+        self._preview_mailbox = FrameMailbox()
+        self._preview_dropped = 0
+        self._preview_cpu = 0.0      # CPU (วินาที) ที่ใช้ทำ preview ทั้งสองฝั่ง
+        self._preview_shown = 0
+        self._preview_stats_t = time.monotonic()
+        self.camera_info = ""
+        self.camera_modes = []
+        self._menu_dirty = False
 
         self._video_thread = threading.Thread(target=self._video_loop, daemon=True)
         self._video_thread.start()
+        self.after(30, self._drain_preview)
+        self.after(100, self._drain_shots)
+        self.after(500, self._recover_staging)
+
+    def _new_session_dir(self):
+        path = os.path.join(STAGING_DIR, f"session_{now_str()}_{os.getpid()}")
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def _recover_staging(self):
+        """กู้ภาพจาก session ที่ค้างอยู่ (เช่น โปรแกรมปิดไปก่อนกดบันทึก)"""
+        if not os.path.isdir(STAGING_DIR):
+            return
+        for d in sorted(os.listdir(STAGING_DIR)):
+            path = os.path.join(STAGING_DIR, d)
+            if d.startswith("save_"):
+                # บันทึกค้างกลางทาง: โปรเจกต์จริงยังไม่ถูกแตะ แต่ภาพที่ย้ายมาจาก session ต้องย้ายกลับก่อนลบ
+                self._restore_staged(path)
+                shutil.rmtree(path, ignore_errors=True)
+                continue
+            if d.startswith("old_"):
+                # ล่มระหว่างสลับโฟลเดอร์: ถ้าโปรเจกต์ใหม่ไม่อยู่ ให้คืนของเดิม
+                proj_dir = os.path.join(PROJECTS_DIR, d[len("old_") + len(now_str()) + 1:])
+                if os.path.exists(proj_dir):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    os.replace(path, proj_dir)
+        leftovers = []
+        for d in sorted(os.listdir(STAGING_DIR)):
+            path = os.path.join(STAGING_DIR, d)
+            if path == self.session_dir or not d.startswith("session_") or not os.path.isdir(path):
+                continue
+            shots = sorted(f for f in os.listdir(path) if f.lower().endswith(".jpg"))
+            if shots:
+                leftovers.append((path, shots))
+            else:
+                shutil.rmtree(path, ignore_errors=True)
+        if not leftovers:
+            return
+        total = sum(len(s) for _, s in leftovers)
+        if not messagebox.askyesno("กู้คืนภาพ", f"พบภาพที่ยังไม่ได้บันทึกจากครั้งก่อน {total} รูป ต้องการกู้คืนหรือไม่?"):
+            for path, _ in leftovers:
+                shutil.rmtree(path, ignore_errors=True)
+            return
+        for path, shots in leftovers:
+            for name in shots:
+                dst = self._next_shot_path()
+                os.replace(os.path.join(path, name), dst)
+                self._add_shot(dst, None)
+            shutil.rmtree(path, ignore_errors=True)
+
+    @staticmethod
+    def _restore_staged(save_dir):
+        """ย้ายภาพที่ _save_worker ย้ายออกจาก session กลับไปที่เดิม (ตาม STAGED_SOURCES_NAME)"""
+        try:
+            with open(os.path.join(save_dir, STAGED_SOURCES_NAME), "r", encoding="utf-8") as f:
+                pairs = json.load(f)
+        except (OSError, ValueError):
+            return  # ยังไม่ได้เขียนรายการ = ยังไม่ได้ย้ายภาพไหนเลย
+        for name, src in pairs:
+            dst = os.path.join(save_dir, "images", name)
+            if os.path.exists(dst):
+                os.makedirs(os.path.dirname(src), exist_ok=True)
+                os.replace(dst, unique_path(src))
+
+    def _on_video_resize(self, event):
+        w, h = max(1, event.width - 4), max(1, event.height - 4)
+        pw, ph = self._preview_box
+        # ไม่สนการเปลี่ยนไม่กี่ pixel กันขนาดแกว่งไปมาระหว่างรูปกับ label
+        if abs(w - pw) > 8 or abs(h - ph) > 8:
+            self._preview_box = (w, h)
+
+    def _open_camera(self):
+        """เปิดกล้องด้วยโหมดที่ดีที่สุดจาก capability cache (ทำงานใน thread กล้อง)"""
+        t0 = time.perf_counter()
+        cap = cv2.VideoCapture(self.camera_index, camera_backend())
+        if not cap.isOpened():
+            return None
+        modes, from_cache = probe_camera_modes(self.camera_index, cap)
+        mode = best_mode(modes)
+        actual = apply_camera_mode(cap, mode)
+        if from_cache and actual != (mode["width"], mode["height"]):
+            # cache ไม่ตรงกับกล้องที่เสียบอยู่: probe ใหม่หนึ่งครั้ง
+            forget_camera_modes(self.camera_index)
+            modes, from_cache = probe_camera_modes(self.camera_index, cap)
+            mode = best_mode(modes)
+            actual = apply_camera_mode(cap, mode)
+        ok, _ = cap.read()  # นับถึงเฟรมแรกจริง ไม่ใช่แค่เปิด device
+        ms = 1000 * (time.perf_counter() - t0)
+        src = "cache" if from_cache else "probe ใหม่"
+        self.camera_info = f"กล้องพร้อมใน {ms:.0f} ms ({src}) | {actual[0]}x{actual[1]} {mode['fourcc'] or ''}".rstrip()
+        print(f"ใช้ความละเอียดสูงสุด: {actual[0]}x{actual[1]} — {self.camera_info}")
+        self.camera_modes = modes
+        self._menu_dirty = True
+        return cap
 
     def _video_loop(self):
         try:
-            self.cap = cv2.VideoCapture(self.camera_index)
-            if not self.cap.isOpened():
+            self.cap = self._open_camera()
+            if self.cap is None:
                 messagebox.showerror("ข้อผิดพลาด", "ไม่สามารถเปิดกล้องได้")
                 return
 
-            max_w, max_h = get_max_resolution(self.cap)
-            print(f"ใช้ความละเอียดสูงสุด: {max_w}x{max_h}")
-
-            last_frame = None
             while self.running:
                 ret, frame = self.cap.read()
-                if ret:
-                    last_frame = frame
-                if last_frame is not None:
-                    pil = pil_from_cv2(last_frame)
-                    img = pil_to_ctk_image(pil, size=(1280, 720))
-                    self.video_label.configure(image=img)
-                    self.video_label.image = img
-                time.sleep(0.03)
+                if not ret:
+                    time.sleep(0.03)
+                    continue
+                self._last_frame = frame
+                if self._job is not None:
+                    self._job_step(self._job, frame)
+                if not self._preview_mailbox.empty():
+                    # Tk ยังวาดภาพก่อนหน้าไม่ทัน: ทิ้งเฟรมนี้ไม่ต้องย่อ
+                    self._preview_dropped += 1
+                    continue
+                cpu = time.thread_time()
+                h, w = frame.shape[:2]
+                size = fit_size(w, h, *self._preview_box)
+                small = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+                small = cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
+                self._preview_cpu += time.thread_time() - cpu
+                self._preview_mailbox.put(small)
         finally:
             if self.cap:
                 self.cap.release()
 
+    def _drain_preview(self):
+        """ทำงานใน Tk thread: หยิบภาพล่าสุดจาก mailbox มาแสดง"""
+        if not self.running:
+            return
+        if self._menu_dirty:
+            self._menu_dirty = False
+            self._update_resolution_menu()
+        small = self._preview_mailbox.take()
+        if small is not None:
+            cpu = time.thread_time()
+            pil = Image.fromarray(small)
+            scaling = self.video_label._get_widget_scaling()
+            img = ctk.CTkImage(light_image=pil, dark_image=pil,
+                               size=(pil.width / scaling, pil.height / scaling))
+            self.video_label.configure(image=img)
+            self.video_label.image = img
+            self._preview_cpu += time.thread_time() - cpu
+            self._preview_shown += 1
+
+        elapsed = time.monotonic() - self._preview_stats_t
+        if elapsed >= 1.0:
+            shown = self._preview_shown
+            fps = shown / elapsed
+            ms = 1000 * self._preview_cpu / shown if shown else 0.0
+            core = 100 * self._preview_cpu / elapsed
+            self.preview_stats.configure(
+                text=f"Preview: {fps:.1f} fps | CPU {ms:.1f} ms/เฟรม ({core:.0f}% ของ 1 core) | "
+                     f"ทิ้ง {self._preview_dropped} เฟรม | {self.camera_info}")
+            self._preview_shown = 0
+            self._preview_cpu = 0.0
+            self._preview_dropped = 0
+            self._preview_stats_t = time.monotonic()
+        self.after(10, self._drain_preview)
+
+    def _update_resolution_menu(self):
+        # แสดงเฉพาะความละเอียดที่กล้องรองรับจริง (ถ้า probe ได้)
+        sizes = {(m["width"], m["height"]) for m in self.camera_modes}
+        values = [k for k, wh in RESOLUTIONS.items() if wh in sizes] or list(RESOLUTIONS.keys())
+        self.resolution_menu.configure(values=values)
+
     def change_resolution(self, choice):
         """เปลี่ยนความละเอียดโดยปิดและเปิดกล้องใหม่"""
         if self.cap:
@@ -268,13 +750,9 @@ class CaptureTab(ctk.CTkFrame):
 
         width, height = RESOLUTIONS[choice]
 
-        # เปิดกล้องใหม่
-        new_cap = cv2.VideoCapture(self.camera_index, cv2.CAP_DSHOW)  # ใช้ CAP_DSHOW บน Windows จะควบคุมได้ดีกว่า MSMF
-        new_cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
-        new_cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
-
-        actual_w = int(new_cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        actual_h = int(new_cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        # เปิดกล้องใหม่ (backend ตามระบบ: DSHOW บน Windows, V4L2 บน Linux)
+        new_cap = cv2.VideoCapture(self.camera_index, camera_backend())
+        actual_w, actual_h = apply_camera_mode(new_cap, mode_for_size(self.camera_modes, width, height))
 
         if not new_cap.isOpened():
             messagebox.showerror("ข้อผิดพลาด", "ไม่สามารถเปิดกล้องได้")
@@ -292,13 +770,158 @@ class CaptureTab(ctk.CTkFrame):
         if not self.cap or not self.cap.isOpened():
             messagebox.showerror("กล้องไม่พร้อม", "ไม่สามารถเข้าถึงกล้องได้")
             return
-        ret, frame = self.cap.read()
-        if not ret:
+        # ใช้เฟรมล่าสุดจาก thread กล้อง ไม่เรียก cap.read() ซ้อนจาก Tk thread
+        frame = self._last_frame
+        if frame is None:
             messagebox.showerror("ข้อผิดพลาด", "ถ่ายภาพไม่สำเร็จ")
             return
-        pil = pil_from_cv2(frame)
-        self.captured.append(pil)
-        self._add_thumbnail(pil)
+        path = self._next_shot_path()
+        self.writer.submit(path, frame)
+        self._add_shot(path, frame)
+
+    def _next_shot_path(self):
+        # เรียกได้ทั้งจาก Tk thread และ thread กล้อง
+        with self._shot_lock:
+            self._shot_no += 1
+            return os.path.join(self.session_dir, f"shot_{self._shot_no:05d}.jpg")
+
+    @staticmethod
+    def _make_thumb(frame_bgr):
+        h, w = frame_bgr.shape[:2]
+        small = cv2.resize(frame_bgr, fit_size(w, h, 220, 140), interpolation=cv2.INTER_AREA)
+        return pil_from_cv2(small), (w, h)
+
+    # ---- burst / interval ----
+    def _read_job_number(self, entry, label, cast=int, minimum=1):
+        try:
+            value = cast(entry.get())
+        except ValueError:
+            value = None
+        if value is None or value < minimum:
+            messagebox.showerror("ค่าไม่ถูกต้อง", f"{label} ต้องเป็นตัวเลขตั้งแต่ {minimum} ขึ้นไป")
+            return None
+        return value
+
+    def _start_job(self, **job):
+        if self._job is not None:
+            return
+        if not self.cap or not self.cap.isOpened() or self._last_frame is None:
+            messagebox.showerror("กล้องไม่พร้อม", "ไม่สามารถเข้าถึงกล้องได้")
+            return
+        min_change = self._read_job_number(self.min_change_entry, "ภาพต่างกัน", float, 0)
+        if min_change is None:
+            return
+        now = time.monotonic()
+        job.update(min_change=min_change, first_shot=None, last_shot=None, next_t=now, taken=0,
+                   skipped=0, dropped=0, ref=None, done=False)
+        self.burst_btn.configure(state="disabled")
+        self.interval_btn.configure(state="disabled")
+        self._job = job
+
+    def start_burst(self):
+        """ถ่าย N เฟรมเร็วที่สุดเท่าที่กล้องส่งมา"""
+        n = self._read_job_number(self.burst_n_entry, "Burst N")
+        if n is not None:
+            self._start_job(mode="burst", count=n, interval=0.0, until=None)
+
+    def start_interval(self):
+        """ถ่ายหนึ่งเฟรมทุก X ms เป็นเวลา T วินาที"""
+        ms = self._read_job_number(self.interval_ms_entry, "ช่วงเวลา (ms)")
+        secs = self._read_job_number(self.interval_t_entry, "ระยะเวลา (s)", float, 0.001)
+        if ms is not None and secs is not None:
+            self._start_job(mode="interval", count=None, interval=ms / 1000.0,
+                            until=time.monotonic() + secs)
+
+    def stop_capture_job(self):
+        if self._job is not None:
+            self._job["done"] = True
+
+    @staticmethod
+    def _tiny_gray(frame_bgr):
+        # ภาพเล็กมากพอสำหรับเทียบว่าฉากเปลี่ยนหรือยัง (stride ก่อนจะได้ไม่ต้องแตะทุก pixel)
+        small = cv2.resize(frame_bgr[::8, ::8], (64, 36), interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+    def _job_step(self, job, frame):
+        """เรียกใน thread กล้องทุกเฟรมใหม่ระหว่างมีงานถ่ายต่อเนื่อง"""
+        now = time.monotonic()
+        if job["done"] or (job["until"] is not None and now >= job["until"]):
+            job["done"] = True
+            return
+        if now < job["next_t"]:
+            return
+        # interval: ถ้าช้ากว่ากำหนดไม่ต้องถ่ายชดเชย นับจากตอนนี้ไปอีก X ms
+        job["next_t"] = max(job["next_t"] + job["interval"], now) if job["interval"] else now
+        if job["min_change"] > 0:
+            tiny = self._tiny_gray(frame)
+            if job["ref"] is not None:
+                diff = 100.0 * float(cv2.absdiff(tiny, job["ref"]).mean()) / 255.0
+                if diff < job["min_change"]:
+                    job["skipped"] += 1
+                    return
+        path = self._next_shot_path()
+        if not self.writer.try_submit(path, frame, self._on_shot_written):
+            job["dropped"] += 1
+            return
+        if job["min_change"] > 0:
+            job["ref"] = tiny
+        job["taken"] += 1
+        if job["first_shot"] is None:
+            job["first_shot"] = now
+        job["last_shot"] = now
+        if job["count"] is not None and job["taken"] >= job["count"]:
+            job["done"] = True
+
+    def _on_shot_written(self, path, frame):
+        # อยู่ใน worker ของ ShotWriter: ทำ thumbnail ที่นี่ Tk thread แค่สร้าง widget
+        thumb, full_size = self._make_thumb(frame)
+        self._shot_events.put((path, thumb, full_size))
+
+    def _collect_shots(self):
+        """ย้ายภาพที่ worker เขียนเสร็จแล้วเข้า self.captured (Tk thread)"""
+        events = []
+        while True:
+            try:
+                events.append(self._shot_events.get_nowait())
+            except queue.Empty:
+                break
+        # worker หลายตัวอาจเขียนเสร็จสลับลำดับ เรียงตามชื่อไฟล์ (เลขภาพ) ก่อนใส่รายการ
+        for path, thumb, full_size in sorted(events, key=lambda e: e[0]):
+            self.captured.append(path)
+            self._add_thumbnail(thumb, full_size)
+        if events:
+            self.count_label.configure(text=f"รูปทั้งหมด: {len(self.captured)}")
+
+    def _drain_shots(self):
+        if not self.running:
+            return
+        self._collect_shots()
+        job = self._job
+        if job is not None:
+            span = (job["last_shot"] - job["first_shot"]) if job["taken"] > 1 else 0.0
+            fps = (job["taken"] - 1) / span if span > 0 else 0.0
+            state = "เสร็จ" if job["done"] else "กำลังถ่าย"
+            self.job_stats.configure(
+                text=f"{state}: {job['taken']} รูป | {fps:.1f} fps | ภาพซ้ำข้าม {job['skipped']} | "
+                     f"ทิ้ง (encode ไม่ทัน) {job['dropped']}")
+            if job["done"]:
+                self._job = None
+                self.burst_btn.configure(state="normal")
+                self.interval_btn.configure(state="normal")
+        self.after(100, self._drain_shots)
+
+    def _add_shot(self, path, frame_bgr):
+        """เพิ่มภาพในรายการ: frame_bgr=None คือโหลด thumbnail จากไฟล์ (ตอนกู้คืน)"""
+        if frame_bgr is not None:
+            thumb, (w, h) = self._make_thumb(frame_bgr)
+        else:
+            with Image.open(path) as im:
+                w, h = im.size
+                im.draft("RGB", (220, 140))
+                thumb = im.convert("RGB")
+            thumb.thumbnail((220, 140), Image.LANCZOS)
+        self.captured.append(path)
+        self._add_thumbnail(thumb, (w, h))
         self.count_label.configure(text=f"รูปทั้งหมด: {len(self.captured)}")
 
     def stop(self):
@@ -306,7 +929,7 @@ class CaptureTab(ctk.CTkFrame):
         if self._video_thread.is_alive():
             self._video_thread.join()
 
-    def _add_thumbnail(self, pil_img):
+    def _add_thumbnail(self, pil_img, full_size):
         idx = len(self.thumb_widgets)
         thumb = pil_to_ctk_image(pil_img, size=(220, 140))
         frame = ctk.CTkFrame(self.scroll)
@@ -319,16 +942,27 @@ class CaptureTab(ctk.CTkFrame):
 
         name = ctk.CTkLabel(frame, text=f"ภาพที่ {idx+1}")
         name.grid(row=0, column=1, sticky="w", padx=4)
-        size = ctk.CTkLabel(frame, text=f"{pil_img.width}x{pil_img.height}")
+        size = ctk.CTkLabel(frame, text=f"{full_size[0]}x{full_size[1]}")
         size.grid(row=1, column=1, sticky="w", padx=4)
 
         self.thumb_widgets.append(frame)
 
     def reset_list(self):
+        if self._saving:
+            return
+        if self._job is not None:
+            messagebox.showwarning("กำลังถ่าย", "กรุณาหยุดการถ่ายต่อเนื่องก่อน")
+            return
+        self.writer.flush()
+        self._collect_shots()
         if not self.captured:
             return
         if not messagebox.askyesno("ยืนยัน", "ต้องการลบภาพทั้งหมดใช่หรือไม่?"):
             return
+        for p in self.captured:
+            # ลบเฉพาะภาพที่ยังค้างใน staging ภาพที่บันทึกเป็นโปรเจกต์แล้วไม่แตะ
+            if os.path.dirname(p) == self.session_dir and os.path.exists(p):
+                os.remove(p)
         self.captured.clear()
         for w in self.thumb_widgets:
             w.destroy()
@@ -336,6 +970,13 @@ class CaptureTab(ctk.CTkFrame):
         self.count_label.configure(text="รูปทั้งหมด: 0")
 
     def save_project(self):
+        if self._saving:
+            return
+        if self._job is not None:
+            messagebox.showwarning("กำลังถ่าย", "กรุณาหยุดการถ่ายต่อเนื่องก่อน")
+            return
+        self.writer.flush()
+        self._collect_shots()
         if not self.captured:
             messagebox.showwarning("ไม่มีรูป", "ยังไม่มีรูปสำหรับบันทึก")
             return
@@ -345,23 +986,147 @@ class CaptureTab(ctk.CTkFrame):
             return
         name = safe_filename(name)
         proj_dir = os.path.join(PROJECTS_DIR, name)
+        # ภาพถูก encode ไว้แล้วตอนถ่าย (flush ด้านบนรอให้เขียนลงดิสก์ครบแล้ว)
+        if self.writer.errors:
+            messagebox.showerror("ข้อผิดพลาด", "บันทึกภาพบางรูปไม่สำเร็จ:\n" + "\n".join(self.writer.errors[:5]))
+            self.writer.errors.clear()
+            return
         if os.path.exists(proj_dir):
             if not messagebox.askyesno("ซ้ำชื่อ", "มีโปรเจกต์ชื่อนี้อยู่แล้ว ต้องการเขียนทับหรือไม่?"):
                 return
-            shutil.rmtree(proj_dir)
-        os.makedirs(proj_dir, exist_ok=True)
-        img_dir = os.path.join(proj_dir, "images")
-        os.makedirs(img_dir, exist_ok=True)
-        # Save images
-        for i, im in enumerate(self.captured, start=1):
-            im.save(os.path.join(img_dir, f"img_{i:04d}.jpg"), quality=95)
-        self.session_logger.add_project(name, len(self.captured))
+
+        self._saving = True
+        self._save_progress = [0, len(self.captured)]
+        for btn in (self.save_btn, self.reset_btn):
+            btn.configure(state="disabled")
+        self.save_bar.set(0)
+        self.save_bar.grid()
+        self.save_label.grid()
+        t = threading.Thread(target=self._save_worker, args=(name, proj_dir, list(self.captured)), daemon=True)
+        t.start()
+        self.after(100, self._poll_save)
+
+    def _save_worker(self, name, proj_dir, sources):
+        """ประกอบโปรเจกต์ในโฟลเดอร์ชั่วคราว แล้ว rename เข้า PROJECTS_DIR ทีเดียว
+
+        ระหว่างนี้โปรเจกต์เดิม (ถ้ามี) ยังอยู่ครบ ถ้าล่มกลางทางจะเหลือแค่โฟลเดอร์ save_* ใน STAGING_DIR
+        """
+        t0 = time.perf_counter()
+        tmp_dir = os.path.join(STAGING_DIR, f"save_{now_str()}_{name}")
+        img_dir = os.path.join(tmp_dir, "images")
+        moved = []  # (dst, src) ที่ย้ายออกจาก staging แล้ว ใช้ย้ายกลับถ้าบันทึกไม่สำเร็จ
+        moved_lock = threading.Lock()
+        old_dir = None
+        try:
+            os.makedirs(img_dir)
+            # เขียนรายการก่อนย้ายภาพใดๆ: ถ้าโปรแกรมล่ม/ถูกปิดกลางทาง _recover_staging ย้ายกลับได้
+            staged = [[f"img_{i:04d}.jpg", src] for i, src in enumerate(sources, start=1)
+                      if os.path.dirname(src) == self.session_dir]
+            with open(os.path.join(tmp_dir, STAGED_SOURCES_NAME), "w", encoding="utf-8") as f:
+                json.dump(staged, f)
+                f.flush()
+                os.fsync(f.fileno())
+
+            def place(item):
+                i, src = item
+                dst = os.path.join(img_dir, f"img_{i:04d}.jpg")
+                if os.path.dirname(src) == self.session_dir:
+                    # ไฟล์ใน staging อยู่ filesystem เดียวกัน: ย้ายด้วย rename ไม่ต้องคัดลอกข้อมูล
+                    try:
+                        os.replace(src, dst)
+                        with moved_lock:
+                            moved.append((dst, src))
+                        return os.path.join(proj_dir, "images", os.path.basename(dst))
+                    except OSError:
+                        pass
+                # ไฟล์ของโปรเจกต์อื่น (หรือ rename ไม่ได้): hard link ถ้าได้ ไม่งั้นคัดลอก
+                try:
+                    os.link(src, dst)
+                except OSError:
+                    shutil.copy2(src, dst)
+                return os.path.join(proj_dir, "images", os.path.basename(dst))
+
+            # I/O ล้วน: thread pool ช่วยได้เมื่อต้องคัดลอกข้าม filesystem
+            saved = []
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                for path in pool.map(place, enumerate(sources, start=1)):
+                    saved.append(path)
+                    self._save_progress[0] += 1  # นับฝั่งเดียว (thread นี้) ไม่ต้องใช้ lock
+
+            if os.path.exists(proj_dir):
+                old_dir = os.path.join(STAGING_DIR, f"old_{now_str()}_{name}")
+                os.replace(proj_dir, old_dir)
+            os.replace(tmp_dir, proj_dir)
+            try:
+                os.remove(os.path.join(proj_dir, STAGED_SOURCES_NAME))
+            except OSError:
+                pass
+            if old_dir:
+                shutil.rmtree(old_dir, ignore_errors=True)
+            # ไฟล์ใน staging ที่ต้องคัดลอกแทนการย้าย (rename ไม่ได้) ลบต้นฉบับได้แล้ว
+            moved_src = {src for _, src in moved}
+            for src in sources:
+                if os.path.dirname(src) == self.session_dir and src not in moved_src:
+                    try:
+                        os.remove(src)
+                    except OSError:
+                        pass
+            self._save_result = (name, proj_dir, sources, saved, time.perf_counter() - t0, None, True)
+        except Exception as e:
+            # ย้ายภาพกลับเข้า staging ก่อนลบโฟลเดอร์ชั่วคราว ไม่ให้ภาพที่ถ่ายไว้หาย
+            for dst, src in moved:
+                try:
+                    os.replace(dst, src)
+                except OSError:
+                    pass
+            # ย้ายโปรเจกต์เดิมไปแล้วแต่สลับไม่สำเร็จ: คืนที่เดิม
+            intact = True
+            if old_dir and os.path.exists(old_dir):
+                try:
+                    if not os.path.exists(proj_dir):
+                        os.replace(old_dir, proj_dir)
+                except OSError:
+                    intact = False
+            if os.path.isdir(tmp_dir) and not any(os.path.exists(d) for d, _ in moved):
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+            self._save_result = (name, proj_dir, sources, None, time.perf_counter() - t0, e, intact)
+
+    def _poll_save(self):
+        if not self.running:
+            return
+        done, total = self._save_progress
+        self.save_bar.set(done / max(1, total))
+        self.save_label.configure(text=f"กำลังบันทึก {done}/{total}")
+        result, self._save_result = self._save_result, None
+        if result is None:
+            self.after(100, self._poll_save)
+            return
+        name, proj_dir, sources, saved, elapsed, error, intact = result
+        self._saving = False
+        for btn in (self.save_btn, self.reset_btn):
+            btn.configure(state="normal")
+        self.save_bar.grid_remove()
+        self.save_label.grid_remove()
+        if error is not None:
+            note = ("โปรเจกต์เดิมไม่ถูกแตะ" if intact
+                    else f"โปรเจกต์เดิมอยู่ที่ {STAGING_DIR} จะถูกย้ายคืนเมื่อเปิดโปรแกรมครั้งถัดไป")
+            messagebox.showerror("ข้อผิดพลาด", f"บันทึกโปรเจกต์ไม่สำเร็จ ({note}): {error}")
+            return
+        # ภาพที่ถ่ายเพิ่มระหว่างบันทึกยังอยู่ท้ายรายการ
+        self.captured = saved + self.captured[len(sources):]
+        self.session_logger.add_project(name, len(saved))
         self.on_project_saved(name, proj_dir)
-        messagebox.showinfo("สำเร็จ", f"บันทึก {len(self.captured)} รูป ไปยังโปรเจกต์: {name}")
-        # Keep images in memory for further work; don't reset automatically
+        rate = len(saved) / elapsed if elapsed > 0 else 0.0
+        print(f"บันทึก {len(saved)} รูปใน {elapsed:.2f} s ({rate:.0f} รูป/วินาที)")
+        messagebox.showinfo("สำเร็จ", f"บันทึก {len(saved)} รูป ไปยังโปรเจกต์: {name}\n"
+                                      f"ใช้เวลา {elapsed:.2f} วินาที ({rate:.0f} รูป/วินาที)")
+        # Keep the list (now pointing at the project files) for further work; don't reset automatically
 
     def destroy(self):
         self.running = False
+        self.writer.close()
+        if self.session_dir and os.path.isdir(self.session_dir) and not os.listdir(self.session_dir):
+            os.rmdir(self.session_dir)
         if self.cap:
             try:
                 self.cap.release()
@@ -370,6 +1135,1213 @@ class CaptureTab(ctk.CTkFrame):
         super().destroy()
 
 
+# ---------- Thumbnail strip ----------
+THUMB_CACHE_DIR = os.path.join(CACHE_DIR, "thumbs")
+THUMB_SIZE = (180, 120)
+
+def thumb_cache_path(path):
+    """ไฟล์ thumbnail ใน cache: key = path + mtime + size ไฟล์ถูกแก้เมื่อไรก็สร้างใหม่เอง"""
+    st = os.stat(path)
+    key = f"{os.path.abspath(path)}|{st.st_mtime_ns}|{st.st_size}|{THUMB_SIZE}"
+    return os.path.join(THUMB_CACHE_DIR, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".jpg")
+
+def make_thumbnail(path):
+    """โหลด thumbnail จาก cache หรือสร้างใหม่ (ทำงานใน worker thread)"""
+    cache = thumb_cache_path(path)
+    try:
+        with Image.open(cache) as im:
+            return im.convert("RGB")
+    except OSError:
+        pass
+    with Image.open(path) as im:
+        # JPEG: ให้ decoder ย่อ 1/2-1/8 ตั้งแต่ตอนถอดรหัส ไม่ต้อง decode ภาพเต็ม
+        im.draft("RGB", (THUMB_SIZE[0] * 2, THUMB_SIZE[1] * 2))
+        th = im.convert("RGB")
+    th.thumbnail(THUMB_SIZE, Image.LANCZOS)
+    os.makedirs(THUMB_CACHE_DIR, exist_ok=True)
+    tmp = f"{cache}.{threading.get_ident()}.part"
+    th.save(tmp, "JPEG", quality=85)
+    os.replace(tmp, cache)
+    return th
+
+
+class ThumbStrip(tk.Frame):
+    """รายการ thumbnail แบบ virtualized: สร้าง canvas item เฉพาะแถวที่มองเห็น
+
+    thumbnail ถูกโหลดโดย worker pool (เฉพาะแถวที่ต้องแสดง) แล้วส่งกลับมาให้ Tk thread
+    ผ่านคิว PhotoImage เก็บแบบ LRU ไม่เกิน max_cached รูป
+    """
+    ROW_H = THUMB_SIZE[1] + 28
+
+    def __init__(self, master, on_select, workers=4, max_cached=256, bg="#2b2b2b"):
+        super().__init__(master, bg=bg)
+        self.on_select = on_select
+        self.items = []
+        self.selected = -1
+        self.marked = set()            # path ที่ต้องเน้นสี (เช่น label จากโมเดลที่ยังไม่ตรวจ)
+        self.max_cached = max_cached
+        self._photos = OrderedDict()   # path -> PhotoImage (LRU)
+        self._pending = set()          # path ที่ส่งเข้า pool แล้ว
+        self._wanted = set()           # path ของแถวที่มองเห็นตอนนี้ (worker ข้ามที่ไม่ต้องการแล้ว)
+        self._results = queue.Queue()
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._rows = {}                # row index -> (bg, image, text) canvas items ที่ใช้อยู่
+        self._spare = []               # canvas items ที่เลื่อนพ้นจอแล้ว เอากลับมาใช้ใหม่
+
+        self.canvas = tk.Canvas(self, bg=bg, highlightthickness=0)
+        self.vbar = ctk.CTkScrollbar(self, command=self._yview)
+        self.canvas.configure(yscrollcommand=self.vbar.set)
+        self.canvas.pack(side="left", fill="both", expand=True)
+        self.vbar.pack(side="right", fill="y")
+        self.canvas.bind("<Configure>", lambda e: self._refresh())
+        self.canvas.bind("<Button-1>", self._on_click)
+        self.canvas.bind("<MouseWheel>", self._on_wheel)
+        self.canvas.bind("<Button-4>", self._on_wheel)
+        self.canvas.bind("<Button-5>", self._on_wheel)
+        self.after(30, self._drain_results)
+
+    # ---- public ----
+    def set_items(self, paths):
+        self.items = list(paths)
+        self.selected = -1
+        self._wanted.clear()
+        for ids in self._rows.values():
+            self._park(ids)
+        self._rows.clear()
+        self.canvas.configure(scrollregion=(0, 0, 1, len(self.items) * self.ROW_H))
+        self.canvas.yview_moveto(0)
+        self._refresh()
+
+    def select(self, idx):
+        self.selected = idx
+        self.see(idx)
+        for row, ids in self._rows.items():
+            self._style_row(row, ids)
+
+    def set_marked(self, paths):
+        self.marked = set(paths)
+        for row, ids in self._rows.items():
+            self._style_row(row, ids)
+
+    def see(self, idx):
+        if not self.items:
+            return
+        top = self.canvas.canvasy(0)
+        h = self.canvas.winfo_height()
+        y0, y1 = idx * self.ROW_H, (idx + 1) * self.ROW_H
+        if y0 < top or y1 > top + h:
+            self.canvas.yview_moveto(max(0.0, (y0 - (h - self.ROW_H) / 2) / (len(self.items) * self.ROW_H)))
+            self._refresh()
+
+    def destroy(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        super().destroy()
+
+    # ---- scrolling ----
+    def _yview(self, *args):
+        self.canvas.yview(*args)
+        self._refresh()
+
+    def _on_wheel(self, event):
+        if getattr(event, "num", None) == 4 or event.delta > 0:
+            self.canvas.yview_scroll(-1, "units")
+        else:
+            self.canvas.yview_scroll(1, "units")
+        self._refresh()
+
+    def _on_click(self, event):
+        idx = int(self.canvas.canvasy(event.y) // self.ROW_H)
+        if 0 <= idx < len(self.items):
+            self.on_select(idx)
+
+    # ---- rows ----
+    def _visible_range(self):
+        top = self.canvas.canvasy(0)
+        h = max(1, self.canvas.winfo_height())
+        first = max(0, int(top // self.ROW_H) - 1)
+        last = min(len(self.items), int((top + h) // self.ROW_H) + 2)
+        return first, last
+
+    def _park(self, ids):
+        for item in ids:
+            self.canvas.itemconfigure(item, state="hidden")
+        self._spare.append(ids)
+
+    def _refresh(self):
+        first, last = self._visible_range()
+        for row in [r for r in self._rows if not first <= r < last]:
+            self._park(self._rows.pop(row))
+        self._wanted = {self.items[r] for r in range(first, last)}
+        w = max(1, self.canvas.winfo_width())
+        for row in range(first, last):
+            ids = self._rows.get(row)
+            if ids is None:
+                if self._spare:
+                    ids = self._spare.pop()
+                else:
+                    ids = (self.canvas.create_rectangle(0, 0, 0, 0, width=0),
+                           self.canvas.create_image(0, 0, anchor="n"),
+                           self.canvas.create_text(0, 0, anchor="n", fill="#dddddd"))
+                self._rows[row] = ids
+            y = row * self.ROW_H
+            bg, img, txt = ids
+            self.canvas.coords(bg, 2, y + 2, w - 2, y + self.ROW_H - 2)
+            self.canvas.coords(img, w // 2, y + 4)
+            self.canvas.coords(txt, w // 2, y + THUMB_SIZE[1] + 8)
+            self.canvas.itemconfigure(txt, text=os.path.basename(self.items[row]), state="normal")
+            self._style_row(row, ids)
+            self._show_thumb(row, ids)
+
+    def _style_row(self, row, ids):
+        if row == self.selected:
+            color = "#2a2a3a"
+        elif self.items[row] in self.marked:
+            color = "#5a4a20"
+        else:
+            color = "#333333"
+        self.canvas.itemconfigure(ids[0], fill=color, state="normal")
+
+    def _show_thumb(self, row, ids):
+        path = self.items[row]
+        photo = self._photos.get(path)
+        if photo is not None:
+            self._photos.move_to_end(path)
+            self.canvas.itemconfigure(ids[1], image=photo, state="normal")
+            return
+        self.canvas.itemconfigure(ids[1], image="", state="hidden")
+        if path not in self._pending:
+            self._pending.add(path)
+            self._pool.submit(self._load, path)
+
+    # ---- worker ----
+    def _load(self, path):
+        if path not in self._wanted:
+            # เลื่อนผ่านไปแล้ว ไม่ต้อง decode
+            self._results.put((path, None))
+            return
+        try:
+            self._results.put((path, make_thumbnail(path)))
+        except Exception as e:
+            print(f"สร้าง thumbnail ไม่ได้: {path}: {e}")
+            self._results.put((path, None))
+
+    def _drain_results(self):
+        if not self.winfo_exists():
+            return
+        changed = False
+        while True:
+            try:
+                path, pil = self._results.get_nowait()
+            except queue.Empty:
+                break
+            self._pending.discard(path)
+            if pil is None:
+                continue
+            self._photos[path] = ImageTk.PhotoImage(pil)
+            self._photos.move_to_end(path)
+            while len(self._photos) > self.max_cached:
+                self._photos.popitem(last=False)
+            changed = True
+        if changed:
+            for row, ids in self._rows.items():
+                if 0 <= row < len(self.items) and self.items[row] in self._photos:
+                    self._show_thumb(row, ids)
+        self.after(30, self._drain_results)
+
+
+# ---------- Mask store ----------
+MASK_CACHE_DIR = os.path.join(CACHE_DIR, "masks")
+
+def pack_mask(mask):
+    """PIL "L" หรือ numpy -> ((w, h), bytes): 1 bit ต่อ pixel แล้ว zlib (mask แปรงส่วนใหญ่เป็นพื้นที่ทึบ บีบได้มาก)"""
+    arr = np.asarray(mask)
+    bits = np.packbits(arr > 0)
+    return (arr.shape[1], arr.shape[0]), zlib.compress(bits.tobytes(), 1)
+
+def unpack_mask(size, data):
+    w, h = size
+    bits = np.frombuffer(zlib.decompress(data), dtype=np.uint8)
+    m = np.unpackbits(bits, count=w * h).reshape(h, w)
+    return Image.fromarray(m * np.uint8(255), "L")
+
+
+class MaskStore(MutableMapping):
+    """เก็บ mask ของแต่ละรูป (path -> {class_id: PIL "L"}) แบบประหยัดหน่วยความจำ
+
+    hot  : รูปที่ใช้ล่าสุด hot_size รูป เก็บเป็น PIL ที่แก้ไขได้ตรงๆ
+    warm : รูปอื่นเก็บแบบ bit-packed + zlib ในหน่วยความจำ ไม่เกิน warm_budget bytes
+    cold : เกินงบแล้วเขียนลงไฟล์ใน MASK_CACHE_DIR/<hash ของโฟลเดอร์>/
+    แต่ละรูปอยู่ใน tier เดียวเท่านั้น เรียก dict ของรูปไหนก็ถูกย้ายขึ้น hot
+    """
+
+    def __init__(self, hot_size=4, warm_budget=64 * 1024 * 1024, cache_dir=MASK_CACHE_DIR):
+        self.hot_size = hot_size
+        self.warm_budget = warm_budget
+        self.cache_dir = cache_dir
+        self._hot = OrderedDict()    # path -> {cid: PIL}
+        self._warm = OrderedDict()   # path -> {cid: (size, bytes)}
+        self._warm_bytes = 0
+        self._cold = {}              # path -> ไฟล์ .npz
+        self._lazy = {}              # path -> ฟังก์ชันสร้าง masks (จาก journal) ยังไม่เคยถูกเปิด
+
+    # ---- MutableMapping ----
+    def __getitem__(self, path):
+        if path in self._hot:
+            self._hot.move_to_end(path)
+            return self._hot[path]
+        if path in self._lazy:
+            masks = self._lazy.pop(path)()
+            self._put_hot(path, masks)
+            return masks
+        if path in self._warm:
+            packed = self._warm.pop(path)
+            self._warm_bytes -= self._packed_bytes(packed)
+        elif path in self._cold:
+            packed = self._read_cold(self._cold.pop(path))
+        else:
+            raise KeyError(path)
+        masks = {cid: unpack_mask(size, data) for cid, (size, data) in packed.items()}
+        self._put_hot(path, masks)
+        return masks
+
+    def __setitem__(self, path, masks):
+        self._discard(path)
+        self._put_hot(path, masks)
+
+    def __delitem__(self, path):
+        if path not in self:
+            raise KeyError(path)
+        self._discard(path)
+
+    def __contains__(self, path):
+        return path in self._hot or path in self._warm or path in self._cold or path in self._lazy
+
+    def __iter__(self):
+        yield from list(self._hot)
+        yield from list(self._warm)
+        yield from list(self._cold)
+        yield from list(self._lazy)
+
+    def __len__(self):
+        return len(self._hot) + len(self._warm) + len(self._cold) + len(self._lazy)
+
+    # ---- public ----
+    def put_lazy(self, path, loader):
+        """ลงทะเบียน masks ที่จะสร้างเมื่อถูกเรียกใช้ครั้งแรก (ใช้ตอนโหลดจาก journal ไม่ต้อง decode ทุกรูป)"""
+        self._discard(path)
+        self._lazy[path] = loader
+
+    def has_masks(self, path):
+        """รูปนี้มี mask ไม่ว่างใน hot/warm หรือไม่ (ไม่เปิด cold/lazy: ของพวกนั้นบันทึกลง journal แล้ว)"""
+        if path in self._hot:
+            return any(m is not None and m.getbbox() is not None for m in self._hot[path].values())
+        # ตอนย้ายลง warm ตัด mask ว่างทิ้งแล้ว เหลืออะไรอยู่ก็คือมี mask
+        return bool(self._warm.get(path))
+
+    def stats(self):
+        hot = sum(m.width * m.height for masks in self._hot.values() for m in masks.values() if m is not None)
+        cold = sum(os.path.getsize(p) for p in self._cold.values() if os.path.exists(p))
+        return {"images": len(self), "hot_images": len(self._hot), "hot_bytes": hot,
+                "warm_images": len(self._warm), "warm_bytes": self._warm_bytes,
+                "cold_images": len(self._cold), "cold_bytes": cold}
+
+    def close(self):
+        for p in self._cold.values():
+            try:
+                os.remove(p)
+            except OSError:
+                pass
+        self._cold.clear()
+
+    # ---- internal ----
+    @staticmethod
+    def _packed_bytes(packed):
+        return sum(len(data) for _, data in packed.values())
+
+    def _discard(self, path):
+        self._hot.pop(path, None)
+        self._lazy.pop(path, None)
+        packed = self._warm.pop(path, None)
+        if packed is not None:
+            self._warm_bytes -= self._packed_bytes(packed)
+        cold = self._cold.pop(path, None)
+        if cold is not None:
+            try:
+                os.remove(cold)
+            except OSError:
+                pass
+
+    def _put_hot(self, path, masks):
+        self._hot[path] = masks
+        self._hot.move_to_end(path)
+        while len(self._hot) > self.hot_size:
+            old_path, old_masks = self._hot.popitem(last=False)
+            # mask ว่าง (เช่น หลัง Clear mask) ไม่ต้องเก็บ
+            packed = {cid: pack_mask(m) for cid, m in old_masks.items()
+                      if m is not None and m.getbbox() is not None}
+            self._warm[old_path] = packed
+            self._warm_bytes += self._packed_bytes(packed)
+        while self._warm_bytes > self.warm_budget and self._warm:
+            old_path, packed = self._warm.popitem(last=False)
+            self._warm_bytes -= self._packed_bytes(packed)
+            self._cold[old_path] = self._write_cold(old_path, packed)
+
+    def _write_cold(self, path, packed):
+        folder = os.path.join(self.cache_dir,
+                              hashlib.sha1(os.path.dirname(os.path.abspath(path)).encode("utf-8")).hexdigest()[:16])
+        os.makedirs(folder, exist_ok=True)
+        out = os.path.join(folder, hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest() + ".npz")
+        arrays = {}
+        for cid, (size, data) in packed.items():
+            arrays[f"size_{cid}"] = np.array(size, dtype=np.int64)
+            arrays[f"data_{cid}"] = np.frombuffer(data, dtype=np.uint8)
+        with open(out, "wb") as f:
+            np.savez(f, **arrays)
+        return out
+
+    @staticmethod
+    def _read_cold(fname):
+        packed = {}
+        with np.load(fname) as z:
+            for key in z.files:
+                if key.startswith("size_"):
+                    cid = int(key[len("size_"):])
+                    packed[cid] = (tuple(int(v) for v in z[key]), z[f"data_{cid}"].tobytes())
+        os.remove(fname)
+        return packed
+
+
+# ---------- Edit history (undo/redo) ----------
+class MaskEdit:
+    """การแก้ mask หนึ่งคลาส: เก็บเฉพาะสี่เหลี่ยมที่เปลี่ยน ก่อน/หลัง แบบ bit-packed"""
+    def __init__(self, cls_id, rect, before, after):
+        self.cls_id = cls_id
+        self.rect = rect              # (x0, y0, x1, y1) พิกัดภาพ
+        self.before = pack_mask(before)
+        self.after = pack_mask(after)
+        self.nbytes = len(self.before[1]) + len(self.after[1]) + 128
+
+
+class BoxEdit:
+    """การแก้รายการ boxes ของรูป: เก็บรายการก่อน/หลัง (tuple เล็ก ๆ)"""
+    def __init__(self, before, after):
+        self.before = list(before)
+        self.after = list(after)
+        self.nbytes = 64 * (len(self.before) + len(self.after)) + 128
+
+
+class GroupEdit:
+    """หลายการแก้ที่ต้อง undo พร้อมกัน (เช่น คัดลอก label จากรูปก่อนหน้า)"""
+    def __init__(self, edits):
+        self.edits = list(edits)
+        self.nbytes = sum(e.nbytes for e in self.edits) + 64
+
+
+class EditHistory:
+    """undo/redo แยกตามรูป ใช้หน่วยความจำรวมไม่เกิน budget bytes (ทิ้งขั้นที่เก่าที่สุดก่อน)"""
+
+    def __init__(self, budget=16 * 1024 * 1024):
+        self.budget = budget
+        self.nbytes = 0
+        self._undo = defaultdict(list)
+        self._redo = defaultdict(list)
+        self._order = deque()   # (path, edit) ตามลำดับเวลา ใช้หาอันที่เก่าที่สุดตอนเกินงบ
+
+    def push(self, path, edit):
+        dropped = self._redo.pop(path, [])
+        if dropped:
+            # ขั้น redo ที่ทิ้งต้องออกจาก _order ด้วย ไม่งั้น mask ที่ pack ไว้ยังค้างในหน่วยความจำ
+            for old in dropped:
+                self.nbytes -= old.nbytes
+            dead = {id(e) for e in dropped}
+            self._order = deque(item for item in self._order if id(item[1]) not in dead)
+        self._undo[path].append(edit)
+        self._order.append((path, edit))
+        self.nbytes += edit.nbytes
+        while self.nbytes > self.budget and self._order:
+            p, old = self._order.popleft()
+            for stack in (self._undo.get(p), self._redo.get(p)):
+                if stack and any(e is old for e in stack):
+                    stack.remove(old)
+                    self.nbytes -= old.nbytes
+                    break
+
+    def undo(self, path):
+        stack = self._undo.get(path)
+        if not stack:
+            return None
+        edit = stack.pop()
+        self._redo[path].append(edit)
+        return edit
+
+    def redo(self, path):
+        stack = self._redo.get(path)
+        if not stack:
+            return None
+        edit = stack.pop()
+        self._undo[path].append(edit)
+        return edit
+
+    def counts(self, path):
+        return len(self._undo.get(path, ())), len(self._redo.get(path, ()))
+
+
+# ---------- Annotation journal ----------
+JOURNAL_DIRNAME = ".labels_journal"
+
+def _b64(data):
+    return base64.b64encode(data).decode("ascii")
+
+
+class AnnotationJournal:
+    """autosave ของ label ต่อโฟลเดอร์รูป: <folder>/.labels_journal/
+
+    journal.jsonl : log แบบ append-only ของทุกการแก้ (boxes ทั้งรายการ / patch ของ mask)
+    snapshot.json : สถานะรวมล่าสุด thread เขียนรวม log เข้า snapshot เป็นระยะแล้วเริ่ม log ใหม่
+    ทุก op ใช้ซ้ำได้ (idempotent) ถ้าล่มหลังเขียน snapshot แต่ก่อนล้าง log ก็ replay ได้ถูกต้อง
+
+    state: ชื่อไฟล์ -> {"size": [w, h], "boxes": [...], "masks": {cls: {"base": b64|None, "patches": [...]}}}
+           (+ "unreviewed": True ถ้า label มาจาก pre-label และยังไม่มีคนเปิดดู)
+    patch ของ mask เก็บต่อท้ายไว้ก่อน (โหลดเร็ว) แล้วค่อยรวมเข้า base ตอน compact
+    """
+
+    def __init__(self, folder, compact_every=500):
+        self.folder = folder
+        self.dir = os.path.join(folder, JOURNAL_DIRNAME)
+        self.log_path = os.path.join(self.dir, "journal.jsonl")
+        self.snapshot_path = os.path.join(self.dir, "snapshot.json")
+        self.compact_every = compact_every
+        self.errors = []
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        os.makedirs(self.dir, exist_ok=True)
+        self.state, self._ops_since_snapshot = self._load()
+        self._thread = threading.Thread(target=self._writer, daemon=True)
+        self._thread.start()
+
+    # ---- โหลด ----
+    def _load(self):
+        state = {}
+        try:
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                state = json.load(f).get("images", {})
+        except (OSError, ValueError):
+            pass
+        n = 0
+        try:
+            with open(self.log_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        op = json.loads(line)
+                    except ValueError:
+                        continue  # บรรทัดสุดท้ายที่เขียนไม่จบตอนล่ม
+                    self._apply(state, op)
+                    n += 1
+        except OSError:
+            pass
+        return state, n
+
+    @staticmethod
+    def _apply(state, op):
+        entry = state.setdefault(op["img"], {"size": None, "boxes": [], "masks": {}})
+        if op.get("size"):
+            entry["size"] = op["size"]
+        if op["op"] == "boxes":
+            entry["boxes"] = op["boxes"]
+        elif op["op"] == "mask":
+            m = entry["masks"].setdefault(str(op["cls"]), {"base": None, "patches": []})
+            m["patches"].append([op["rect"], op["w"], op["h"], op["data"]])
+        elif op["op"] == "review":
+            if op["unreviewed"]:
+                entry["unreviewed"] = True
+            else:
+                entry.pop("unreviewed", None)
+
+    def masks_for(self, name):
+        """สร้าง {cls: PIL "L"} ของรูปจาก state (เรียกจาก MaskStore ตอนเปิดรูปครั้งแรก)"""
+        with self._lock:
+            entry = self.state.get(name)
+            if not entry or not entry["size"]:
+                return {}
+            size = tuple(entry["size"])
+            items = [(cls, m["base"], list(m["patches"])) for cls, m in entry["masks"].items()]
+        return {int(cls): self._materialize(size, base, patches) for cls, base, patches in items}
+
+    @staticmethod
+    def _materialize(size, base, patches):
+        if base is None:
+            mask = Image.new("L", size, 0)
+        else:
+            mask = unpack_mask(size, base64.b64decode(base))
+        for rect, w, h, data in patches:
+            mask.paste(unpack_mask((w, h), base64.b64decode(data)), tuple(rect[:2]))
+        return mask
+
+    # ---- บันทึก (เรียกจาก Tk thread: แค่แปลงเป็น dict แล้วใส่คิว) ----
+    def record(self, name, edit, side="after", size=None):
+        for op in self._ops_for(name, edit, side, size):
+            self._queue.put(op)
+
+    def mark_unreviewed(self, name, flag=True):
+        """label ของรูปนี้มาจากโมเดล (True) หรือคนตรวจแล้ว (False)"""
+        self._queue.put({"op": "review", "img": name, "unreviewed": bool(flag)})
+
+    def _ops_for(self, name, edit, side, size):
+        size = list(size) if size else None
+        if isinstance(edit, GroupEdit):
+            edits = reversed(edit.edits) if side == "before" else edit.edits
+            return [op for e in edits for op in self._ops_for(name, e, side, size)]
+        if isinstance(edit, BoxEdit):
+            boxes = edit.before if side == "before" else edit.after
+            return [{"op": "boxes", "img": name, "size": size,
+                     "boxes": [[int(b[0])] + [float(v) for v in b[1:]] for b in boxes]}]
+        (w, h), data = edit.before if side == "before" else edit.after
+        return [{"op": "mask", "img": name, "size": size, "cls": int(edit.cls_id),
+                 "rect": list(edit.rect), "w": w, "h": h, "data": _b64(data)}]
+
+    def flush(self, timeout=10.0):
+        """รอจน op ที่อยู่ในคิวถูกเขียนและรวมเข้า state แล้ว"""
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def snapshot_state(self):
+        # สำเนาตื้นพอ: string ของ patch เป็น immutable, list ถูกคัดลอก
+        with self._lock:
+            return {name: {"size": e["size"], "boxes": list(e["boxes"]),
+                           "masks": {c: (m["base"], list(m["patches"])) for c, m in e["masks"].items()}}
+                    for name, e in self.state.items()}
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    # ---- thread เขียน ----
+    def _writer(self):
+        f = open(self.log_path, "a", encoding="utf-8")
+        stop = False
+        while not stop:
+            ops = [self._queue.get()]
+            while True:
+                try:
+                    ops.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if ops[-1] is None:
+                stop = True
+            waiters = [op for op in ops if isinstance(op, threading.Event)]
+            ops = [op for op in ops if isinstance(op, dict)]
+            try:
+                if ops:
+                    f.write("".join(json.dumps(op, ensure_ascii=False) + "\n" for op in ops))
+                    f.flush()
+                    os.fsync(f.fileno())
+                    with self._lock:
+                        for op in ops:
+                            self._apply(self.state, op)
+                    self._ops_since_snapshot += len(ops)
+                if self._ops_since_snapshot >= self.compact_every or (stop and self._ops_since_snapshot):
+                    f.close()
+                    self._compact()
+                    f = open(self.log_path, "w", encoding="utf-8")
+            except Exception as e:
+                self.errors.append(str(e))
+                print(f"❌ เขียน journal ไม่สำเร็จ: {e}")
+            for w in waiters:
+                w.set()
+        f.close()
+
+    def _compact(self):
+        # รวม patch เข้า base ทีละ mask (นอก lock) แล้วเขียน snapshot แบบ atomic
+        with self._lock:
+            todo = [(name, cls, tuple(entry["size"]), m["base"], list(m["patches"]))
+                    for name, entry in self.state.items() if entry["size"]
+                    for cls, m in entry["masks"].items() if m["patches"]]
+        merged = {}
+        for name, cls, size, base, patches in todo:
+            mask = self._materialize(size, base, patches)
+            merged[(name, cls)] = (None if mask.getbbox() is None else _b64(pack_mask(mask)[1]), len(patches))
+        with self._lock:
+            for (name, cls), (base, n) in merged.items():
+                m = self.state[name]["masks"][cls]
+                m["base"] = base
+                del m["patches"][:n]   # patch ที่มาระหว่าง compact ยังอยู่
+            data = json.dumps({"version": 1, "images": self.state}, ensure_ascii=False)
+        tmp = self.snapshot_path + ".part"
+        with open(tmp, "w", encoding="utf-8") as out:
+            out.write(data)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp, self.snapshot_path)
+        self._ops_since_snapshot = 0
+
+
+# ---------- Label export ----------
+EXPORT_STATE_NAME = ".export_state.json"
+
+def link_or_copy(src, dst):
+    """ไฟล์เหมือนเดิมทุก byte: hard link ถ้าอยู่ดิสก์เดียวกัน ไม่งั้นคัดลอก"""
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def reencode_jpeg(src, dst, quality=95):
+    # ใช้ใน process pool: เฉพาะไฟล์ที่ไม่ใช่ JPEG
+    with Image.open(src) as im:
+        im.convert("RGB").save(dst, quality=quality)
+
+def export_mask_lines(size, masks, min_iou=None, min_area=0):
+    """ใช้ใน process pool: masks = {cls: (base, patches)} จาก journal -> บรรทัด polygon ของ YOLO segment
+
+    คืน (lines, [จำนวนจุดก่อนลด, หลังลด, ผลรวม IoU กับ mask, จำนวน mask])
+    """
+    w, h = size
+    lines = []
+    report = [0, 0, 0.0, 0]
+    for cls, (base, patches) in masks.items():
+        mask_np = np.array(AnnotationJournal._materialize(tuple(size), base, patches))
+        if not mask_np.any():
+            continue
+        raw = mask_to_polygons(mask_np)
+        polys = raw if min_iou is None and not min_area else mask_to_polygons(mask_np, min_iou, min_area)
+        drawn = np.zeros_like(mask_np)
+        if polys:
+            cv2.fillPoly(drawn, polys, 255)
+        inter = np.count_nonzero((drawn > 0) & (mask_np > 0))
+        report[0] += sum(len(p) for p in raw)
+        report[1] += sum(len(p) for p in polys)
+        report[2] += float(inter) / max(1, np.count_nonzero((drawn > 0) | (mask_np > 0)))
+        report[3] += 1
+        for poly in polys:
+            lines.append(f"{cls} " + " ".join(normalize_polygon(poly, w, h)))
+    return lines, report
+
+def _export_fingerprint(path, entry, options=None):
+    # options: ค่าที่มีผลกับไฟล์ label (เช่นระดับการลดจุด) เปลี่ยนแล้วต้อง export ใหม่
+    st = os.stat(path)
+    key = json.dumps([1, st.st_mtime_ns, st.st_size, entry, options], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+def export_labels(images, folder, state, out_dir, progress=None, workers=None, min_iou=None, min_area=0):
+    """export รูป + label แบบ YOLO เฉพาะรูปที่เปลี่ยนตั้งแต่ export ครั้งก่อน
+
+    images: path ของรูปทั้งหมด, state: AnnotationJournal.snapshot_state()
+    progress: list [ทำแล้ว, ทั้งหมด] ให้ UI อ่าน คืน dict สถิติ
+    min_iou/min_area: การลดจุด polygon ของ mask (ดู mask_to_polygons)
+    """
+    images_out = os.path.join(out_dir, "images")
+    labels_out = os.path.join(out_dir, "labels")
+    os.makedirs(images_out, exist_ok=True)
+    os.makedirs(labels_out, exist_ok=True)
+    state_path = os.path.join(out_dir, EXPORT_STATE_NAME)
+    try:
+        with open(state_path, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+    except (OSError, ValueError):
+        previous = {}
+
+    progress = progress if progress is not None else [0, 0]
+    progress[:] = [0, len(images)]
+    done_state = {}
+    stats = {"exported": 0, "skipped": 0, "linked": 0, "reencoded": 0, "masks": 0,
+             "vertices_before": 0, "vertices_after": 0, "mask_iou": 1.0}
+    iou = [0.0, 0]
+    options = [min_iou, min_area]
+    pool = None
+    try:
+        pending = []   # (label_path, box_lines, future ของรูป, future ของ mask, ชื่อ, fingerprint)
+        for path in images:
+            name = os.path.relpath(path, folder)
+            base, ext = os.path.splitext(os.path.basename(path))
+            entry = state.get(name, {"size": None, "boxes": [], "masks": {}})
+            fp = _export_fingerprint(path, entry, options if entry["masks"] else None)
+            img_dst = os.path.join(images_out, base + ".jpg")
+            lbl_dst = os.path.join(labels_out, base + ".txt")
+            if previous.get(name) == fp and os.path.exists(img_dst) and os.path.exists(lbl_dst):
+                done_state[name] = fp
+                stats["skipped"] += 1
+                progress[0] += 1
+                continue
+
+            is_jpeg = ext.lower() in (".jpg", ".jpeg")
+            has_mask = bool(entry["size"]) and any(b or p for b, p in entry["masks"].values())
+            if (has_mask or not is_jpeg) and pool is None:
+                pool = process_pool(workers)
+            img_future = None
+            if is_jpeg:
+                link_or_copy(path, img_dst)
+                stats["linked"] += 1
+            else:
+                img_future = pool.submit(reencode_jpeg, path, img_dst)
+                stats["reencoded"] += 1
+
+            size = entry["size"]
+            if size is None and entry["boxes"]:
+                with Image.open(path) as im:  # อ่านแค่ header ไม่ decode
+                    size = im.size
+            box_lines = []
+            for (cls_id, x1, y1, x2, y2) in entry["boxes"]:
+                cx, cy, bw, bh = compute_yolo_bbox(size[0], size[1], x1, y1, x2, y2)
+                box_lines.append(f"{cls_id} {cx:.6f} {cy:.6f} {bw:.6f} {bh:.6f}")
+            mask_future = None
+            if has_mask:
+                mask_future = pool.submit(export_mask_lines, entry["size"], entry["masks"], min_iou, min_area)
+                stats["masks"] += 1
+            pending.append((lbl_dst, box_lines, img_future, mask_future, name, fp))
+
+            # เขียนไฟล์ที่เสร็จแล้วไปเรื่อยๆ ไม่ให้ future ค้างในหน่วยความจำเยอะ
+            while pending and (all(fu is None or fu.done() for fu in pending[0][2:4]) or len(pending) > 256):
+                _write_label(pending.pop(0), done_state, progress, stats, iou)
+        while pending:
+            _write_label(pending.pop(0), done_state, progress, stats, iou)
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True)
+        tmp = state_path + ".part"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({**previous, **done_state}, f)
+        os.replace(tmp, state_path)
+    if iou[1]:
+        stats["mask_iou"] = iou[0] / iou[1]
+    return stats
+
+def _write_label(item, done_state, progress, stats, iou):
+    lbl_dst, lines, img_future, mask_future, name, fp = item
+    if img_future is not None:
+        img_future.result()  # ให้ error ของการ encode โผล่ที่นี่
+    if mask_future is not None:
+        mask_lines, report = mask_future.result()
+        lines = lines + mask_lines
+        stats["vertices_before"] += report[0]
+        stats["vertices_after"] += report[1]
+        iou[0] += report[2]
+        iou[1] += report[3]
+    with open(lbl_dst, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines))
+    done_state[name] = fp
+    stats["exported"] += 1
+    progress[0] += 1
+
+
+# ---------- Image prefetch ----------
+def load_label_image(path):
+    """ถอดรหัสรูปสำหรับหน้า Label: คืน (PIL RGB, numpy RGB) ที่พร้อมใช้เป็นภาพฐานของ renderer"""
+    with Image.open(path) as im:
+        pil = im.convert("RGB")
+    return pil, np.asarray(pil, dtype=np.uint8)
+
+
+class ImagePrefetcher:
+    """ถอดรหัสรูปถัดไป/ก่อนหน้าไว้ล่วงหน้าใน thread แยก ตามทิศที่ผู้ใช้กำลังเลื่อน
+
+    เก็บใน cache ขนาดจำกัด (max_bytes) รูปที่อยู่ในช่วงที่ต้องการจะไม่ถูกไล่ออกก่อนรูปอื่น
+    """
+
+    def __init__(self, loader=load_label_image, ahead=3, behind=1, max_bytes=512 * 1024 * 1024):
+        self.loader = loader
+        self.ahead = ahead
+        self.behind = behind
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()   # path -> (item, nbytes)
+        self._bytes = 0
+        self._wanted = []             # ลำดับที่ควรโหลด (ใกล้สุดก่อน)
+        self._keep = set()            # รูปในช่วงปัจจุบัน (ไล่ออกเป็นลำดับสุดท้าย)
+        self._cond = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target=self._worker, daemon=True)
+        self._thread.start()
+
+    def get(self, path):
+        """คืน item ที่โหลดไว้แล้ว หรือโหลดเองทันทีถ้ายังไม่มี"""
+        with self._cond:
+            entry = self._cache.get(path)
+            if entry is not None:
+                self._cache.move_to_end(path)
+                self.hits += 1
+                return entry[0]
+        self.misses += 1
+        item = self.loader(path)
+        self._store(path, item)
+        return item
+
+    def update(self, paths, index, direction):
+        """แจ้งตำแหน่งปัจจุบัน: โหลดล่วงหน้า ahead รูปตามทิศ direction และ behind รูปย้อนกลับ"""
+        step = 1 if direction >= 0 else -1
+        order = [index + step * k for k in range(1, self.ahead + 1)]
+        order += [index - step * k for k in range(1, self.behind + 1)]
+        with self._cond:
+            self._wanted = [paths[i] for i in order if 0 <= i < len(paths)]
+            self._keep = set(self._wanted) | {paths[index]}
+            self._cond.notify()
+
+    def clear(self):
+        with self._cond:
+            self._cache.clear()
+            self._bytes = 0
+            self._wanted = []
+            self._keep = set()
+
+    def close(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+
+    @staticmethod
+    def _item_bytes(item):
+        # PIL RGB เก็บ 4 bytes ต่อ pixel ภายใน
+        return sum(x.width * x.height * 4 if isinstance(x, Image.Image) else getattr(x, "nbytes", 0)
+                   for x in item)
+
+    def _store(self, path, item):
+        nbytes = self._item_bytes(item)
+        with self._cond:
+            if path in self._cache:
+                return
+            self._cache[path] = (item, nbytes)
+            self._bytes += nbytes
+            # ไล่รูปที่อยู่นอกช่วงออกก่อน (เก่าสุดก่อน) แล้วค่อยเป็นรูปในช่วง
+            order = [p for p in self._cache if p not in self._keep] + [p for p in self._cache if p in self._keep]
+            for p in order:
+                if self._bytes <= self.max_bytes:
+                    break
+                if p != path:
+                    self._bytes -= self._cache.pop(p)[1]
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while self._running and not any(p not in self._cache for p in self._wanted):
+                    self._cond.wait()
+                if not self._running:
+                    return
+                path = next(p for p in self._wanted if p not in self._cache)
+            try:
+                item = self.loader(path)
+            except Exception as e:
+                print(f"โหลดรูปล่วงหน้าไม่ได้: {path}: {e}")
+                with self._cond:
+                    self._wanted = [p for p in self._wanted if p != path]
+                continue
+            self._store(path, item)
+
+
+# ---------- Pre-labeling ----------
+PRELABEL_BATCH = 8
+
+def prediction_to_labels(result):
+    """ผล YOLO หนึ่งรูป -> ((w, h), boxes, {cls: mask uint8}) ในพิกัดรูปต้นฉบับ (mask เฉพาะโมเดล -seg)"""
+    h, w = result.orig_shape
+    boxes, masks = [], {}
+    if result.boxes is None or len(result.boxes) == 0:
+        return (w, h), boxes, masks
+    cls_ids = result.boxes.cls.cpu().numpy().astype(int)
+    xyxy = result.boxes.xyxy.cpu().numpy()
+    polys = result.masks.xy if result.masks is not None else None
+    for i, cid in enumerate(cls_ids.tolist()):
+        x1, y1, x2, y2 = (float(v) for v in xyxy[i])
+        boxes.append((cid, x1, y1, x2, y2))
+        if polys is not None and len(polys[i]) >= 3:
+            mask = masks.setdefault(cid, np.zeros((h, w), np.uint8))
+            cv2.fillPoly(mask, [np.round(polys[i]).astype(np.int32)], 255)
+    return (w, h), boxes, masks
+
+
+# ---------- Auto segment (GrabCut) ----------
+GRABCUT_MAX_SIDE = 360   # ย่อ ROI ให้ด้านยาวไม่เกินนี้ก่อนเข้า grabCut
+
+def grabcut_mask(image_rgb, rect, fg=(), bg=(), brush=6, iters=4, max_side=GRABCUT_MAX_SIDE):
+    """ตัดวัตถุในกรอบ rect=(x1, y1, x2, y2) ด้วย cv2.grabCut บนภาพ ROI ที่ย่อแล้ว
+
+    fg/bg: เส้นขีด (list ของ list จุด (x, y) พิกัดรูป) บอกว่าตรงนั้นเป็นวัตถุ/พื้นหลังแน่ๆ
+    คืน (roi, mask) โดย roi=(x0, y0, x1, y1) ในพิกัดรูป และ mask เป็น uint8 0/255 ขนาดเท่า roi
+    """
+    H, W = image_rgb.shape[:2]
+    x1, y1, x2, y2 = (int(round(v)) for v in rect)
+    x1, x2 = sorted((max(0, min(W, x1)), max(0, min(W, x2))))
+    y1, y2 = sorted((max(0, min(H, y1)), max(0, min(H, y2))))
+    if x2 - x1 < 4 or y2 - y1 < 4:
+        return None, None
+    # ขอบรอบกรอบให้ grabCut มีตัวอย่างสีพื้นหลัง
+    m = max(8, int(0.15 * max(x2 - x1, y2 - y1)))
+    roi = (max(0, x1 - m), max(0, y1 - m), min(W, x2 + m), min(H, y2 + m))
+    rw, rh = roi[2] - roi[0], roi[3] - roi[1]
+    s = min(1.0, max_side / max(rw, rh))
+    sw, sh = max(1, int(round(rw * s))), max(1, int(round(rh * s)))
+    small = cv2.resize(image_rgb[roi[1]:roi[3], roi[0]:roi[2]], (sw, sh), interpolation=cv2.INTER_AREA)
+
+    def to_small(x, y):
+        return int(round((x - roi[0]) * s)), int(round((y - roi[1]) * s))
+
+    gc = np.full((sh, sw), cv2.GC_BGD, np.uint8)
+    (a, b), (c, d) = to_small(x1, y1), to_small(x2, y2)
+    gc[b:d, a:c] = cv2.GC_PR_FGD
+    if not (gc == cv2.GC_BGD).any():
+        # กรอบชิดขอบรูปทุกด้าน: ให้ขอบ ROI เป็น "น่าจะพื้นหลัง" ไว้เป็นตัวอย่างสี
+        gc[[0, -1], :] = cv2.GC_PR_BGD
+        gc[:, [0, -1]] = cv2.GC_PR_BGD
+    width = max(1, int(round(brush * s)))
+    for strokes, value in ((fg, cv2.GC_FGD), (bg, cv2.GC_BGD)):
+        for stroke in strokes:
+            pts = np.array([to_small(x, y) for x, y in stroke], np.int32).reshape(-1, 1, 2)
+            cv2.polylines(gc, [pts], False, int(value), width)
+            for p in pts[:1]:
+                cv2.circle(gc, tuple(int(v) for v in p[0]), width, int(value), -1)
+    bgd, fgd = np.zeros((1, 65), np.float64), np.zeros((1, 65), np.float64)
+    try:
+        cv2.grabCut(small, gc, None, bgd, fgd, iters, cv2.GC_INIT_WITH_MASK)
+    except cv2.error:
+        # เช่นไม่มี pixel พื้นหลังเลย (กรอบเต็มรูป)
+        return roi, np.zeros((rh, rw), np.uint8)
+    fg_small = np.where((gc == cv2.GC_FGD) | (gc == cv2.GC_PR_FGD), 255, 0).astype(np.uint8)
+
+    # ขยายกลับขนาดจริง (linear แล้ว threshold ให้ขอบเรียบ) แล้วเก็บกวาดจุดเล็กๆ
+    mask = cv2.resize(fg_small, (rw, rh), interpolation=cv2.INTER_LINEAR)
+    mask = np.where(mask >= 128, 255, 0).astype(np.uint8)
+    k = max(3, int(round(1.0 / s)) | 1)
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (k, k))
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+    n, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    if n > 2:
+        areas = stats[1:, cv2.CC_STAT_AREA]
+        keep = np.flatnonzero(areas >= 0.05 * areas.max()) + 1
+        mask = np.where(np.isin(labels, keep), 255, 0).astype(np.uint8)
+    return roi, mask
+
+
+# ---------- Label propagation (tracking) ----------
+def load_track_gray(path, size=None):
+    """ภาพ gray ย่อสำหรับ tracking: ให้ libjpeg ถอดรหัสแบบย่อ 1/2, 1/4 ตรงๆ (เร็วกว่า decode เต็มแล้วย่อ)
+
+    คืน (gray, scale) โดย scale = ขนาดย่อ / ขนาดจริง
+    """
+    if size is None:
+        with Image.open(path) as im:
+            size = im.size
+    side = max(size)
+    flag = (cv2.IMREAD_REDUCED_GRAYSCALE_4 if side > 2560 else
+            cv2.IMREAD_REDUCED_GRAYSCALE_2 if side > 1280 else cv2.IMREAD_GRAYSCALE)
+    gray = cv2.imread(path, flag)
+    if gray is None:
+        raise ValueError(f"อ่านรูปไม่ได้: {path}")
+    return gray, gray.shape[1] / size[0]
+
+def estimate_motion(prev_gray, cur_gray, rect):
+    """การเคลื่อนที่ของวัตถุในกรอบ rect=(x1, y1, x2, y2) (พิกัดภาพ gray) จาก prev -> cur
+
+    sparse optical flow (LK ไป-กลับ) + estimateAffinePartial2D ได้ทั้งเลื่อน/หมุน/ย่อขยาย
+    แต่เช็กกับ template matching (เลื่อนอย่างเดียว) ในบริเวณรอบกรอบเดิมด้วย ถ้า flow ไม่พอหรือ
+    ตำแหน่งของ flow เข้ากับภาพแย่กว่าชัดเจนก็ใช้ template แทน คืน (M 2x3, วิธีที่ใช้)
+    """
+    h, w = prev_gray.shape
+    x1, y1, x2, y2 = (int(round(v)) for v in rect)
+    x1, y1, x2, y2 = max(0, x1), max(0, y1), min(w, x2), min(h, y2)
+    identity = np.float32([[1, 0, 0], [0, 1, 0]])
+    if x2 - x1 < 4 or y2 - y1 < 4:
+        return identity, "copy"
+
+    flow = None
+    roi_mask = np.zeros_like(prev_gray)
+    roi_mask[y1:y2, x1:x2] = 255
+    pts = cv2.goodFeaturesToTrack(prev_gray, maxCorners=80, qualityLevel=0.01, minDistance=4, mask=roi_mask)
+    if pts is not None and len(pts) >= 6:
+        lk = dict(winSize=(21, 21), maxLevel=3,
+                  criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03))
+        nxt, st, _ = cv2.calcOpticalFlowPyrLK(prev_gray, cur_gray, pts, None, **lk)
+        back, st2, _ = cv2.calcOpticalFlowPyrLK(cur_gray, prev_gray, nxt, None, **lk)
+        good = (st[:, 0] == 1) & (st2[:, 0] == 1) & (np.linalg.norm(back - pts, axis=2)[:, 0] < 1.0)
+        if good.sum() >= 6:
+            M, inliers = cv2.estimateAffinePartial2D(pts[good], nxt[good], method=cv2.RANSAC,
+                                                     ransacReprojThreshold=2.0)
+            # จุดส่วนใหญ่ต้องไปทางเดียวกัน ไม่งั้นถือว่า flow หลง
+            if M is not None and inliers is not None and inliers.sum() >= max(5, 0.5 * good.sum()):
+                flow = M.astype(np.float32)
+
+    template = prev_gray[y1:y2, x1:x2]
+    bw, bh = x2 - x1, y2 - y1
+    sx1, sy1 = max(0, x1 - bw), max(0, y1 - bh)
+    sx2, sy2 = min(w, x2 + bw), min(h, y2 + bh)
+    search = cur_gray[sy1:sy2, sx1:sx2]
+    if template.std() < 2 or search.shape[0] < bh or search.shape[1] < bw:
+        # พื้นเรียบไม่มีลาย: template matching เชื่อไม่ได้
+        return (flow, "flow") if flow is not None else (identity, "copy")
+    res = cv2.matchTemplate(search, template, cv2.TM_CCOEFF_NORMED)
+    _, best, _, loc = cv2.minMaxLoc(res)
+    if flow is not None:
+        # คะแนนของตำแหน่งที่ flow ทำนาย (ดูจากจุดกลางกรอบ)
+        cx, cy = flow @ np.float32([(x1 + x2) / 2, (y1 + y2) / 2, 1])
+        tx, ty = int(round(cx - bw / 2)) - sx1, int(round(cy - bh / 2)) - sy1
+        inside = 0 <= ty < res.shape[0] and 0 <= tx < res.shape[1]
+        if inside and res[ty, tx] >= best - 0.1:
+            return flow, "flow"
+    if best >= 0.5:
+        return np.float32([[1, 0, sx1 + loc[0] - x1], [0, 1, sy1 + loc[1] - y1]]), "template"
+    return (flow, "flow") if flow is not None else (identity, "copy")
+
+def _scale_affine(M, scale):
+    # M ในพิกัดภาพย่อ -> พิกัดรูปจริง (translation หารด้วย scale)
+    M = M.copy()
+    M[:, 2] /= scale
+    return M
+
+def propagate_labels(prev_gray, cur_gray, scale, boxes, masks, size):
+    """ติดตาม label ของรูปก่อนหน้าไปยังรูปปัจจุบัน
+
+    boxes: [(cls, x1, y1, x2, y2)] พิกัดรูปจริง, masks: {cls: uint8 HxW}, size=(w, h) ของรูปปัจจุบัน
+    คืน (boxes ใหม่, masks ใหม่, {วิธี: จำนวน}) mask ถูก warp แยกทีละ connected component
+    """
+    w, h = size
+    methods = defaultdict(int)
+    new_boxes = []
+    for cls_id, x1, y1, x2, y2 in boxes:
+        M, how = estimate_motion(prev_gray, cur_gray, (x1 * scale, y1 * scale, x2 * scale, y2 * scale))
+        methods[how] += 1
+        M = _scale_affine(M, scale)
+        corners = np.float32([[x1, y1], [x2, y1], [x2, y2], [x1, y2]])
+        moved = corners @ M[:, :2].T + M[:, 2]
+        nx1, ny1 = np.clip(moved.min(0), 0, (w, h))
+        nx2, ny2 = np.clip(moved.max(0), 0, (w, h))
+        if nx2 - nx1 > 1 and ny2 - ny1 > 1:
+            new_boxes.append((cls_id, float(nx1), float(ny1), float(nx2), float(ny2)))
+    new_masks = {}
+    for cls_id, mask in masks.items():
+        n, labels, stats, _ = cv2.connectedComponentsWithStats((mask > 0).astype(np.uint8), connectivity=8)
+        out = np.zeros((h, w), np.uint8)
+        for i in range(1, n):
+            x, y, bw, bh = stats[i, :4]
+            M, how = estimate_motion(prev_gray, cur_gray, (x * scale, y * scale, (x + bw) * scale, (y + bh) * scale))
+            methods[how] += 1
+            comp = np.where(labels == i, 255, 0).astype(np.uint8)
+            out = np.maximum(out, cv2.warpAffine(comp, _scale_affine(M, scale), (w, h), flags=cv2.INTER_NEAREST))
+        if out.any():
+            new_masks[cls_id] = out
+    return new_boxes, new_masks, dict(methods)
+
+
+# ---------- Near-duplicate detection ----------
+HASH_CACHE_DIR = os.path.join(CACHE_DIR, "dhash")
+DUPLICATES_DIRNAME = "_duplicates"
+DEDUP_RADIUS = 6   # bit: hash ต่างกันไม่เกินนี้ถือว่าเกือบซ้ำ
+
+def dhash(path):
+    """difference hash 64 bit: ภาพ gray 9x8 แล้วเทียบ pixel ซ้าย-ขวา (ใช้ใน process pool)"""
+    with Image.open(path) as im:
+        im.draft("L", (64, 64))   # JPEG: decode แบบย่อตั้งแต่แรก
+        small = np.asarray(im.convert("L").resize((9, 8), Image.BILINEAR), dtype=np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+def compute_hashes(paths, progress=None, workers=None):
+    """dHash ของทุกรูป: ใช้ค่าใน cache (key = mtime + ขนาดไฟล์) ที่เหลือคำนวณขนานใน process pool
+
+    cache อยู่ที่ HASH_CACHE_DIR/<sha1 ของโฟลเดอร์>.json คืน dict path -> hash
+    """
+    folder = os.path.dirname(os.path.abspath(paths[0])) if paths else ""
+    cache_path = os.path.join(HASH_CACHE_DIR, hashlib.sha1(folder.encode("utf-8")).hexdigest() + ".json")
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    progress = progress if progress is not None else [0, 0]
+    progress[:] = [0, len(paths)]
+    hashes, todo = {}, []
+    for p in paths:
+        st = os.stat(p)
+        key = f"{st.st_mtime_ns}:{st.st_size}"
+        hit = cache.get(os.path.basename(p))
+        if hit and hit[0] == key:
+            hashes[p] = int(hit[1], 16)
+            progress[0] += 1
+        else:
+            todo.append((p, key))
+    if todo:
+        with process_pool(workers) as pool:
+            for (p, key), h in zip(todo, pool.map(dhash, [p for p, _ in todo], chunksize=32)):
+                hashes[p] = h
+                cache[os.path.basename(p)] = [key, f"{h:016x}"]
+                progress[0] += 1
+        os.makedirs(HASH_CACHE_DIR, exist_ok=True)
+        tmp = cache_path + ".part"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(cache, f)
+        os.replace(tmp, cache_path)
+    return hashes
+
+
+class BKTree:
+    """BK-tree ของ hash 64 bit ตามระยะ Hamming: หาเพื่อนบ้านในรัศมี r โดยไม่ต้องเทียบทุกคู่"""
+
+    def __init__(self):
+        self.root = None   # [hash, item, {ระยะ: node ลูก}]
+
+    def add(self, h, item):
+        if self.root is None:
+            self.root = [h, item, {}]
+            return
+        node = self.root
+        while True:
+            d = bin(h ^ node[0]).count("1")
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [h, item, {}]
+                return
+            node = child
+
+    def search(self, h, radius):
+        out = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            d = bin(h ^ node[0]).count("1")
+            if d <= radius:
+                out.append(node[1])
+            for dist, child in node[2].items():
+                if d - radius <= dist <= d + radius:
+                    stack.append(child)
+        return out
+
+def near_duplicate_clusters(hashes, radius=6):
+    """จัดกลุ่มรูปที่ hash ห่างกันไม่เกิน radius bit (เชื่อมต่อกันเป็นทอดๆ ด้วย union-find)
+
+    คืน list ของกลุ่ม (list ของ path เรียงตามชื่อ) เฉพาะกลุ่มที่มีมากกว่า 1 รูป
+    """
+    paths = sorted(hashes)
+    parent = list(range(len(paths)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    tree = BKTree()
+    for i, p in enumerate(paths):
+        for j in tree.search(hashes[p], radius):
+            a, b = find(i), find(j)
+            if a != b:
+                parent[max(a, b)] = min(a, b)
+        tree.add(hashes[p], i)
+    groups = defaultdict(list)
+    for i, p in enumerate(paths):
+        groups[find(i)].append(p)
+    return [g for g in groups.values() if len(g) > 1]
+
+def unique_path(path):
+    """path ที่ยังไม่มีไฟล์อยู่: ถ้าชื่อซ้ำต่อท้าย _1, _2, ... (ไม่เขียนทับของเดิม)"""
+    base, ext = os.path.splitext(path)
+    n = 0
+    while os.path.lexists(path):
+        n += 1
+        path = f"{base}_{n}{ext}"
+    return path
+
+
 # ---------- Tab 2: Labeling ----------
 class LabelTab(ctk.CTkFrame):
     def __init__(self, master, get_projects_callable):
@@ -399,8 +2371,9 @@ class LabelTab(ctk.CTkFrame):
         self.browse_btn = ctk.CTkButton(sel_frame, text="เลือกโฟลเดอร์ภายนอก", command=self._browse_external)
         self.browse_btn.grid(row=0, column=2, padx=4, pady=6, sticky="e")
 
-        self.thumb_scroll = ctk.CTkScrollableFrame(left, label_text="รูปทั้งหมดในโปรเจกต์")
-        self.thumb_scroll.grid(row=2, column=0, sticky="nsew", padx=6, pady=6)
+        ctk.CTkLabel(left, text="รูปทั้งหมดในโปรเจกต์").grid(row=1, column=0, sticky="w", padx=10)
+        self.thumb_strip = ThumbStrip(left, on_select=self._select_index)
+        self.thumb_strip.grid(row=2, column=0, sticky="nsew", padx=6, pady=6)
 
         # Center viewer (scrollable with zoom)
         center = ctk.CTkFrame(self)
@@ -414,9 +2387,9 @@ class LabelTab(ctk.CTkFrame):
         self.tkcanvas.grid(row=0, column=0, sticky="nsew")
 
         # Add scrollbars
-        vbar = ctk.CTkScrollbar(center, command=self.tkcanvas.yview)
+        vbar = ctk.CTkScrollbar(center, command=self._yview)
         vbar.grid(row=0, column=2, sticky="ns")
-        hbar = ctk.CTkScrollbar(center, orientation="horizontal", command=self.tkcanvas.xview)
+        hbar = ctk.CTkScrollbar(center, orientation="horizontal", command=self._xview)
         hbar.grid(row=1, column=0, sticky="ew")
         self.tkcanvas.configure(yscrollcommand=vbar.set, xscrollcommand=hbar.set)
 
@@ -430,9 +2403,14 @@ class LabelTab(ctk.CTkFrame):
 
         self.tool_var = ctk.StringVar(value="box")
         self.tool_seg = ctk.CTkRadioButton(right, text="Brush Marker (Segment)", variable=self.tool_var, value="segment")
-        self.tool_box = ctk.CTkRadioButton(right, text="Bounding Box (Detect)", variable=self.tool_var, value="box")
+        tool_row = ctk.CTkFrame(right, fg_color="transparent")
+        self.tool_box = ctk.CTkRadioButton(tool_row, text="Bounding Box (Detect)", variable=self.tool_var, value="box")
+        self.tool_auto = ctk.CTkRadioButton(tool_row, text="Auto Segment (กรอบ + ขีด)", variable=self.tool_var,
+                                            value="grabcut", command=self._end_grabcut)
         self.tool_seg.grid(row=1, column=0, sticky="w", padx=6, pady=4)
-        self.tool_box.grid(row=2, column=0, sticky="w", padx=6, pady=4)
+        tool_row.grid(row=2, column=0, sticky="w")
+        self.tool_box.grid(row=0, column=0, sticky="w", padx=6, pady=4)
+        self.tool_auto.grid(row=1, column=0, sticky="w", padx=6, pady=4)
 
         size_frame = ctk.CTkFrame(right)
         size_frame.grid(row=3, column=0, sticky="ew", padx=6, pady=6)
@@ -470,26 +2448,112 @@ class LabelTab(ctk.CTkFrame):
         self.clear_mask_btn.grid(row=6, column=0, sticky="ew", padx=6, pady=6)
         self.clear_boxes_btn.grid(row=7, column=0, sticky="ew", padx=6, pady=6)
 
-        self.export_btn = ctk.CTkButton(right, text="Export", fg_color="#2a8", hover_color="#277", command=self._export_labels)
-        self.export_btn.grid(row=8, column=0, sticky="ew", padx=6, pady=10)
+        export_frame = ctk.CTkFrame(right)
+        export_frame.grid(row=8, column=0, sticky="ew", padx=6, pady=10)
+        export_frame.grid_columnconfigure(1, weight=1)
+        ctk.CTkLabel(export_frame, text="ลดจุด polygon:").grid(row=0, column=0, padx=4, pady=4, sticky="w")
+        self.simplify_var = ctk.StringVar(value="ปกติ")
+        ctk.CTkOptionMenu(export_frame, values=list(SIMPLIFY_PRESETS), variable=self.simplify_var).grid(
+            row=0, column=1, padx=4, pady=4, sticky="ew")
+        self.export_btn = ctk.CTkButton(export_frame, text="Export", fg_color="#2a8", hover_color="#277", command=self._export_labels)
+        self.export_btn.grid(row=1, column=0, columnspan=2, sticky="ew", padx=4, pady=4)
+
+        undo_frame = ctk.CTkFrame(right)
+        undo_frame.grid(row=10, column=0, sticky="ew", padx=6, pady=6)
+        undo_frame.grid_columnconfigure((0, 1), weight=1)
+        self.undo_btn = ctk.CTkButton(undo_frame, text="Undo", command=self.undo)
+        self.undo_btn.grid(row=0, column=0, sticky="ew", padx=4, pady=4)
+        self.redo_btn = ctk.CTkButton(undo_frame, text="Redo", command=self.redo)
+        self.redo_btn.grid(row=0, column=1, sticky="ew", padx=4, pady=4)
+
+        self.export_bar = ctk.CTkProgressBar(right)
+        self.export_bar.grid(row=11, column=0, sticky="ew", padx=6, pady=(6, 0))
+        self.export_label = ctk.CTkLabel(right, text="", anchor="w")
+        self.export_label.grid(row=12, column=0, sticky="ew", padx=6)
+        self.export_bar.grid_remove()
+        self.export_label.grid_remove()
+
+        pre_frame = ctk.CTkFrame(right)
+        pre_frame.grid(row=13, column=0, sticky="ew", padx=6, pady=6)
+        pre_frame.grid_columnconfigure(1, weight=1)
+        self.prelabel_btn = ctk.CTkButton(pre_frame, text="Pre-label ด้วยโมเดล (.pt)", command=self._start_prelabel)
+        self.prelabel_btn.grid(row=0, column=0, columnspan=2, sticky="ew", padx=4, pady=4)
+        self.prelabel_conf_label = ctk.CTkLabel(pre_frame, text="Conf: 0.50")
+        self.prelabel_conf_label.grid(row=1, column=0, padx=4, sticky="w")
+        self.prelabel_conf = ctk.CTkSlider(pre_frame, from_=0.05, to=0.95, number_of_steps=18,
+                                           command=lambda v: self.prelabel_conf_label.configure(text=f"Conf: {v:.2f}"))
+        self.prelabel_conf.set(0.5)
+        self.prelabel_conf.grid(row=1, column=1, padx=4, sticky="ew")
+        self.prelabel_bar = ctk.CTkProgressBar(pre_frame)
+        self.prelabel_bar.grid(row=2, column=0, columnspan=2, sticky="ew", padx=4, pady=(4, 0))
+        self.prelabel_cancel_btn = ctk.CTkButton(pre_frame, text="ยกเลิก", fg_color="#aa3333",
+                                                 command=self._cancel_prelabel)
+        self.prelabel_cancel_btn.grid(row=3, column=0, columnspan=2, sticky="ew", padx=4, pady=4)
+        self.prelabel_bar.grid_remove()
+        self.prelabel_cancel_btn.grid_remove()
+        self.prelabel_label = ctk.CTkLabel(pre_frame, text="", anchor="w", justify="left")
+        self.prelabel_label.grid(row=4, column=0, columnspan=2, sticky="ew", padx=4)
+        self.unreviewed_btn = ctk.CTkButton(pre_frame, text="ไปรูปที่ยังไม่ตรวจ", command=self.next_unreviewed)
+        self.unreviewed_btn.grid(row=5, column=0, columnspan=2, sticky="ew", padx=4, pady=4)
+
+        track_frame = ctk.CTkFrame(right)
+        track_frame.grid(row=14, column=0, sticky="ew", padx=6, pady=6)
+        track_frame.grid_columnconfigure(1, weight=1)
+        self.track_var = ctk.BooleanVar(value=False)
+        ctk.CTkCheckBox(track_frame, text="D: ติดตามการเคลื่อนที่ (แทนคัดลอกตรงๆ)", variable=self.track_var).grid(
+            row=0, column=0, columnspan=2, sticky="w", padx=4, pady=4)
+        self.track_count = ctk.CTkEntry(track_frame, width=60)
+        self.track_count.insert(0, "10")
+        self.track_count.grid(row=1, column=0, padx=4, pady=4)
+        self.track_btn = ctk.CTkButton(track_frame, text="ติดตามต่อไปข้างหน้า N รูป", command=self._toggle_track_batch)
+        self.track_btn.grid(row=1, column=1, sticky="ew", padx=4, pady=4)
+        self.track_label = ctk.CTkLabel(track_frame, text="", anchor="w", justify="left")
+        self.track_label.grid(row=2, column=0, columnspan=2, sticky="ew", padx=4)
+
+        dedup_frame = ctk.CTkFrame(right)
+        dedup_frame.grid(row=15, column=0, sticky="ew", padx=6, pady=6)
+        dedup_frame.grid_columnconfigure(1, weight=1)
+        ctk.CTkLabel(dedup_frame, text="ต่างกันไม่เกิน (bit):").grid(row=0, column=0, padx=4, pady=4, sticky="w")
+        self.dedup_radius = ctk.CTkEntry(dedup_frame, width=50)
+        self.dedup_radius.insert(0, str(DEDUP_RADIUS))
+        self.dedup_radius.grid(row=0, column=1, padx=4, pady=4, sticky="w")
+        self.dedup_btn = ctk.CTkButton(dedup_frame, text="หารูปซ้ำ (ย้ายไป _duplicates)", command=self._start_dedup)
+        self.dedup_btn.grid(row=1, column=0, columnspan=2, sticky="ew", padx=4, pady=4)
+        self.dedup_label = ctk.CTkLabel(dedup_frame, text="", anchor="w", justify="left")
+        self.dedup_label.grid(row=2, column=0, columnspan=2, sticky="ew", padx=4)
 
         self.help_label = ctk.CTkLabel(right, justify="left",
-            text="ปุ่มลัด:\n- Q: รูปก่อนหน้า\n- E: รูปถัดไป\n- D: คัดลอก Label จากรูปก่อนหน้า\nซูม: Ctrl + Scroll")
+            text="ปุ่มลัด:\n- Q: รูปก่อนหน้า\n- E: รูปถัดไป\n- D: คัดลอก Label จากรูปก่อนหน้า\n"
+                 "- U: รูปถัดไปที่ยังไม่ตรวจ (จาก Pre-label)\n"
+                 "- Auto Segment: ลากกรอบ แล้วขีดซ้าย=วัตถุ / ขวา=พื้นหลัง, Esc: จบ\n"
+                 "- Ctrl+Z / Ctrl+Y: Undo / Redo\nซูม: Ctrl + Scroll")
         self.help_label.grid(row=9, column=0, sticky="w", padx=6, pady=(6,0))
 
         # State
         self.current_project_dir = None
         self.images = []  # list of file paths
-        self.thumbs = []
-        self.thumb_widgets = []
         self.selected_index = -1
 
         # per-image annotations
         # boxes: list of (cls, x1,y1,x2,y2) in image coordinates
         # mask: PIL single-channel ("L") mask 0/255
         self.boxes_by_image = dict()
-        # self.mask_by_image = dict()
-        self.mask_by_image = dict()
+        # masks: {class_id: PIL "L"} ต่อรูป เก็บใน MaskStore (รูปที่ไม่ได้ใช้ถูกบีบ/ย้ายลงดิสก์)
+        self.mask_by_image = MaskStore()
+        self.prefetcher = ImagePrefetcher()
+        self._last_index = -1
+        self.history = EditHistory()
+        self.journal = None           # AnnotationJournal ของโฟลเดอร์ที่เปิดอยู่
+        self.manifest = None          # DatasetManifest ของโฟลเดอร์ที่เปิดอยู่
+        self._export_thread = None
+        self._export_progress = [0, 0]
+        self._export_result = None
+        self._prelabel = None         # งาน pre-label ที่กำลังรัน (dict) หรือ None
+        self.unreviewed = set()       # path ที่ label มาจากโมเดลและยังไม่มีคนเปิดดู
+        self._stroke = None           # {"cls", "before": ndarray|None, "rect"} ระหว่างลากแปรง
+        self._grabcut = None          # {"cls", "rect", "fg", "bg", "scribble"} ของวัตถุที่กำลังตัดด้วย Auto Segment
+        self._track_job = None        # งานติดตาม label ต่อหลายรูป (dict) หรือ None
+        self._dedup_job = None        # งานหารูปซ้ำที่กำลังรัน (dict) หรือ None
         self.size_by_image = dict()
 
 
@@ -500,15 +2564,25 @@ class LabelTab(ctk.CTkFrame):
         self.min_zoom, self.max_zoom = 0.2, 6.0
         self.tk_img_handle = None
         self.canvas_img_id = None
+        self._base_np = None          # RGB ของภาพต้นฉบับ
+        self._composite = None        # RGB ที่ผสม mask แล้ว (เต็มความละเอียด)
+        self._render_pending = False
+        self.img_offset_x = self.img_offset_y = 0
+        self._content_size = (1, 1)
         self.drawing_box = False
         self.box_start = None
 
         self.tkcanvas.bind("<ButtonPress-1>", self.on_mouse_down)
         self.tkcanvas.bind("<B1-Motion>", self.on_mouse_drag)
         self.tkcanvas.bind("<ButtonRelease-1>", self.on_mouse_up)
+        # คลิกขวา: ขีดพื้นหลังของ Auto Segment
+        self.tkcanvas.bind("<ButtonPress-3>", lambda e: self._grabcut_scribble(e, "bg", start=True))
+        self.tkcanvas.bind("<B3-Motion>", lambda e: self._grabcut_scribble(e, "bg"))
+        self.tkcanvas.bind("<ButtonRelease-3>", lambda e: self._grabcut_release())
         self.tkcanvas.bind("<Control-MouseWheel>", self.on_mouse_wheel)  # Windows
         self.tkcanvas.bind("<Control-Button-4>", self.on_mouse_wheel)    # Linux scroll up
         self.tkcanvas.bind("<Control-Button-5>", self.on_mouse_wheel)    # Linux scroll dn
+        self.tkcanvas.bind("<Configure>", lambda e: self.base_img is not None and self._refresh_view())
 
         # keyboard shortcuts bind to root
         # แก้ไขบรรทัดที่ 422
@@ -582,6 +2656,14 @@ class LabelTab(ctk.CTkFrame):
 
     def handle_key(self, event):
         key = event.keysym.lower()
+        if event.state & 0x4:  # Ctrl
+            if key == "z":
+                self.undo()
+                return "break"
+            if key == "y":
+                self.redo()
+                return "break"
+            return
         if key == "q":
             self.prev_image()
             return "break"
@@ -591,9 +2673,16 @@ class LabelTab(ctk.CTkFrame):
         elif key == "d":
             self.copy_prev_labels()
             return "break"
+        elif key == "u":
+            self.next_unreviewed()
+            return "break"
+        elif key == "escape":
+            self._end_grabcut()
+            return "break"
 
     def _list_project_names(self):
-        return sorted([d for d in os.listdir(PROJECTS_DIR) if os.path.isdir(os.path.join(PROJECTS_DIR, d))])
+        return sorted([d for d in os.listdir(PROJECTS_DIR)
+                       if not d.startswith(".") and os.path.isdir(os.path.join(PROJECTS_DIR, d))])
 
     def refresh_projects(self):
         self.project_combo.configure(values=self._list_project_names())
@@ -614,34 +2703,77 @@ class LabelTab(ctk.CTkFrame):
             self.load_folder(folder)
 
     def load_folder(self, folder):
-        exts = (".jpg", ".jpeg", ".png", ".bmp")
-        paths = [os.path.join(folder, f) for f in os.listdir(folder) if f.lower().endswith(exts)]
-        paths.sort()
+        # ชื่อไฟล์อ่านจาก listdir (ไม่ stat) ส่วนขนาดรูปมาจาก manifest ไม่ต้องเปิด header ทีละรูป
+        # รูปใหม่/ที่แก้ไขถูกอ่านเข้า manifest ใน background
+        paths = sorted(os.path.join(folder, f) for f in os.listdir(folder) if f.lower().endswith(IMAGE_EXTS))
         if not paths:
             messagebox.showwarning("ไม่มีรูป", "โฟลเดอร์นี้ไม่มีไฟล์รูปที่รองรับ")
             return
+        self._cancel_prelabel()  # ผลที่ค้างของโฟลเดอร์เดิมถูกทิ้งใน _apply_prediction
+        if self._track_job is not None:
+            self._track_job = None
+            self.track_btn.configure(text="ติดตามต่อไปข้างหน้า N รูป")
         self.current_project_dir = folder
         self.images = paths
-        self._populate_thumbs()
+        self.manifest = manifest = DatasetManifest(folder)
+        self.size_by_image.update(manifest.sizes())
+        manifest.refresh_async()
+        self.after(200, self._poll_manifest, manifest)
+        self.prefetcher.clear()
+        self._last_index = -1
+        self._open_journal(folder)
+        self.thumb_strip.set_items(self.images)
+        self.thumb_strip.set_marked(self.unreviewed)
+        self._update_unreviewed_label()
         self.selected_index = 0
         self._load_current_image()
 
-    def _populate_thumbs(self):
-        for w in self.thumb_widgets:
-            w.destroy()
-        self.thumb_widgets.clear()
-        self.thumbs.clear()
-        for i, p in enumerate(self.images):
-            pil = Image.open(p).convert("RGB")
-            th = pil.copy()
-            th.thumbnail((180, 120), Image.LANCZOS)
-            ctkimg = pil_to_ctk_image(th)
-            btn = ctk.CTkButton(self.thumb_scroll, image=ctkimg, text=os.path.basename(p), compound="top",
-                                command=lambda idx=i: self._select_index(idx))
-            btn.image = ctkimg
-            btn.pack(fill="x", padx=6, pady=4)
-            self.thumb_widgets.append(btn)
-            self.thumbs.append(th)
+    def _poll_manifest(self, manifest):
+        if manifest is not self.manifest:
+            return
+        if manifest.refreshing:
+            self.after(200, self._poll_manifest, manifest)
+            return
+        self.size_by_image.update(manifest.sizes())
+        if manifest.last_refresh and manifest.last_refresh["updated"]:
+            print(f"manifest: {manifest.last_refresh}")
+
+    def _open_journal(self, folder):
+        """โหลด label ที่ autosave ไว้ของโฟลเดอร์นี้ (mask ยังไม่ decode จนกว่าจะเปิดรูปนั้น)"""
+        if self.journal is not None:
+            self._finish_stroke()
+            self.journal.close()
+        t0 = time.perf_counter()
+        self.journal = AnnotationJournal(folder)
+        self.unreviewed = set()
+        restored = 0
+        for name, entry in self.journal.state.items():
+            path = os.path.join(folder, name)
+            if not os.path.exists(path):
+                continue
+            if entry["size"]:
+                self.size_by_image[path] = tuple(entry["size"])
+            self.boxes_by_image[path] = [tuple(b) for b in entry["boxes"]]
+            if entry["masks"]:
+                self.mask_by_image.put_lazy(path, lambda n=name, j=self.journal: j.masks_for(n))
+            if entry.get("unreviewed"):
+                self.unreviewed.add(path)
+            restored += 1
+        if restored:
+            print(f"กู้ label {restored} รูปจาก journal ใน {1000 * (time.perf_counter() - t0):.0f} ms")
+
+    def _on_annotation_changed(self, path, edit, side="after"):
+        """ทุกการแก้ label (รวม undo/redo) ผ่านที่นี่: บันทึกลง journal ของโฟลเดอร์"""
+        if self.journal is None:
+            return
+        name = os.path.relpath(path, self.journal.folder)
+        if name.startswith(".."):
+            return
+        self.journal.record(name, edit, side, self.size_by_image.get(path))
+
+    def _push_edit(self, path, edit):
+        self.history.push(path, edit)
+        self._on_annotation_changed(path, edit)
 
     def _select_index(self, idx):
         self.selected_index = idx
@@ -652,9 +2784,15 @@ class LabelTab(ctk.CTkFrame):
         if self.selected_index < 0 or self.selected_index >= len(self.images):
             return
         path = self.images[self.selected_index]
+        self._finish_stroke()
+        self._end_grabcut()
 
         self.base_img_path = path
-        self.base_img = Image.open(path).convert("RGB")
+        # รูปข้างเคียงถูกถอดรหัสไว้ล่วงหน้าแล้ว (ถ้าเลื่อนตามลำดับ) ไม่ต้องรอ decode
+        self.base_img, self._base_np = self.prefetcher.get(path)
+        direction = self.selected_index - self._last_index if self._last_index >= 0 else 1
+        self._last_index = self.selected_index
+        self.prefetcher.update(self.images, self.selected_index, direction)
         self.size_by_image[path] = (self.base_img.width, self.base_img.height)
         # init annotation storage if missing
         self.boxes_by_image.setdefault(path, [])
@@ -663,63 +2801,148 @@ class LabelTab(ctk.CTkFrame):
 
         self.zoom_scale = 1.0
         self._render_canvas()
+        if path in self.unreviewed:
+            # เปิดดูแล้ว = ตรวจแล้ว
+            self._set_unreviewed(path, False)
 
         # highlight selected thumb
-        for i, btn in enumerate(self.thumb_widgets):
-            if i == self.selected_index:
-                btn.configure(fg_color="#2a2a3a")
-            else:
-                btn.configure(fg_color="transparent")
+        self.thumb_strip.select(self.selected_index)
 
-    def _render_canvas(self):
-        if self.base_img is None:
-            return
-        img = self.base_img
+    # ---- renderer ----
+    # _composite = ภาพเต็มความละเอียดที่ผสม mask ทุกคลาสแล้ว (cache ไว้ต่อรูปที่เปิดอยู่)
+    # แปรงแต่ละครั้งผสมใหม่เฉพาะสี่เหลี่ยมที่โดน แล้ววาดเฉพาะส่วนที่มองเห็นบนจอตาม zoom
+    # กล่อง (boxes) เป็น canvas item ไม่ต้องวาดลงภาพ
 
-        # --- overlay mask ---
-        disp = img.convert("RGBA")
-        masks = self.mask_by_image.get(self.base_img_path, {})
-        for cid, m in masks.items():
+    def _class_rgb(self, cid):
+        h = self._color_for_class(cid).lstrip("#")
+        return int(h[0:2], 16), int(h[2:4], 16), int(h[4:6], 16)
+
+    def _blend_rect(self, x0, y0, x1, y1):
+        """ผสม mask ทุกคลาสลง _composite ใหม่เฉพาะช่วง [x0:x1, y0:y1]"""
+        if x1 <= x0 or y1 <= y0:
+            return
+        if self._composite is self._base_np:
+            self._composite = self._base_np.copy()
+        out = self._base_np[y0:y1, x0:x1].copy()
+        for cid, m in self.mask_by_image.get(self.base_img_path, {}).items():
             if m is None:
                 continue
-            m_np = np.array(m)
-            if m_np.max() == 0:
+            sel = np.asarray(m.crop((x0, y0, x1, y1))) > 0
+            if not sel.any():
                 continue
-            color_hex = self._color_for_class(cid).lstrip("#")
-            r = int(color_hex[0:2], 16)
-            g = int(color_hex[2:4], 16)
-            b = int(color_hex[4:6], 16)
-            overlay = Image.new("RGBA", disp.size, (r, g, b, 0))
-            ov_np = np.array(overlay)
-            ov_np[m_np > 0, 3] = int(255 * 0.30)
-            overlay = Image.fromarray(ov_np, "RGBA")
-            disp = Image.alpha_composite(disp, overlay)
-
-        disp = disp.convert("RGB")
-        disp = draw_boxes_on_pil(disp, self.boxes_by_image.get(self.base_img_path, []),
-                                 color=(0, 255, 0), width=2)
-
-        # --- apply zoom ---
-        if abs(self.zoom_scale - 1.0) > 1e-3:
-            w, h = disp.size
-            disp = disp.resize((int(w * self.zoom_scale), int(h * self.zoom_scale)), Image.LANCZOS)
-
-        # --- คำนวณ offset ให้วางภาพกึ่งกลาง ---
+            tint = np.empty_like(out)
+            tint[:] = self._class_rgb(cid)
+            # เท่ากับ alpha_composite overlay สีคลาส alpha 30%
+            tinted = cv2.addWeighted(out, 0.70, tint, 0.30, 0)
+            np.copyto(out, tinted, where=sel[..., None])
+        self._composite[y0:y1, x0:x1] = out
+
+    def _rebuild_composite(self):
+        masks = self.mask_by_image.get(self.base_img_path, {})
+        if not any(m is not None and m.getbbox() is not None for m in masks.values()):
+            # ยังไม่มี mask: ใช้ภาพฐานตรงๆ ไม่ต้องคัดลอก (_blend_rect จะคัดลอกเองตอนแปรงครั้งแรก)
+            self._composite = self._base_np
+            return
+        self._composite = self._base_np.copy()
+        self._blend_rect(0, 0, self.base_img.width, self.base_img.height)
+
+    def _update_layout(self):
+        """คำนวณ offset ให้ภาพอยู่กึ่งกลาง และ scrollregion ตาม zoom"""
         canvas_w = self.tkcanvas.winfo_width()
         canvas_h = self.tkcanvas.winfo_height()
-        img_w, img_h = disp.size
+        img_w = int(self.base_img.width * self.zoom_scale)
+        img_h = int(self.base_img.height * self.zoom_scale)
         self.img_offset_x = max((canvas_w - img_w) // 2, 0)
         self.img_offset_y = max((canvas_h - img_h) // 2, 0)
+        self._content_size = (img_w + self.img_offset_x, img_h + self.img_offset_y)
+        self.tkcanvas.config(scrollregion=(0, 0, *self._content_size))
 
-        self.tk_img_handle = ImageTk.PhotoImage(disp)
+    def _render_viewport(self):
+        """วาดเฉพาะส่วนของภาพที่อยู่ในกรอบ canvas ตอนนี้"""
+        self._render_pending = False
+        if self.base_img is None:
+            return
+        z = self.zoom_scale
+        vx0, vy0 = self.tkcanvas.canvasx(0), self.tkcanvas.canvasy(0)
+        vx1 = vx0 + self.tkcanvas.winfo_width()
+        vy1 = vy0 + self.tkcanvas.winfo_height()
+        img_w, img_h = self.base_img.size
+        # ช่วงที่มองเห็น -> พิกัดภาพ (ปัดออกให้ครอบ pixel ครบ)
+        sx0 = max(0, int((vx0 - self.img_offset_x) / z))
+        sy0 = max(0, int((vy0 - self.img_offset_y) / z))
+        sx1 = min(img_w, int(math.ceil((vx1 - self.img_offset_x) / z)))
+        sy1 = min(img_h, int(math.ceil((vy1 - self.img_offset_y) / z)))
+        if sx1 <= sx0 or sy1 <= sy0:
+            if self.canvas_img_id is not None:
+                self.tkcanvas.itemconfig(self.canvas_img_id, state="hidden")
+            return
+        crop = self._composite[sy0:sy1, sx0:sx1]
+        dw = max(1, int(round((sx1 - sx0) * z)))
+        dh = max(1, int(round((sy1 - sy0) * z)))
+        if (dw, dh) != (sx1 - sx0, sy1 - sy0):
+            interp = cv2.INTER_AREA if z < 1.0 else cv2.INTER_LINEAR
+            crop = cv2.resize(crop, (dw, dh), interpolation=interp)
+        view = Image.fromarray(np.ascontiguousarray(crop))
+        # ขนาดเท่าเดิม (แปรง/เลื่อนที่ zoom เดิม): เขียนทับ PhotoImage เดิม ไม่สร้างใหม่
+        if self.tk_img_handle is not None and (self.tk_img_handle.width(), self.tk_img_handle.height()) == view.size:
+            self.tk_img_handle.paste(view)
+        else:
+            self.tk_img_handle = ImageTk.PhotoImage(view)
+        x = self.img_offset_x + sx0 * z
+        y = self.img_offset_y + sy0 * z
         if self.canvas_img_id is None:
-            self.canvas_img_id = self.tkcanvas.create_image(self.img_offset_x, self.img_offset_y,
-                                                            image=self.tk_img_handle, anchor="nw")
+            self.canvas_img_id = self.tkcanvas.create_image(x, y, image=self.tk_img_handle, anchor="nw")
         else:
-            self.tkcanvas.itemconfig(self.canvas_img_id, image=self.tk_img_handle)
-            self.tkcanvas.coords(self.canvas_img_id, self.img_offset_x, self.img_offset_y)
+            self.tkcanvas.itemconfig(self.canvas_img_id, image=self.tk_img_handle, state="normal")
+            self.tkcanvas.coords(self.canvas_img_id, x, y)
+        self.tkcanvas.tag_lower(self.canvas_img_id)
+
+    def _schedule_render(self, *_):
+        # เลื่อน/ย่อขยายหน้าต่างถี่ ๆ: รวมเป็นการวาดครั้งเดียวตอน idle
+        if not self._render_pending and self.base_img is not None:
+            self._render_pending = True
+            self.after_idle(self._render_viewport)
+
+    def _draw_boxes(self):
+        self.tkcanvas.delete("ann_box")
+        z, ox, oy = self.zoom_scale, self.img_offset_x, self.img_offset_y
+        for (_cls, x1, y1, x2, y2) in self.boxes_by_image.get(self.base_img_path, []):
+            self.tkcanvas.create_rectangle(x1 * z + ox, y1 * z + oy, x2 * z + ox, y2 * z + oy,
+                                           outline="#00ff00", width=2, tags="ann_box")
+            # เลข class มุมซ้ายบนเหมือน draw_boxes_on_pil เดิม
+            self.tkcanvas.create_text(x1 * z + ox + 2, y1 * z + oy + 2, text=f"{_cls}", anchor="nw",
+                                      fill="#ffff00", tags="ann_box")
+        gc = self._grabcut
+        if gc is not None:
+            x1, y1, x2, y2 = gc["rect"]
+            self.tkcanvas.create_rectangle(x1 * z + ox, y1 * z + oy, x2 * z + ox, y2 * z + oy,
+                                           outline="#ffcc00", dash=(4, 3), width=2, tags="ann_box")
+            for kind, color in (("fg", "#00ff66"), ("bg", "#ff3333")):
+                for stroke in gc[kind]:
+                    pts = [v for x, y in stroke for v in (x * z + ox, y * z + oy)]
+                    if len(pts) >= 4:
+                        self.tkcanvas.create_line(*pts, fill=color, width=3, tags="ann_box")
 
-        self.tkcanvas.config(scrollregion=(0, 0, img_w + self.img_offset_x, img_h + self.img_offset_y))
+    def _render_canvas(self):
+        """วาดใหม่ทั้งหมด: ใช้เมื่อ mask ถูกเปลี่ยนทั้งภาพ (โหลดรูป, ล้าง, คัดลอก label)"""
+        if self.base_img is None:
+            return
+        self._rebuild_composite()
+        self._refresh_view()
+
+    def _refresh_view(self):
+        # zoom/ขนาด canvas เปลี่ยน: composite เดิมใช้ได้ แค่วาง layout และ viewport ใหม่
+        self._update_layout()
+        self._render_viewport()
+        self._draw_boxes()
+
+    def _xview(self, *args):
+        self.tkcanvas.xview(*args)
+        self._schedule_render()
+
+    def _yview(self, *args):
+        self.tkcanvas.yview(*args)
+        self._schedule_render()
 
     def _img_coords_from_canvas(self, x, y):
         """แปลงพิกัดจาก canvas → พิกัดภาพ"""
@@ -751,30 +2974,30 @@ class LabelTab(ctk.CTkFrame):
         if abs(self.zoom_scale - old_scale) < 1e-6:
             return
 
-        # render ใหม่ (จะอัปเดต offset ด้วย)
-        self._render_canvas()
+        # อัปเดต offset/scrollregion ตาม zoom ใหม่ก่อน
+        self._update_layout()
 
         # พิกัดใหม่ของจุดเดิมบน canvas หลังซูม
         new_canvas_x = img_x_before * self.zoom_scale + self.img_offset_x
         new_canvas_y = img_y_before * self.zoom_scale + self.img_offset_y
 
-        # คำนวณ scroll ให้จุดเดิมอยู่ตรงเมาส์
-        canvas_width = self.tkcanvas.winfo_width()
-        canvas_height = self.tkcanvas.winfo_height()
-        bbox = self.tkcanvas.bbox("all")
+        # คำนวณ scroll ให้จุดเดิมอยู่ตรงเมาส์ (สัดส่วนของ scrollregion)
+        total_w, total_h = self._content_size
+        self.tkcanvas.xview_moveto(max(0.0, (new_canvas_x - event.x) / total_w))
+        self.tkcanvas.yview_moveto(max(0.0, (new_canvas_y - event.y) / total_h))
 
-        if bbox:
-            target_x = (new_canvas_x - event.x) / (bbox[2] - canvas_width)
-            target_y = (new_canvas_y - event.y) / (bbox[3] - canvas_height)
-            self.tkcanvas.xview_moveto(target_x)
-            self.tkcanvas.yview_moveto(target_y)
+        # วาดเฉพาะส่วนที่มองเห็นที่ตำแหน่ง scroll ใหม่
+        self._render_viewport()
+        self._draw_boxes()
 
     def on_mouse_down(self, event):
         if self.base_img is None:
             return
         ix, iy = self._img_coords_from_canvas(event.x, event.y)
         tool = self.tool_var.get()
-        if tool == "box":
+        if tool == "grabcut" and self._grabcut is not None:
+            self._grabcut_scribble(event, "fg", start=True)
+        elif tool in ("box", "grabcut"):
             self.drawing_box = True
             self.box_start = (ix, iy)
         else:
@@ -791,6 +3014,8 @@ class LabelTab(ctk.CTkFrame):
             pass
         elif tool == "segment":
             self._paint_at(ix, iy)
+        elif tool == "grabcut" and self._grabcut is not None:
+            self._grabcut_scribble(event, "fg")
 
     def on_mouse_up(self, event):
         if self.base_img is None:
@@ -807,10 +3032,27 @@ class LabelTab(ctk.CTkFrame):
                 # normalize order
                 x1, x2 = sorted([x1, x2])
                 y1, y2 = sorted([y1, y2])
-                self.boxes_by_image[self.base_img_path].append((cls_id, x1, y1, x2, y2))
-                self._render_canvas()
+                boxes = self.boxes_by_image[self.base_img_path]
+                self._push_edit(self.base_img_path, BoxEdit(boxes, boxes + [(cls_id, x1, y1, x2, y2)]))
+                boxes.append((cls_id, x1, y1, x2, y2))
+                self._draw_boxes()
             self.drawing_box = False
             self.box_start = None
+        elif tool == "segment":
+            self._finish_stroke()
+        elif tool == "grabcut":
+            if self._grabcut is not None:
+                self._grabcut_release()
+            elif self.drawing_box and self.box_start is not None:
+                ix, iy = self._img_coords_from_canvas(event.x, event.y)
+                (x1, y1), (x2, y2) = self.box_start, (ix, iy)
+                self.drawing_box = False
+                self.box_start = None
+                cls_id = self._current_class() if abs(x2 - x1) > 3 and abs(y2 - y1) > 3 else None
+                if cls_id is not None:
+                    self._grabcut = {"cls": cls_id, "rect": (min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)),
+                                     "fg": [], "bg": [], "scribble": None}
+                    self._run_grabcut()
 
     def _paint_at(self, ix, iy):
         cls_id = self._current_class()
@@ -819,13 +3061,156 @@ class LabelTab(ctk.CTkFrame):
         r = int(self.brush_size.get())
         masks = self.mask_by_image.get(self.base_img_path, {})
         mask = masks.get(cls_id)
+        if self._stroke is None or self._stroke["cls"] != cls_id:
+            self._finish_stroke()
+            # สำเนา mask ก่อนลากไว้ชั่วคราว ตอนปล่อยเมาส์เก็บเฉพาะสี่เหลี่ยมที่โดนแปรง
+            self._stroke = {"cls": cls_id, "before": None if mask is None else np.array(mask), "rect": None}
         if mask is None:
             mask = Image.new("L", (self.base_img.width, self.base_img.height), 0)
         draw = ImageDraw.Draw(mask)
         draw.ellipse([ix - r, iy - r, ix + r, iy + r], fill=255)
         masks[cls_id] = mask
         self.mask_by_image[self.base_img_path] = masks
-        self._render_canvas()
+        # ผสมใหม่เฉพาะสี่เหลี่ยมรอบหัวแปรง
+        w, h = self.base_img.size
+        rect = (max(0, int(ix - r) - 1), max(0, int(iy - r) - 1),
+                min(w, int(ix + r) + 2), min(h, int(iy + r) + 2))
+        self._blend_rect(*rect)
+        self._render_viewport()
+        s = self._stroke["rect"]
+        self._stroke["rect"] = rect if s is None else (min(s[0], rect[0]), min(s[1], rect[1]),
+                                                       max(s[2], rect[2]), max(s[3], rect[3]))
+
+    def _finish_stroke(self):
+        stroke, self._stroke = self._stroke, None
+        if stroke is None or stroke["rect"] is None or self.base_img_path is None:
+            return
+        x0, y0, x1, y1 = stroke["rect"]
+        if x1 <= x0 or y1 <= y0:
+            return
+        after = np.asarray(self.mask_by_image.get(self.base_img_path, {})[stroke["cls"]])[y0:y1, x0:x1]
+        before = (np.zeros_like(after) if stroke["before"] is None
+                  else stroke["before"][y0:y1, x0:x1])
+        self._push_edit(self.base_img_path, MaskEdit(stroke["cls"], stroke["rect"], before, after))
+
+    # ---- Auto segment (GrabCut) ----
+    def _grabcut_scribble(self, event, kind, start=False):
+        if self._grabcut is None or self.base_img is None or self.tool_var.get() != "grabcut":
+            return
+        pt = self._img_coords_from_canvas(event.x, event.y)
+        if start or self._grabcut["scribble"] is None:
+            self._grabcut["scribble"] = [pt]
+            self._grabcut[kind].append(self._grabcut["scribble"])
+        else:
+            self._grabcut["scribble"].append(pt)
+        self._draw_boxes()
+
+    def _grabcut_release(self):
+        if self._grabcut is None or self._grabcut["scribble"] is None:
+            return
+        self._grabcut["scribble"] = None
+        self._run_grabcut()
+
+    def _run_grabcut(self):
+        """คำนวณ mask ของวัตถุใหม่จากกรอบ + เส้นขีดทั้งหมด แล้วเขียนลง mask ของคลาส (undo ได้ทีละครั้ง)
+
+        ผลรอบใหม่แทนที่ผลรอบก่อนเสมอ: ผสมกับ mask ที่มีอยู่ก่อนเริ่มตัดวัตถุนี้ (gc["base"])
+        """
+        gc = self._grabcut
+        t0 = time.perf_counter()
+        roi, obj = grabcut_mask(self._base_np, gc["rect"], gc["fg"], gc["bg"],
+                                brush=max(2, int(self.brush_size.get()) // 3))
+        if roi is None:
+            return
+        path, cls_id = self.base_img_path, gc["cls"]
+        masks = self.mask_by_image.get(path, {})
+        mask = masks.get(cls_id)
+        if mask is None:
+            mask = Image.new("L", self.base_img.size, 0)
+        current = np.array(mask.crop(roi))
+        if gc.get("base") is None or gc["roi"] != roi:
+            gc["base"], gc["roi"] = current.copy(), roi
+        new = np.maximum(gc["base"], obj)
+        if np.array_equal(new, current):
+            self._draw_boxes()
+            return
+        mask.paste(Image.fromarray(new, "L"), roi[:2])
+        masks[cls_id] = mask
+        self.mask_by_image[path] = masks
+        self._push_edit(path, MaskEdit(cls_id, roi, current, new))
+        self._blend_rect(*roi)
+        self._render_viewport()
+        self._draw_boxes()
+        print(f"Auto segment {roi[2] - roi[0]}x{roi[3] - roi[1]}: {1000 * (time.perf_counter() - t0):.0f} ms")
+
+    def _end_grabcut(self):
+        if self._grabcut is not None:
+            self._grabcut = None
+            if self.base_img is not None:
+                self._draw_boxes()
+
+    def _mask_edits(self, path, before_masks):
+        """เทียบ mask ก่อน/หลังของทุกคลาส คืน MaskEdit เฉพาะส่วนที่เปลี่ยน"""
+        after_masks = self.mask_by_image.get(path, {})
+        edits = []
+        for cid in set(before_masks) | set(after_masks):
+            b, a = before_masks.get(cid), after_masks.get(cid)
+            a = None if a is None else np.asarray(a)
+            if b is None and a is None:
+                continue
+            if b is None:
+                b = np.zeros_like(a)
+            if a is None:
+                a = np.zeros_like(b)
+            if b.shape != a.shape:
+                continue
+            diff = np.argwhere(b != a)
+            if len(diff) == 0:
+                continue
+            (y0, x0), (y1, x1) = diff.min(0), diff.max(0) + 1
+            edits.append(MaskEdit(cid, (int(x0), int(y0), int(x1), int(y1)), b[y0:y1, x0:x1], a[y0:y1, x0:x1]))
+        return edits
+
+    def _apply_edit(self, edit, side):
+        """side = "before" (undo) หรือ "after" (redo) คืนค่า True ถ้า mask เปลี่ยน"""
+        path = self.base_img_path
+        if isinstance(edit, GroupEdit):
+            changed = False
+            for e in (reversed(edit.edits) if side == "before" else edit.edits):
+                changed = self._apply_edit(e, side) or changed
+            return changed
+        if isinstance(edit, BoxEdit):
+            self.boxes_by_image[path] = list(edit.before if side == "before" else edit.after)
+            return False
+        size, data = edit.before if side == "before" else edit.after
+        masks = self.mask_by_image.get(path, {})
+        mask = masks.get(edit.cls_id)
+        if mask is None:
+            mask = Image.new("L", self.base_img.size, 0)
+        mask.paste(unpack_mask(size, data), edit.rect[:2])
+        masks[edit.cls_id] = mask
+        self.mask_by_image[path] = masks
+        self._blend_rect(*edit.rect)
+        return True
+
+    def _step_history(self, redo):
+        if self.base_img_path is None:
+            return
+        self._finish_stroke()
+        edit = (self.history.redo if redo else self.history.undo)(self.base_img_path)
+        if edit is None:
+            return
+        side = "after" if redo else "before"
+        if self._apply_edit(edit, side):
+            self._render_viewport()
+        self._draw_boxes()
+        self._on_annotation_changed(self.base_img_path, edit, side)
+
+    def undo(self):
+        self._step_history(redo=False)
+
+    def redo(self):
+        self._step_history(redo=True)
 
     def _current_class(self):
 
@@ -843,15 +3228,20 @@ class LabelTab(ctk.CTkFrame):
             return
         masks = self.mask_by_image.get(self.base_img_path, {})
         if cls_id in masks:
+            before = {cls_id: np.array(masks[cls_id])}
             masks[cls_id] = Image.new("L", (self.base_img.width, self.base_img.height), 0)
             self.mask_by_image[self.base_img_path] = masks
+            edits = self._mask_edits(self.base_img_path, before)
+            if edits:
+                self._push_edit(self.base_img_path, GroupEdit(edits))
             self._render_canvas()
 
     def _clear_boxes(self):
         if self.base_img_path is None:
             return
+        self._push_edit(self.base_img_path, BoxEdit(self.boxes_by_image.get(self.base_img_path, []), []))
         self.boxes_by_image[self.base_img_path] = []
-        self._render_canvas()
+        self._draw_boxes()
 
     def prev_image(self):
         if not self.images:
@@ -870,6 +3260,14 @@ class LabelTab(ctk.CTkFrame):
             return
         cur = self.images[self.selected_index]
         prev = self.images[self.selected_index - 1]
+        if self.track_var.get() and self._image_size(prev) == self._image_size(cur):
+            t0 = time.perf_counter()
+            methods = self._propagate(prev, cur)
+            self.track_label.configure(text=f"ติดตาม 1 รูป {1000 * (time.perf_counter() - t0):.0f} ms {methods}")
+            self._render_canvas()
+            return
+        boxes_before = list(self.boxes_by_image.get(cur, []))
+        masks_before = {cid: np.array(m) for cid, m in self.mask_by_image.get(cur, {}).items() if m is not None}
 
         # boxes
         prev_boxes = self.boxes_by_image.get(prev, [])
@@ -901,55 +3299,855 @@ class LabelTab(ctk.CTkFrame):
                     new_masks[cid] = pmask.copy()
             self.mask_by_image[cur] = new_masks
 
+        edits = self._mask_edits(cur, masks_before)
+        if self.boxes_by_image.get(cur, []) != boxes_before:
+            edits.append(BoxEdit(boxes_before, self.boxes_by_image.get(cur, [])))
+        if edits:
+            self._push_edit(cur, GroupEdit(edits))
         self._render_canvas()
 
+    # ---- pre-label ด้วยโมเดล ----
+    def _set_unreviewed(self, path, flag):
+        if flag:
+            self.unreviewed.add(path)
+        else:
+            self.unreviewed.discard(path)
+        if self.journal is not None:
+            name = os.path.relpath(path, self.journal.folder)
+            if not name.startswith(".."):
+                self.journal.mark_unreviewed(name, flag)
+        self.thumb_strip.set_marked(self.unreviewed)
+        self._update_unreviewed_label()
+
+    def _update_unreviewed_label(self):
+        n = len(self.unreviewed)
+        self.unreviewed_btn.configure(text=f"ไปรูปที่ยังไม่ตรวจ ({n})", state="normal" if n else "disabled")
+
+    def next_unreviewed(self):
+        if not self.unreviewed or not self.images:
+            return
+        n = len(self.images)
+        for k in range(1, n + 1):
+            idx = (self.selected_index + k) % n
+            if self.images[idx] in self.unreviewed:
+                self._select_index(idx)
+                return
+
+    def _has_labels(self, path):
+        if self.boxes_by_image.get(path):
+            return True
+        # mask ที่เพิ่งวาดอาจยังไม่ถึง journal (เขียนแบบ async) ดูในหน่วยความจำก่อน
+        if self.mask_by_image.has_masks(path):
+            return True
+        entry = self.journal.state.get(os.path.relpath(path, self.journal.folder)) if self.journal else None
+        return bool(entry and entry["masks"])
+
+    def _start_prelabel(self):
+        if YOLO is None:
+            messagebox.showerror("ยังไม่พร้อม", "ไม่พบไลบรารี ultralytics กรุณาติดตั้งด้วย: pip install ultralytics")
+            return
+        if not self.images:
+            messagebox.showwarning("ไม่มีรูป", "ยังไม่ได้เลือกโฟลเดอร์รูป")
+            return
+        if self._prelabel is not None:
+            return
+        model_path = filedialog.askopenfilename(title="เลือกไฟล์โมเดลสำหรับ Pre-label",
+                                                filetypes=[("PyTorch Weights", "*.pt")])
+        if not model_path:
+            return
+        self._finish_stroke()
+        if self.journal is not None:
+            self.journal.flush()
+        # ไม่ทับ label ที่คนทำไว้แล้ว: ทำเฉพาะรูปที่ยังไม่มี label เลย
+        paths = [p for p in self.images if not self._has_labels(p)]
+        if not paths:
+            messagebox.showinfo("Pre-label", "ทุกรูปมี label แล้ว")
+            return
+        job = {"total": len(paths), "done": 0, "added": 0,
+               "results": queue.Queue(), "cancel": threading.Event(), "finished": None}
+        self._prelabel = job
+        conf = float(self.prelabel_conf.get())
+        threading.Thread(target=self._prelabel_worker, args=(job, model_path, paths, conf), daemon=True).start()
+        self.prelabel_btn.configure(state="disabled")
+        self.prelabel_bar.set(0)
+        self.prelabel_bar.grid()
+        self.prelabel_cancel_btn.grid()
+        self.prelabel_label.configure(text=f"กำลังโหลดโมเดล... ({len(paths)} รูป)")
+        self.after(100, self._poll_prelabel, job)
+
+    def _cancel_prelabel(self):
+        if self._prelabel is not None:
+            self._prelabel["cancel"].set()
+
+    @staticmethod
+    def _prelabel_worker(job, model_path, paths, conf):
+        # thread แยก: อ่านรูป + inference บน CPU ทีละ batch แล้วส่งผลกลับผ่านคิว (ไม่แตะ widget)
+        t0 = time.perf_counter()
+        error = None
+        try:
+            model = YOLO(model_path)
+            for i in range(0, len(paths), PRELABEL_BATCH):
+                if job["cancel"].is_set():
+                    break
+                chunk = paths[i:i + PRELABEL_BATCH]
+                results = model.predict(chunk, conf=conf, device="cpu", batch=len(chunk), verbose=False)
+                for path, r in zip(chunk, results):
+                    job["results"].put((path, prediction_to_labels(r)))
+        except Exception as e:
+            error = str(e)
+        job["finished"] = (time.perf_counter() - t0, error)
+
+    def _apply_prediction(self, path, size, boxes, masks):
+        # คนอาจ label รูปนี้ไประหว่างรอ: ไม่ทับ
+        if not boxes or path not in self.images or self._has_labels(path):
+            return False
+        self.size_by_image[path] = size
+        edits = []
+        if masks:
+            self.mask_by_image[path] = {cid: Image.fromarray(m, "L") for cid, m in masks.items()}
+            edits = self._mask_edits(path, {})
+        self.boxes_by_image[path] = list(boxes)
+        edits.append(BoxEdit([], list(boxes)))
+        for cid in sorted({b[0] for b in boxes}):
+            self._ensure_class_button(cid)
+        self._push_edit(path, GroupEdit(edits))
+        if path == self.base_img_path:
+            # รูปที่เปิดอยู่ผู้ใช้เห็นผลทันที ไม่ต้องทำเครื่องหมายว่ายังไม่ตรวจ
+            self._render_canvas()
+        else:
+            self._set_unreviewed(path, True)
+        return True
+
+    def _poll_prelabel(self, job):
+        if self._prelabel is not job:
+            return
+        # ใส่ผลลง label ทีละนิด ไม่ให้ UI กระตุก
+        t0 = time.perf_counter()
+        while time.perf_counter() - t0 < 0.03:
+            try:
+                path, (size, boxes, masks) = job["results"].get_nowait()
+            except queue.Empty:
+                break
+            job["done"] += 1
+            if self._apply_prediction(path, size, boxes, masks):
+                job["added"] += 1
+        finished = job["finished"]
+        self.prelabel_bar.set(job["done"] / max(1, job["total"]))
+        self.prelabel_label.configure(text=f"Pre-label {job['done']}/{job['total']} รูป "
+                                           f"(มี label {job['added']} รูป)")
+        if finished is None or not job["results"].empty():
+            self.after(100, self._poll_prelabel, job)
+            return
+        elapsed, error = finished
+        self._prelabel = None
+        self.prelabel_btn.configure(state="normal")
+        self.prelabel_bar.grid_remove()
+        self.prelabel_cancel_btn.grid_remove()
+        rate = job["done"] / elapsed if elapsed > 0 else 0.0
+        summary = (f"Pre-label {job['done']}/{job['total']} รูปใน {elapsed:.1f} s ({rate:.1f} รูป/s)\n"
+                   f"เพิ่ม label {job['added']} รูป (ยังไม่ตรวจ {len(self.unreviewed)} รูป)")
+        self.prelabel_label.configure(text=summary)
+        print(summary)
+        if error is not None:
+            messagebox.showerror("Pre-label ไม่สำเร็จ", error)
+        elif job["cancel"].is_set():
+            messagebox.showinfo("ยกเลิก Pre-label", summary)
+        else:
+            messagebox.showinfo("Pre-label เสร็จสิ้น", summary)
+
+    # ---- ติดตาม label จากรูปก่อนหน้า ----
+    def _image_size(self, path):
+        size = self.size_by_image.get(path)
+        if size is None:
+            with Image.open(path) as im:  # อ่านแค่ header
+                size = im.size
+            self.size_by_image[path] = size
+        return tuple(size)
+
+    def _propagate(self, prev, cur, prev_gray=None, cur_gray=None):
+        """ติดตาม boxes/mask ของ prev ไปยัง cur แล้วแทนที่ label ของ cur (undo ได้เป็นขั้นเดียว)
+
+        แทนที่เฉพาะชนิดที่ prev มี (เหมือนคัดลอกแบบเดิม): prev มีแค่ boxes ก็ไม่ลบ mask ที่ระบายไว้ใน cur
+
+        prev_gray/cur_gray: (gray, scale) จาก load_track_gray ถ้ามีอยู่แล้ว คืน dict จำนวนวัตถุตามวิธีที่ใช้
+        """
+        size = self._image_size(cur)
+        prev_gray = prev_gray or load_track_gray(prev, self._image_size(prev))
+        cur_gray = cur_gray or load_track_gray(cur, size)
+        prev_boxes = self.boxes_by_image.get(prev, [])
+        prev_masks = {cid: np.asarray(m) for cid, m in self.mask_by_image.get(prev, {}).items() if m is not None}
+        new_boxes, new_masks, methods = propagate_labels(prev_gray[0], cur_gray[0], prev_gray[1],
+                                                         prev_boxes, prev_masks, size)
+        boxes_before = list(self.boxes_by_image.get(cur, []))
+        masks_before = {cid: np.array(m) for cid, m in self.mask_by_image.get(cur, {}).items() if m is not None}
+        if prev_boxes:
+            self.boxes_by_image[cur] = new_boxes
+        if prev_masks:
+            self.mask_by_image[cur] = {cid: Image.fromarray(m, "L") for cid, m in new_masks.items()}
+        edits = self._mask_edits(cur, masks_before) if prev_masks else []
+        if prev_boxes and new_boxes != boxes_before:
+            edits.append(BoxEdit(boxes_before, new_boxes))
+        if edits:
+            self._push_edit(cur, GroupEdit(edits))
+        return methods
+
+    def _toggle_track_batch(self):
+        if self._track_job is not None:
+            self._track_job["cancel"] = True
+            return
+        if not self.images or self.selected_index < 0:
+            return
+        try:
+            n = max(1, int(self.track_count.get().strip()))
+        except ValueError:
+            messagebox.showerror("จำนวนรูปไม่ถูกต้อง", "กรุณากรอกจำนวนรูปเป็นตัวเลข")
+            return
+        self._finish_stroke()
+        self._end_grabcut()
+        start = self.selected_index
+        job = {"start": start + 1, "index": start + 1, "stop": min(len(self.images), start + 1 + n), "gray": None,
+               "done": 0, "kept": 0, "methods": defaultdict(int), "t0": time.perf_counter(), "cancel": False}
+        if job["index"] >= job["stop"]:
+            return
+        self._track_job = job
+        self.track_btn.configure(text="หยุด")
+        self.after(1, self._track_step, job)
+
+    def _track_step(self, job):
+        """ติดตามไปหนึ่งรูปต่อหนึ่ง after() ให้ UI ยังตอบสนองระหว่างทำหลายรูป"""
+        if self._track_job is not job:
+            return
+        i = job["index"]
+        if job["cancel"] or i >= job["stop"]:
+            self._finish_track_batch(job)
+            return
+        prev, cur = self.images[i - 1], self.images[i]
+        try:
+            # ภาพ gray ของรูปปัจจุบันใช้ต่อเป็น prev ของรอบถัดไป ไม่ต้อง decode ซ้ำ
+            cached = job["gray"]
+            prev_gray = cached[1] if cached and cached[0] == prev else load_track_gray(prev, self._image_size(prev))
+            cur_gray = load_track_gray(cur, self._image_size(cur))
+            job["gray"] = (cur, cur_gray)
+            if self._has_labels(cur) or self._image_size(prev) != self._image_size(cur):
+                # รูปที่มี label อยู่แล้วไม่ทับ ใช้เป็นต้นแบบของรูปถัดไปแทน
+                job["kept"] += 1
+            else:
+                for how, k in self._propagate(prev, cur, prev_gray, cur_gray).items():
+                    job["methods"][how] += k
+                job["done"] += 1
+        except Exception as e:
+            job["cancel"] = True
+            messagebox.showerror("ติดตาม label ไม่สำเร็จ", f"{os.path.basename(cur)}: {e}")
+        job["index"] = i + 1
+        self.track_label.configure(text=f"ติดตาม {job['index'] - job['start']}/{job['stop'] - job['start']} รูป")
+        self.after(1, self._track_step, job)
+
+    def _finish_track_batch(self, job):
+        self._track_job = None
+        self.track_btn.configure(text="ติดตามต่อไปข้างหน้า N รูป")
+        elapsed = time.perf_counter() - job["t0"]
+        rate = job["done"] / elapsed if elapsed > 0 else 0.0
+        self.track_label.configure(
+            text=f"ติดตาม {job['done']} รูปใน {elapsed:.1f} s ({rate:.1f} รูป/s), ข้ามรูปที่มี label {job['kept']} รูป\n"
+                 + ", ".join(f"{k}: {v}" for k, v in sorted(job["methods"].items())))
+        # ไปที่รูปสุดท้ายที่ทำ ให้ตรวจผลได้ทันที
+        self._select_index(job["index"] - 1)
+
+    # ---- หารูปซ้ำ ----
+    def _start_dedup(self):
+        if not self.images or self._dedup_job is not None:
+            return
+        try:
+            radius = max(0, int(self.dedup_radius.get().strip()))
+        except ValueError:
+            messagebox.showerror("ค่าไม่ถูกต้อง", "กรุณากรอกจำนวน bit เป็นตัวเลข")
+            return
+        job = {"folder": self.current_project_dir, "progress": [0, len(self.images)], "result": None}
+        self._dedup_job = job
+        self.dedup_btn.configure(state="disabled")
+        threading.Thread(target=self._dedup_worker, args=(job, list(self.images), radius), daemon=True).start()
+        self.after(100, self._poll_dedup, job)
+
+    @staticmethod
+    def _dedup_worker(job, paths, radius):
+        t0 = time.perf_counter()
+        try:
+            hashes = compute_hashes(paths, progress=job["progress"])
+            t_hash = time.perf_counter() - t0
+            clusters = near_duplicate_clusters(hashes, radius)
+            job["result"] = (clusters, t_hash, time.perf_counter() - t0 - t_hash, None)
+        except Exception as e:
+            job["result"] = (None, 0.0, 0.0, e)
+
+    def _poll_dedup(self, job):
+        if job["result"] is None:
+            done, total = job["progress"]
+            self.dedup_label.configure(text=f"คำนวณ hash {done}/{total}")
+            self.after(100, self._poll_dedup, job)
+            return
+        self._dedup_job = None
+        self.dedup_btn.configure(state="normal")
+        clusters, t_hash, t_group, error = job["result"]
+        if error is not None:
+            self.dedup_label.configure(text="")
+            messagebox.showerror("หารูปซ้ำไม่สำเร็จ", str(error))
+            return
+        if job["folder"] != self.current_project_dir:
+            return
+        self._finish_stroke()
+        if self.journal is not None:
+            self.journal.flush()
+        # เก็บรูปที่มี label ไว้ทั้งหมด ถ้ากลุ่มไหนไม่มี label เลยเก็บรูปแรก ที่เหลือย้ายออกได้
+        movable = []
+        labeled_extra = 0   # รูปที่มี label แต่ซ้ำกับรูปอื่นในกลุ่ม: ตัดออกตอน train ได้ (ไม่ย้ายไฟล์)
+        for group in clusters:
+            labeled = [p for p in group if self._has_labels(p)]
+            movable += [p for p in group if p not in labeled][0 if labeled else 1:]
+            labeled_extra += max(0, len(labeled) - 1)
+        total = len(self.images)
+        labeled_total = sum(1 for p in self.images if self._has_labels(p))
+        info = (f"{total} รูป: hash {t_hash:.2f} s, จัดกลุ่ม {1000 * t_group:.0f} ms\n"
+                f"พบ {len(clusters)} กลุ่มรูปที่เกือบซ้ำ ({sum(len(g) for g in clusters)} รูป)")
+        if labeled_extra:
+            # รูปที่ไม่มี label ไม่ได้ถูก train อยู่แล้ว ที่ทำให้ train ช้าคือรูปที่มี label ซ้ำกัน
+            info += (f"\nมี label ซ้ำกัน {labeled_extra} รูป: ติ๊ก 'ใช้รูปเดียวต่อกลุ่มรูปที่เกือบซ้ำ' ในหน้า Train "
+                     f"(เวลา train ต่อ epoch ลดลงราว {100.0 * labeled_extra / max(1, labeled_total):.0f}%)")
+        self.dedup_label.configure(text=info)
+        print(info)
+        if not movable:
+            messagebox.showinfo("หารูปซ้ำ", info + "\nไม่มีรูปที่ไม่มี label ให้ย้าย")
+            return
+        if not messagebox.askyesno("หารูปซ้ำ", f"{info}\n\nย้ายรูปที่ไม่มี label {len(movable)} รูปไป {DUPLICATES_DIRNAME}/ ?\n"
+                                             f"(ลดรูปที่ต้องไล่ label ลง {100.0 * len(movable) / total:.0f}%)"):
+            return
+        dup_dir = os.path.join(job["folder"], DUPLICATES_DIRNAME)
+        os.makedirs(dup_dir, exist_ok=True)
+        moved = 0
+        for p in movable:
+            try:
+                # _duplicates อาจมีไฟล์ชื่อเดียวกันจากรอบก่อน: ต่อท้ายชื่อแทนการเขียนทับ
+                os.replace(p, unique_path(os.path.join(dup_dir, os.path.basename(p))))
+                moved += 1
+            except OSError as e:
+                print(f"ย้ายไม่ได้: {p}: {e}")
+        self.load_folder(job["folder"])
+        self.dedup_label.configure(text=f"{info}\nย้าย {moved} รูปไป {DUPLICATES_DIRNAME}/")
+
     def _export_labels(self):
         if not self.images:
             messagebox.showwarning("ไม่มีรูป", "ยังไม่ได้เลือกโฟลเดอร์รูป")
             return
+        if self._export_thread is not None:
+            return
         out_dir = filedialog.askdirectory(title="เลือกโฟลเดอร์ปลายทางสำหรับ Export")
         if not out_dir:
             return
-        images_out = os.path.join(out_dir, "images")
-        labels_out = os.path.join(out_dir, "labels")
-        os.makedirs(images_out, exist_ok=True)
-        os.makedirs(labels_out, exist_ok=True)
-        count = 0
-        for path in self.images:
-            pil_img = Image.open(path).convert("RGB")
-            w, h = pil_img.size
-            base = os.path.splitext(os.path.basename(path))[0]
-            # copy/save image
-            save_img_path = os.path.join(images_out, base + ".jpg")
-            pil_img.save(save_img_path, quality=95)
-
-            # write label file
-            label_lines = []
-            # boxes
-            for (cls_id, x1, y1, x2, y2) in self.boxes_by_image.get(path, []):
-                cx, cy, bw, bh = compute_yolo_bbox(w, h, x1, y1, x2, y2)
-                label_lines.append(f"{cls_id} {cx:.6f} {cy:.6f} {bw:.6f} {bh:.6f}")
-
-            # segmentation as polygons (single combined mask)
-            # segmentation: บันทึกตามคลาส
-            masks = self.mask_by_image.get(path, {})
-            for cls_id, mask in masks.items():
-                if mask is None:
-                    continue
-                mask_np = np.array(mask)
-                if mask_np.max() == 0:
-                    continue
-                polys = mask_to_polygons(mask_np)
-                for poly in polys:
-                    coords = normalize_polygon(poly, w, h)
-                    line = f"{cls_id} " + " ".join(coords)
-                    label_lines.append(line)
+        # label ทั้งหมดอยู่ใน journal แล้ว: รอคิวเขียนให้หมดแล้วใช้ state ของ journal เป็นต้นฉบับ
+        self._finish_stroke()
+        self.journal.flush()
+        state = self.journal.snapshot_state()
+        self._export_progress = [0, len(self.images)]
+        self._export_result = None
+        self.export_btn.configure(state="disabled")
+        self.export_bar.set(0)
+        self.export_bar.grid()
+        self.export_label.grid()
+        min_iou, min_area = SIMPLIFY_PRESETS.get(self.simplify_var.get(), (None, 0))
+        args = (list(self.images), self.journal.folder, state, out_dir, min_iou, min_area)
+        self._export_thread = threading.Thread(target=self._export_worker, args=args, daemon=True)
+        self._export_thread.start()
+        self.after(100, self._poll_export)
+
+    def _export_worker(self, images, folder, state, out_dir, min_iou, min_area):
+        t0 = time.perf_counter()
+        try:
+            stats = export_labels(images, folder, state, out_dir, progress=self._export_progress,
+                                  min_iou=min_iou, min_area=min_area)
+            self._export_result = (out_dir, stats, time.perf_counter() - t0, None)
+        except Exception as e:
+            self._export_result = (out_dir, None, time.perf_counter() - t0, e)
+
+    def _poll_export(self):
+        done, total = self._export_progress
+        self.export_bar.set(done / max(1, total))
+        self.export_label.configure(text=f"กำลัง Export {done}/{total}")
+        if self._export_result is None:
+            self.after(100, self._poll_export)
+            return
+        out_dir, stats, elapsed, error = self._export_result
+        self._export_thread = None
+        self.export_btn.configure(state="normal")
+        self.export_bar.grid_remove()
+        self.export_label.grid_remove()
+        if error is not None:
+            messagebox.showerror("Export ไม่สำเร็จ", str(error))
+            return
+        print(f"Export {stats} ใน {elapsed:.2f} s")
+        seg = ""
+        if stats["vertices_before"]:
+            seg = (f"\nจุด polygon {stats['vertices_before']:,} -> {stats['vertices_after']:,} "
+                   f"(-{100 * (1 - stats['vertices_after'] / stats['vertices_before']):.0f}%), "
+                   f"IoU กับ mask เฉลี่ย {stats['mask_iou']:.4f}")
+        messagebox.showinfo("Export เสร็จสิ้น",
+                            f"ส่งออก {stats['exported']} รูป (ไม่เปลี่ยน ข้าม {stats['skipped']} รูป) "
+                            f"ใน {elapsed:.1f} วินาที{seg}\nไปยัง:\n{out_dir}")
 
-            with open(os.path.join(labels_out, base + ".txt"), "w", encoding="utf-8") as f:
-                f.write("\n".join(label_lines))
-            count += 1
+    def destroy(self):
+        self._cancel_prelabel()
+        self.prefetcher.close()
+        if self.journal is not None:
+            self._finish_stroke()
+            self.journal.close()  # compact ครั้งสุดท้าย
+        self.mask_by_image.close()
+        super().destroy()
 
-        messagebox.showinfo("Export เสร็จสิ้น", f"ส่งออก {count} รูป ไปยัง:\n{out_dir}")
+
+# ---------- Dataset manifest ----------
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp")
+MANIFEST_DIR = os.path.join(CACHE_DIR, "manifests")
+
+MANIFEST_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    name TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    bytes INTEGER NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    label_mtime_ns INTEGER,
+    n_objects INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS objects (
+    name TEXT NOT NULL,
+    cls INTEGER NOT NULL,
+    w REAL NOT NULL,
+    h REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS objects_name ON objects(name);
+CREATE INDEX IF NOT EXISTS objects_cls ON objects(cls);
+"""
+
+def parse_label_objects(label_path):
+    """อ่านไฟล์ label YOLO -> list ของ (cls, w, h) ขนาดกรอบแบบ normalized (polygon ใช้กรอบที่ครอบ)"""
+    out = []
+    with open(label_path, "r", encoding="utf-8") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) < 5:
+                continue
+            vals = np.asarray(parts[1:], dtype=np.float64)
+            if len(vals) == 4:
+                w, h = vals[2], vals[3]
+            else:
+                xs, ys = vals[0::2], vals[1::2]
+                w, h = xs.max() - xs.min(), ys.max() - ys.min()
+            out.append((int(parts[0]), float(w), float(h)))
+    return out
+
+
+class DatasetManifest:
+    """ข้อมูลของรูปทั้งโฟลเดอร์ (ขนาดรูป, สถานะ label, class และขนาดกรอบ) ใน SQLite ที่ CACHE_DIR/manifests/
+
+    refresh() เทียบ mtime กับที่บันทึกไว้ อ่านใหม่เฉพาะรูป/label ที่เปลี่ยน ใช้ได้จาก thread ไหนก็ได้
+    (แต่ละครั้งเปิด connection ใหม่ แบบ WAL อ่านระหว่าง refresh ใน background ได้)
+    """
+
+    def __init__(self, images_dir, labels_dir=None):
+        self.images_dir = os.path.abspath(images_dir)
+        self.labels_dir = labels_dir
+        key = f"{self.images_dir}|{os.path.abspath(labels_dir) if labels_dir else ''}"
+        self.path = os.path.join(MANIFEST_DIR, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".sqlite")
+        self._refresh_lock = threading.Lock()
+        self.refreshing = False
+        self.last_refresh = None
+        os.makedirs(MANIFEST_DIR, exist_ok=True)
+        with closing(self._connect()) as con:
+            con.executescript(MANIFEST_SCHEMA)
+
+    def _connect(self):
+        con = sqlite3.connect(self.path, timeout=10)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        return con
+
+    def _label_path(self, name):
+        return os.path.join(self.labels_dir, os.path.splitext(name)[0] + ".txt")
+
+    # ---- อัปเดต ----
+    def refresh(self):
+        """สแกนโฟลเดอร์ (stat อย่างเดียว) แล้วอ่าน header รูป/ไฟล์ label เฉพาะที่ mtime เปลี่ยน คืน dict สถิติ"""
+        with self._refresh_lock:
+            t0 = time.perf_counter()
+            files = {e.name: e.stat() for e in os.scandir(self.images_dir)
+                     if e.is_file() and e.name.lower().endswith(IMAGE_EXTS)}
+            labels = {}
+            if self.labels_dir and os.path.isdir(self.labels_dir):
+                labels = {e.name: e.stat().st_mtime_ns for e in os.scandir(self.labels_dir)
+                          if e.is_file() and e.name.endswith(".txt")}
+            with closing(self._connect()) as con:
+                known = {row[0]: row[1:] for row in con.execute(
+                    "SELECT name, mtime_ns, bytes, width, height, label_mtime_ns FROM images")}
+                removed = [n for n in known if n not in files]
+                upserts, objects, changed_labels = [], [], []
+                for name, st in files.items():
+                    old = known.get(name)
+                    lbl_mtime = labels.get(os.path.splitext(name)[0] + ".txt")
+                    image_changed = old is None or old[0] != st.st_mtime_ns or old[1] != st.st_size
+                    label_changed = old is None or old[4] != lbl_mtime
+                    if not image_changed and not label_changed:
+                        continue
+                    width, height = (old[2], old[3]) if old and not image_changed else (None, None)
+                    if width is None:
+                        try:
+                            with Image.open(os.path.join(self.images_dir, name)) as im:  # header เท่านั้น
+                                width, height = im.size
+                        except OSError:
+                            pass
+                    objs = []
+                    if lbl_mtime is not None:
+                        try:
+                            objs = parse_label_objects(self._label_path(name))
+                        except (OSError, ValueError):
+                            pass
+                    upserts.append((name, st.st_mtime_ns, st.st_size, width, height, lbl_mtime, len(objs)))
+                    changed_labels.append((name,))
+                    objects += [(name, c, w, h) for c, w, h in objs]
+                with con:
+                    con.executemany("DELETE FROM images WHERE name = ?", [(n,) for n in removed])
+                    con.executemany("DELETE FROM objects WHERE name = ?", [(n,) for n in removed] + changed_labels)
+                    con.executemany("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?)", upserts)
+                    con.executemany("INSERT INTO objects VALUES (?, ?, ?, ?)", objects)
+            self.last_refresh = {"images": len(files), "updated": len(upserts), "removed": len(removed),
+                                 "seconds": time.perf_counter() - t0}
+            return self.last_refresh
+
+    def refresh_async(self):
+        """refresh ใน thread แยก ดูว่าเสร็จหรือยังจาก self.refreshing"""
+        if self.refreshing:
+            return
+        self.refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"❌ อัปเดต manifest ไม่สำเร็จ: {e}")
+            finally:
+                self.refreshing = False
+
+        threading.Thread(target=run, daemon=True).start()
+
+    # ---- อ่าน ----
+    def image_paths(self):
+        with closing(self._connect()) as con:
+            return [os.path.join(self.images_dir, n) for (n,) in con.execute("SELECT name FROM images ORDER BY name")]
+
+    def sizes(self):
+        with closing(self._connect()) as con:
+            return {os.path.join(self.images_dir, n): (w, h) for n, w, h in
+                    con.execute("SELECT name, width, height FROM images WHERE width IS NOT NULL")}
+
+    def image_classes(self):
+        out = {p: set() for p in self.image_paths()}
+        with closing(self._connect()) as con:
+            for n, c in con.execute("SELECT DISTINCT name, cls FROM objects"):
+                out.setdefault(os.path.join(self.images_dir, n), set()).add(c)
+        return out
+
+    def stats(self):
+        """สรุป dataset: จำนวนรูป/มี label/ไม่มี label, ต่อ class (object, รูป), ขนาดกรอบ (median, small/medium/large)"""
+        with closing(self._connect()) as con:
+            n_images, n_labeled, n_bytes = con.execute(
+                "SELECT COUNT(*), SUM(label_mtime_ns IS NOT NULL AND n_objects > 0), SUM(bytes) FROM images").fetchone()
+            per_class = con.execute("SELECT cls, COUNT(*), COUNT(DISTINCT name), AVG(w), AVG(h) FROM objects "
+                                    "GROUP BY cls ORDER BY cls").fetchall()
+            wh = np.array(con.execute("SELECT w, h FROM objects").fetchall(), dtype=np.float64).reshape(-1, 2)
+        area = wh[:, 0] * wh[:, 1]
+        return {
+            "images": n_images or 0,
+            "labeled": n_labeled or 0,
+            "unlabeled": (n_images or 0) - (n_labeled or 0),
+            "bytes": n_bytes or 0,
+            "classes": {c: {"objects": n, "images": k, "mean_w": mw, "mean_h": mh} for c, n, k, mw, mh in per_class},
+            "median_wh": tuple(np.median(wh, axis=0)) if len(wh) else (0.0, 0.0),
+            # สัดส่วนพื้นที่ต่อรูป: <1% เล็ก, 1-10% กลาง, >10% ใหญ่
+            "small": int((area < 0.01).sum()),
+            "medium": int(((area >= 0.01) & (area < 0.1)).sum()),
+            "large": int((area >= 0.1).sum()),
+        }
+
+
+# ---------- Dataset split ----------
+SPLIT_SEED = 0
+SESSION_GAP = 120.0   # วินาที: รูปที่ถ่ายห่างกันเกินนี้ถือเป็นคนละ session
+SPLIT_MARKER_NAME = ".split_by_app"  # ใน images/train: โฟลเดอร์ train/val สร้างโดย split_dataset (แบ่งใหม่ได้ทุกครั้ง)
+
+def read_label_classes(label_path):
+    """ชุดหมายเลข class ในไฟล์ label แบบ YOLO (set ว่างถ้าไม่มีไฟล์/ไม่มี object)"""
+    try:
+        with open(label_path, "r", encoding="utf-8") as f:
+            return {int(line.split(maxsplit=1)[0]) for line in f if line.strip()}
+    except (OSError, ValueError):
+        return set()
+
+def session_groups(image_files, gap=SESSION_GAP):
+    """จัดรูปเป็นกลุ่มตาม session ที่ถ่าย: ชื่อขึ้นต้นเหมือนกัน (ตัดเลขท้ายออก) และเวลาไฟล์ต่อเนื่องกัน
+
+    ชื่อไฟล์ในโปรเจกต์เป็น img_0001.jpg จึงดูจาก mtime เป็นหลัก (hard link/copy2 ยังเก็บเวลาถ่ายไว้)
+    คืน dict path -> หมายเลขกลุ่ม
+    """
+    def prefix(p):
+        return os.path.splitext(os.path.basename(p))[0].rstrip("0123456789_-")
+
+    items = sorted((prefix(p), os.stat(p).st_mtime, p) for p in image_files)
+    groups, gid, last = {}, -1, None
+    for pre, mtime, p in items:
+        if last is None or pre != last[0] or mtime - last[1] > gap:
+            gid += 1
+        groups[p] = gid
+        last = (pre, mtime)
+    return groups
+
+def stratified_split(image_classes, val_frac=0.2, seed=SPLIT_SEED, groups=None):
+    """แบ่ง train/val ให้ทุก class มีสัดส่วนใน val ใกล้เคียง val_frac (seed คงที่ ผลเหมือนเดิมทุกครั้ง)
+
+    image_classes: dict path -> set ของ class, groups: dict path -> กลุ่ม (กลุ่มเดียวกันอยู่ฝั่งเดียวกันเสมอ)
+    หน่วยที่แบ่ง (รูปหรือกลุ่ม) ถูกจัดเข้าชั้นตาม class ที่หายากที่สุดที่มีอยู่ คืน (train, val) เป็น list ของ path
+    """
+    units = defaultdict(list)
+    for p in sorted(image_classes):
+        units[groups[p] if groups else p].append(p)
+    freq = defaultdict(int)
+    for classes in image_classes.values():
+        for c in classes:
+            freq[c] += 1
+    strata = defaultdict(list)
+    for key, paths in units.items():
+        classes = set().union(*(image_classes[p] for p in paths))
+        strata[min(classes, key=lambda c: (freq[c], c)) if classes else -1].append(key)
+
+    rng = np.random.default_rng(seed)
+    val = set()
+    for stratum in sorted(strata):
+        keys = strata[stratum]
+        order = rng.permutation(len(keys))
+        target = val_frac * sum(len(units[k]) for k in keys)
+        taken = 0
+        for i in order[:len(keys) - 1]:   # เหลือไว้ใน train อย่างน้อยหนึ่งหน่วยเสมอ
+            if taken >= target - 0.5:
+                break
+            val.add(keys[i])
+            taken += len(units[keys[i]])
+    if not val and len(units) > 1:
+        val.add(min(units, key=lambda k: len(units[k])))
+    train = [p for k, paths in units.items() if k not in val for p in paths]
+    return sorted(train), sorted(p for k in val for p in units[k])
+
+def is_app_split(dataset_dir):
+    """images/train ถูกสร้างโดย split_dataset (ไม่ใช่ split ที่ผู้ใช้เตรียมมาเอง)"""
+    return os.path.exists(os.path.join(dataset_dir, "images", "train", SPLIT_MARKER_NAME))
+
+def clear_app_split(dataset_dir):
+    """ลบ images|labels/{train,val} ที่ split_dataset สร้างไว้ (เป็น hard link/สำเนา ต้นฉบับยังอยู่ใน images/)"""
+    if not is_app_split(dataset_dir):
+        return
+    # images/train (ที่มี marker) ลบทีหลังสุด: ถ้าค้างกลางทาง ครั้งหน้ายังรู้ว่าเป็นของแอปและลบต่อได้
+    for sub, part in (("labels", "val"), ("labels", "train"), ("images", "val"), ("images", "train")):
+        shutil.rmtree(os.path.join(dataset_dir, sub, part), ignore_errors=True)
+
+def split_dataset(dataset_dir, val_frac=0.2, seed=SPLIT_SEED, group_sessions=False, use_links=False, manifest=None,
+                  dedup_radius=None):
+    """แบ่ง train/val ของ dataset (images/ + labels/) โดยไม่คัดลอกไฟล์
+
+    ปกติเขียน train.txt/val.txt (รายการ path แบบที่ Ultralytics อ่านได้ label หาจาก images -> labels เอง)
+    use_links=True: สร้าง images/train, images/val (+ labels) เป็น hard link แทน (คัดลอกเฉพาะเมื่อ link ไม่ได้)
+        พร้อม marker ว่าแอปสร้างเอง ครั้งหน้าจะลบแล้วแบ่งใหม่ (ไม่มี link ค้างจากการแบ่งครั้งก่อน)
+    manifest: DatasetManifest ของ images/ + labels/ (อ่าน class จากนั้นแทนการเปิดไฟล์ label ทุกไฟล์)
+    dedup_radius: ถ้าไม่ใช่ None ใช้รูปเดียวต่อกลุ่มรูปที่เกือบซ้ำ (ดู near_duplicate_clusters)
+    คืน (ค่า train, ค่า val สำหรับ data.yaml, dict สถิติ)
+    """
+    t0 = time.perf_counter()
+    imgs = os.path.join(dataset_dir, "images")
+    lbls = os.path.join(dataset_dir, "labels")
+
+    def label_of(p):
+        return os.path.join(lbls, os.path.splitext(os.path.basename(p))[0] + ".txt")
+
+    if manifest is not None:
+        manifest.refresh()
+        image_classes = manifest.image_classes()
+        image_files = sorted(image_classes)
+    else:
+        image_files = sorted(e.path for e in os.scandir(imgs) if e.is_file() and e.name.lower().endswith(IMAGE_EXTS))
+        image_classes = {p: read_label_classes(label_of(p)) for p in image_files}
+    if not image_files:
+        raise RuntimeError("ไม่พบไฟล์รูปใน images/")
+    duplicates = set()
+    if dedup_radius is not None:
+        # รูปเกือบซ้ำเพิ่มเวลา train แต่แทบไม่เพิ่มข้อมูล: เก็บรูปที่มี class มากที่สุดของแต่ละกลุ่มไว้รูปเดียว
+        for group in near_duplicate_clusters(compute_hashes(image_files), dedup_radius):
+            keep = max(group, key=lambda p: len(image_classes[p]))
+            duplicates.update(p for p in group if p != keep)
+        image_files = [p for p in image_files if p not in duplicates]
+        image_classes = {p: image_classes[p] for p in image_files}
+    groups = session_groups(image_files) if group_sessions else None
+    train, val = stratified_split(image_classes, val_frac, seed, groups)
+    if not val and groups:
+        # ทั้ง dataset เป็น session เดียว (หรือ session น้อยเกินไป): แบ่งทีละรูปแทน ไม่ให้ val ว่าง
+        print("⚠️ แบ่งตาม session แล้ว val ว่าง — แบ่งทีละรูปแทน")
+        groups = None
+        train, val = stratified_split(image_classes, val_frac, seed)
+    if not val:
+        raise RuntimeError("รูปน้อยเกินกว่าจะแบ่ง train/val (ต้องมีอย่างน้อย 2 รูป)")
+    full_copy = sum(os.path.getsize(p) + (os.path.getsize(label_of(p)) if os.path.exists(label_of(p)) else 0)
+                    for p in image_files)
+    stats = {"train": len(train), "val": len(val), "sessions": len(set(groups.values())) if groups else 0,
+             "duplicates": len(duplicates), "copied_bytes": 0, "full_copy_bytes": full_copy}
+
+    clear_app_split(dataset_dir)
+    if use_links:
+        copied = 0
+        os.makedirs(os.path.join(imgs, "train"), exist_ok=True)
+        open(os.path.join(imgs, "train", SPLIT_MARKER_NAME), "w").close()
+        for part, files in (("train", train), ("val", val)):
+            for src_dir, make_dst in ((imgs, lambda p: p), (lbls, label_of)):
+                out_dir = os.path.join(src_dir, part)
+                os.makedirs(out_dir, exist_ok=True)
+                for p in files:
+                    src = make_dst(p)
+                    if not os.path.exists(src):
+                        continue
+                    dst = os.path.join(out_dir, os.path.basename(src))
+                    if os.path.lexists(dst):
+                        os.remove(dst)
+                    try:
+                        os.link(src, dst)
+                    except OSError:
+                        shutil.copy2(src, dst)
+                        copied += os.path.getsize(dst)
+        stats["copied_bytes"] = copied
+        refs = (os.path.join("images", "train"), os.path.join("images", "val"))
+    else:
+        for part, files in (("train", train), ("val", val)):
+            # path แบบ ./images/... อ้างอิงจากโฟลเดอร์ของไฟล์ txt ย้าย dataset ทั้งโฟลเดอร์ได้
+            with open(os.path.join(dataset_dir, f"{part}.txt"), "w", encoding="utf-8") as f:
+                f.write("".join(f"./images/{os.path.basename(p)}\n" for p in files))
+            stats["copied_bytes"] += os.path.getsize(os.path.join(dataset_dir, f"{part}.txt"))
+        refs = ("train.txt", "val.txt")
+    stats["seconds"] = time.perf_counter() - t0
+    return refs[0], refs[1], stats
+
+
+# ---------- Training progress ----------
+TRAIN_EVENT_INTERVAL = 0.25  # วินาที: ส่งความคืบหน้าราย batch เข้าคิวไม่ถี่กว่านี้
+
+
+class TrainProgress:
+    """รับความคืบหน้าจาก callback ของ Ultralytics trainer แล้วส่งเข้าคิวให้ UI มาดึงไปแสดง
+
+    callback ทำงานใน thread ที่กำลังฝึก จึงทำแค่ put ลงคิว ไม่แตะ widget
+    ETA คิดจากเวลาเฉลี่ยต่อ batch (EMA) รวมกับเวลา validation ต่อ epoch
+    """
+
+    def __init__(self, interval=TRAIN_EVENT_INTERVAL, clock=time.monotonic):
+        self.events = queue.Queue()
+        self.interval = interval
+        self.clock = clock
+        self.epochs = 1
+        self.nb = 1
+        self.batch_time = None
+        self.val_time = 0.0
+        self._batch = 0
+        self._batch_ts = None
+        self._val_start = None
+        self._last_put = 0.0
+
+    def attach(self, model):
+        for event, fn in (("on_train_start", self._on_train_start),
+                          ("on_train_epoch_start", self._on_epoch_start),
+                          ("on_train_batch_end", self._on_batch_end),
+                          ("on_train_epoch_end", self._on_epoch_end),
+                          ("on_fit_epoch_end", self._on_fit_epoch_end),
+                          ("on_train_end", self._on_train_end)):
+            model.add_callback(event, self._guard(fn))
+
+    def _guard(self, fn):
+        def callback(trainer):
+            try:
+                fn(trainer)
+            except Exception as e:  # ส่งความคืบหน้าพลาดได้ แต่ห้ามทำให้การฝึกล้ม
+                print(f"⚠️ train progress: {e}")
+        return callback
+
+    def eta(self, epoch, batch):
+        """เวลาที่เหลือ (วินาที) เมื่อจบ batch ที่ `batch` ของ epoch `epoch` (เริ่มที่ 0)"""
+        if self.batch_time is None:
+            return None
+        batches = (self.epochs - epoch - 1) * self.nb + (self.nb - batch)
+        return batches * self.batch_time + (self.epochs - epoch) * self.val_time
+
+    @staticmethod
+    def _losses(trainer):
+        tloss = getattr(trainer, "tloss", None)
+        if tloss is None:
+            return {}
+        return {k: round(float(v), 4) for k, v in trainer.label_loss_items(tloss, prefix="train").items()}
+
+    # ---- callbacks (thread ที่ฝึก) ----
+    def _on_train_start(self, trainer):
+        # save_dir คือโฟลเดอร์จริง รวมกรณีชื่อซ้ำแล้วถูกเปลี่ยนเป็น name2, name3, ...
+        self.epochs = max(1, int(trainer.epochs))
+        self.nb = max(1, len(trainer.train_loader))
+        self.events.put(("start", {"save_dir": str(trainer.save_dir), "epochs": self.epochs, "nb": self.nb}))
+
+    def _on_epoch_start(self, trainer):
+        self._batch = 0
+        self._batch_ts = self.clock()
+
+    def _on_batch_end(self, trainer):
+        now = self.clock()
+        self._batch += 1
+        if self._batch_ts is not None:
+            dt = now - self._batch_ts
+            self.batch_time = dt if self.batch_time is None else 0.9 * self.batch_time + 0.1 * dt
+        self._batch_ts = now
+        if now - self._last_put < self.interval and self._batch < self.nb:
+            return
+        self._last_put = now
+        self.events.put(("batch", {"epoch": trainer.epoch, "batch": min(self._batch, self.nb),
+                                   "eta": self.eta(trainer.epoch, self._batch), "loss": self._losses(trainer)}))
+
+    def _on_epoch_end(self, trainer):
+        self._val_start = self.clock()
+
+    def _on_fit_epoch_end(self, trainer):
+        if self._val_start is not None:
+            self.val_time = self.clock() - self._val_start
+            self._val_start = None
+        metrics = {k: round(float(v), 4) for k, v in (getattr(trainer, "metrics", None) or {}).items()}
+        self.events.put(("epoch", {"epoch": trainer.epoch, "metrics": metrics,
+                                   "eta": self.eta(trainer.epoch + 1, 0)}))
+
+    def _on_train_end(self, trainer):
+        self.events.put(("end", {"save_dir": str(trainer.save_dir)}))
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return "เหลือเวลา: -"
+    seconds = max(0, int(seconds))
+    return f"เหลือเวลา ~ {seconds // 3600} ชั่วโมง {seconds % 3600 // 60} นาที {seconds % 60} วินาที"
+
+
+def format_train_metrics(epoch, metrics, losses=None):
+    """สรุป loss/mAP ล่าสุดเป็นบรรทัดเดียว (ใช้ค่า mask ถ้าเป็นงาน segment)"""
+    parts = [f"epoch {epoch + 1}"]
+    for k, v in (losses or {}).items():
+        parts.append(f"{k.split('/')[-1]} {v:.3f}")
+    for name in ("mAP50", "mAP50-95"):
+        v = metrics.get(f"metrics/{name}(M)", metrics.get(f"metrics/{name}(B)"))
+        if v is not None:
+            parts.append(f"{name} {v:.3f}")
+    return " | ".join(parts)
 
 
 # ---------- Tab 3: Train & Test ----------
@@ -968,8 +4166,13 @@ class TrainTestTab(ctk.CTkFrame):
         left.grid_columnconfigure(0, weight=1)
         left.grid_rowconfigure(7, weight=1)
 
-        self.ds_btn = ctk.CTkButton(left, text="เลือกโฟลเดอร์ Dataset (images + labels)", command=self._choose_dataset)
+        ds_frame = ctk.CTkFrame(left, fg_color="transparent")
+        ds_frame.grid(row=0, column=0, sticky="ew")
+        ds_frame.grid_columnconfigure(0, weight=1)
+        self.ds_btn = ctk.CTkButton(ds_frame, text="เลือกโฟลเดอร์ Dataset (images + labels)", command=self._choose_dataset)
         self.ds_btn.grid(row=0, column=0, sticky="ew", padx=6, pady=6)
+        self.stats_btn = ctk.CTkButton(ds_frame, text="สถิติ Dataset", width=110, command=self._show_dataset_stats)
+        self.stats_btn.grid(row=0, column=1, padx=6, pady=6)
 
         mode_frame = ctk.CTkFrame(left)
         mode_frame.grid(row=1, column=0, sticky="ew", padx=6, pady=6)
@@ -1008,6 +4211,18 @@ class TrainTestTab(ctk.CTkFrame):
         for i, (lbl, widget) in enumerate(items):
             ctk.CTkLabel(params, text=lbl).grid(row=i, column=0, sticky="w", padx=6, pady=4)
             widget.grid(row=i, column=1, sticky="ew", padx=6, pady=4)
+        self.split_sessions_var = ctk.BooleanVar(value=False)
+        self.split_links_var = ctk.BooleanVar(value=False)
+        ctk.CTkCheckBox(params, text="แบ่ง val ตาม session ที่ถ่าย (ไม่ให้รูปชุดเดียวกันอยู่ทั้ง train และ val)",
+                        variable=self.split_sessions_var).grid(row=len(items), column=0, columnspan=2,
+                                                               sticky="w", padx=6, pady=4)
+        ctk.CTkCheckBox(params, text="ใช้ hard link (images/train, images/val) แทนไฟล์รายการ train.txt/val.txt",
+                        variable=self.split_links_var).grid(row=len(items) + 1, column=0, columnspan=2,
+                                                            sticky="w", padx=6, pady=4)
+        self.split_dedup_var = ctk.BooleanVar(value=False)
+        ctk.CTkCheckBox(params, text="ใช้รูปเดียวต่อกลุ่มรูปที่เกือบซ้ำ (ตัดรูปที่ label ซ้ำกันออก train เร็วขึ้น)",
+                        variable=self.split_dedup_var).grid(row=len(items) + 2, column=0, columnspan=2,
+                                                            sticky="w", padx=6, pady=4)
 
         self.train_btn = ctk.CTkButton(left, text="เริ่มการฝึก (Train)", fg_color="#2a8", hover_color="#277", command=self._start_train)
         self.train_btn.grid(row=4, column=0, sticky="ew", padx=6, pady=8)
@@ -1024,6 +4239,10 @@ class TrainTestTab(ctk.CTkFrame):
         self.progress_bar.grid(row=1, column=0, sticky="ew", padx=6, pady=4)
         self.eta_label = ctk.CTkLabel(status, text="เหลือเวลา: -")
         self.eta_label.grid(row=2, column=0, sticky="w", padx=6, pady=4)
+        self.split_label = ctk.CTkLabel(status, text="", anchor="w", justify="left")
+        self.split_label.grid(row=3, column=0, sticky="w", padx=6, pady=4)
+        self.metrics_label = ctk.CTkLabel(status, text="", anchor="w", justify="left")
+        self.metrics_label.grid(row=4, column=0, sticky="w", padx=6, pady=4)
 
         self.graph_label = ctk.CTkLabel(left, text="(จะแสดงกราฟเมื่อฝึกเสร็จ)")
         self.graph_label.grid(row=6, column=0, sticky="nsew", padx=6, pady=6)
@@ -1063,11 +4282,11 @@ class TrainTestTab(ctk.CTkFrame):
 
         # State
         self.dataset_dir = None
+        self._dataset_manifest = None   # DatasetManifest ของ dataset ที่เลือก (ใช้ร่วมกันทุกที่ในแท็บนี้)
+        self._manifest_waiters = []     # งานที่รอ manifest สร้างเสร็จ (เช่น กด Train ระหว่างอ่าน)
         self.train_thread = None
-        self.monitor_thread = None
-        self.stop_monitor = threading.Event()
+        self.train_progress = None  # TrainProgress ของรอบที่กำลังฝึก
         self.training_run_dir = None
-        self.epoch_times = deque(maxlen=5)
         self.train_start_ts = None
 
         self.test_image = None
@@ -1100,62 +4319,87 @@ class TrainTestTab(ctk.CTkFrame):
             messagebox.showerror("โครงสร้างไม่ถูกต้อง", "ต้องมีโฟลเดอร์ images และ labels ภายใน")
             return
         self.dataset_dir = folder
+        self._manifest().refresh_async()  # อ่าน label ล่วงหน้าระหว่างกรอกพารามิเตอร์
         messagebox.showinfo("เลือก Dataset แล้ว", folder)
 
+    def _manifest(self):
+        # ใช้ object เดียวต่อ dataset: refresh ที่ซ้อนกันจึงรอกันด้วย _refresh_lock ไม่สร้างซ้ำสองรอบ
+        images = os.path.abspath(os.path.join(self.dataset_dir, "images"))
+        if self._dataset_manifest is None or self._dataset_manifest.images_dir != images:
+            self._dataset_manifest = DatasetManifest(images, os.path.join(self.dataset_dir, "labels"))
+        return self._dataset_manifest
+
+    def _wait_manifest(self, then):
+        """ถ้า manifest ยังสร้างอยู่ใน background ให้รอด้วย after() (ไม่ refresh ซ้ำบน Tk thread) แล้วเรียก then()"""
+        manifest = self._manifest()
+        if not manifest.refreshing:
+            return False
+        self.split_label.configure(text="กำลังอ่านข้อมูล dataset ...")
+        if then not in self._manifest_waiters:
+            self._manifest_waiters.append(then)
+            if len(self._manifest_waiters) == 1:
+                self.after(200, self._poll_manifest_wait, manifest)
+        return True
+
+    def _poll_manifest_wait(self, manifest):
+        if manifest.refreshing:
+            self.after(200, self._poll_manifest_wait, manifest)
+            return
+        waiters, self._manifest_waiters = self._manifest_waiters, []
+        self.split_label.configure(text="")
+        for then in waiters:
+            then()
+
+    def _show_dataset_stats(self):
+        if not self.dataset_dir:
+            messagebox.showwarning("ยังไม่เลือก Dataset", "กรุณาเลือกโฟลเดอร์ Dataset ก่อน")
+            return
+        manifest = self._manifest()
+        if not manifest.refreshing and manifest.last_refresh is None:
+            manifest.refresh_async()
+        if self._wait_manifest(self._show_dataset_stats):
+            return
+        changes = manifest.refresh()  # สร้างเสร็จแล้ว เหลือแค่ส่วนที่เปลี่ยน
+        st = manifest.stats()
+        lines = [f"รูปทั้งหมด {st['images']} รูป ({st['bytes'] / 1024 / 1024:.0f} MB)",
+                 f"มี label {st['labeled']} รูป, ไม่มี label {st['unlabeled']} รูป", "", "ต่อ class:"]
+        total_obj = sum(c["objects"] for c in st["classes"].values()) or 1
+        for cls, c in st["classes"].items():
+            lines.append(f"  {cls}: {c['objects']} object ({100 * c['objects'] / total_obj:.0f}%) ใน {c['images']} รูป, "
+                         f"กรอบเฉลี่ย {c['mean_w']:.2f} x {c['mean_h']:.2f}")
+        w, h = st["median_wh"]
+        lines += ["", f"ขนาดกรอบ (median) {w:.3f} x {h:.3f} ของรูป",
+                  f"เล็ก (<1% ของรูป) {st['small']}, กลาง {st['medium']}, ใหญ่ (>10%) {st['large']}",
+                  "", f"อัปเดต manifest {changes['updated']} รูปใน {1000 * changes['seconds']:.0f} ms"]
+        messagebox.showinfo("สถิติ Dataset", "\n".join(lines))
+
     def _build_data_yaml(self, names, nc, imgsz):
         # Split dataset into train/val (80/20) if not existing
         imgs = os.path.join(self.dataset_dir, "images")
-        lbls = os.path.join(self.dataset_dir, "labels")
-
-        def list_files(d, ext=(".jpg", ".jpeg", ".png")):
-            arr = []
-            for e in ext:
-                arr.extend(glob.glob(os.path.join(d, f"*{e}")))
-            arr.sort()
-            return arr
-
-        image_files = list_files(imgs)
-        if not image_files:
-            raise RuntimeError("ไม่พบไฟล์รูปใน images/")
-        # If already has train/val, use them
-        if os.path.isdir(os.path.join(imgs, "train")) and os.path.isdir(os.path.join(imgs, "val")):
-            data = {
-                "path": self.dataset_dir,
-                "train": os.path.join("images", "train"),
-                "val": os.path.join("images", "val"),
-                "nc": nc,
-                "names": names
-            }
+        # If already has train/val (เตรียมมาเอง ไม่ใช่ที่ split_dataset สร้าง), use them
+        if (os.path.isdir(os.path.join(imgs, "train")) and os.path.isdir(os.path.join(imgs, "val"))
+                and not is_app_split(self.dataset_dir)):
+            train, val = os.path.join("images", "train"), os.path.join("images", "val")
         else:
-            # Create split by moving/copying indexes into subfolders
-            tr_imgs = os.path.join(imgs, "train"); va_imgs = os.path.join(imgs, "val")
-            tr_lbls = os.path.join(lbls, "train"); va_lbls = os.path.join(lbls, "val")
-            os.makedirs(tr_imgs, exist_ok=True); os.makedirs(va_imgs, exist_ok=True)
-            os.makedirs(tr_lbls, exist_ok=True); os.makedirs(va_lbls, exist_ok=True)
-
-            # Prepare split indexes
-            n = len(image_files)
-            n_val = max(1, int(0.2 * n))
-            val_set = set(image_files[-n_val:])
-            for img_path in image_files:
-                base = os.path.splitext(os.path.basename(img_path))[0]
-                lbl_src = os.path.join(lbls, base + ".txt")
-                if img_path in val_set:
-                    shutil.copy2(img_path, os.path.join(va_imgs, os.path.basename(img_path)))
-                    if os.path.exists(lbl_src):
-                        shutil.copy2(lbl_src, os.path.join(va_lbls, os.path.basename(lbl_src)))
-                else:
-                    shutil.copy2(img_path, os.path.join(tr_imgs, os.path.basename(img_path)))
-                    if os.path.exists(lbl_src):
-                        shutil.copy2(lbl_src, os.path.join(tr_lbls, os.path.basename(lbl_src)))
-
-            data = {
-                "path": self.dataset_dir,
-                "train": os.path.join("images", "train"),
-                "val": os.path.join("images", "val"),
-                "nc": nc,
-                "names": names
-            }
+            # ไม่คัดลอกรูป: เขียนรายการไฟล์ (หรือ hard link) แบ่งแบบ stratified ตาม class ด้วย seed คงที่
+            train, val, st = split_dataset(self.dataset_dir, group_sessions=self.split_sessions_var.get(),
+                                           use_links=self.split_links_var.get(), manifest=self._manifest(),
+                                           dedup_radius=DEDUP_RADIUS if self.split_dedup_var.get() else None)
+            info = (f"แบ่ง train {st['train']} / val {st['val']} รูป"
+                    + (f" ({st['sessions']} session)" if st["sessions"]
+                       else " (แบ่งทีละรูป: session น้อยเกินไป)" if self.split_sessions_var.get() else "")
+                    + (f" ตัดรูปเกือบซ้ำ {st['duplicates']} รูป" if st["duplicates"] else "")
+                    + f" ใน {1000 * st['seconds']:.0f} ms, ใช้ดิสก์เพิ่ม {st['copied_bytes'] / 1024:.0f} KB"
+                    f" (แบบคัดลอกเดิม {st['full_copy_bytes'] / 1024 / 1024:.0f} MB)")
+            print(info)
+            self.split_label.configure(text=info)
+        data = {
+            "path": self.dataset_dir,
+            "train": train,
+            "val": val,
+            "nc": nc,
+            "names": names
+        }
 
         yaml_path = os.path.join(self.dataset_dir, f"data_{now_str()}.yaml")
         try:
@@ -1181,12 +4425,10 @@ class TrainTestTab(ctk.CTkFrame):
         if not self.dataset_dir:
             messagebox.showwarning("ยังไม่เลือก Dataset", "กรุณาเลือกโฟลเดอร์ Dataset ก่อน")
             return
-        # Reset state
-        self.stop_monitor.set()  # หยุด monitor เก่า
-        time.sleep(0.5)  # รอให้ thread เก่าหยุด
-        self.stop_monitor.clear()
-        self.training_run_dir = None
-        self.epoch_times.clear()
+        if self.train_thread is not None and self.train_thread.is_alive():
+            return
+        if self._wait_manifest(self._start_train):
+            return
 
         try:
             nc = int(self.num_classes.get().strip())
@@ -1209,24 +4451,32 @@ class TrainTestTab(ctk.CTkFrame):
                 names = names[:nc]
         project_name = safe_filename(self.project_name.get().strip() or f"{mode}_{model_size}_{now_str()}")
 
-        data_yaml = self._build_data_yaml(names, nc, imgsz)
+        try:
+            data_yaml = self._build_data_yaml(names, nc, imgsz)
+        except RuntimeError as e:
+            messagebox.showerror("แบ่ง train/val ไม่ได้", str(e))
+            return
 
         # choose model
         model_name = f"model/yolo11{model_size}.pt" if mode == "detect" else f"model/yolo11{model_size}-seg.pt"
         self.train_btn.configure(state="disabled")
-        self.stop_monitor.clear()
         self.progress_bar.set(0.0)
         self.progress_label.configure(text="ความคืบหน้า: 0%")
         self.eta_label.configure(text="เหลือเวลา: -")
+        self.metrics_label.configure(text="")
         self.graph_label.configure(text="(กำลังฝึก...)")
-        self.epoch_times.clear()
+        self.training_run_dir = None
         self.train_start_ts = time.time()
+        # ความคืบหน้ามาจาก callback ของ trainer ผ่านคิว ไม่ต้อง poll results.csv
+        progress = TrainProgress()
+        self.train_progress = progress
 
         def train_worker():
-            nonlocal model_name, data_yaml, epochs, batch, imgsz, project_name
+            error = None
             try:
                 model = YOLO(model_name)
-                results = model.train(
+                progress.attach(model)
+                model.train(
                     data=data_yaml,
                     epochs=epochs,
                     imgsz=imgsz,
@@ -1253,116 +4503,78 @@ class TrainTestTab(ctk.CTkFrame):
                 del model
                 import gc
                 gc.collect()
-                self._show_training_graph()
-                # Find run dir
-                # Ultralytics runs dir defaults to 'runs/detect' or 'runs/segment'
-                task_dir = "detect" if self.mode_var.get() == "detect" else "segment"
-                runs_root = os.path.join(APP_ROOT, "runs", task_dir, project_name)
-                latest = sorted(glob.glob(os.path.join(runs_root, "*")), key=os.path.getmtime)
-                self.training_run_dir = latest[-1] if latest else None
             except Exception as e:
-                messagebox.showerror("Training ล้มเหลว", str(e))
+                error = str(e)
             finally:
-                # บอก monitor thread ให้หยุด
-                self.stop_monitor.set()
-                # คืนปุ่ม Train ให้กดได้
-                self.train_btn.configure(state="normal")
-                pass
-
-        def monitor_worker():
-            # wait for results.csv and update progress
-            # scan results.csv within runs/* path
-            time.sleep(2.0)
-            task_dir = "detect" if self.mode_var.get() == "detect" else "segment"
-            # poll until we can find a results.csv
-            results_csv = None
-            while not self.stop_monitor.is_set():
-                # if training_run_dir known, check there first
-                if self.training_run_dir:
-                    rc = os.path.join(self.training_run_dir, "results.csv")
-                    if os.path.isfile(rc):
-                        results_csv = rc
-                        break
-                # else, try to find most recent results.csv
-                candidates = glob.glob(os.path.join(APP_ROOT, "runs", task_dir, f"{project_name}", "results.csv"))
-                if candidates:
-                    results_csv = sorted(candidates, key=os.path.getmtime)[-1]
-                    # set training_run_dir based on this file
-                    self.training_run_dir = os.path.dirname(results_csv)
-                    break
-                time.sleep(1.0)
-
-            last_epoch = 0
-            total_epochs = 1
-            while not self.stop_monitor.is_set() and results_csv and os.path.isfile(results_csv):
-                try:
-                    with open(results_csv, "r", newline="") as f:
-                        reader = csv.DictReader(f)
-                        rows = list(reader)
-                        if rows:
-                            last = rows[-1]
-                            # 'epoch' column usually present
-                            try:
-                                cur_epoch = int(float(last.get("epoch", len(rows)-1)))
-                            except Exception:
-                                cur_epoch = len(rows) - 1
-                            # estimate total from user input epochs
-                            total_epochs = max(total_epochs, int(self.epochs.get() or "1"))
-                            # update timing
-                            if cur_epoch > last_epoch:
-                                self.epoch_times.append(time.time())
-                                last_epoch = cur_epoch
-                            prog = min(100, int(100 * (cur_epoch + 1) / max(1, total_epochs)))
-                            # ETA estimation
-                            if len(self.epoch_times) >= 2:
-                                avg_epoch_time = (self.epoch_times[-1] - self.epoch_times[0]) / (len(self.epoch_times) - 1)
-                                remaining = max(0, (total_epochs - (cur_epoch + 1)) * avg_epoch_time)
-                            else:
-                                remaining = 0
-                            hrs = int(remaining // 3600)
-                            mins = int((remaining % 3600) // 60)
-                            secs = int(remaining % 60)
-                            self.progress_bar.set(prog / 100.0)
-                            self.progress_label.configure(text=f"ความคืบหน้า: {prog}%  {cur_epoch}/{total_epochs} epoch")
-                            self.eta_label.configure(text=f"เหลือเวลา ~ {hrs} ชั่วโมง {mins} นาที {secs} วินาที")
-
-                except Exception:
-                    pass
-                time.sleep(1.0)
-            self.stop_monitor.set()
-            self.train_btn.configure(state="normal")
-
-            # On finish: show graph
-            self._show_training_graph()
-            print("=========================================================")
-            # re-enable train button
-            self.train_btn.configure(state="normal")
-            # log session
-            try:
-                end_ts = time.time()
-                self.session_logger.add_train(
-                    mode=self.mode_var.get(),
-                    model_size=self.model_size.get(),
-                    num_classes=int(self.num_classes.get() or "0"),
-                    class_names=[s.strip() for s in self.class_names.get().split(",") if s.strip()],
-                    epochs=int(self.epochs.get() or "0"),
-                    batch=int(self.batch.get() or "0"),
-                    imgsz=int(self.imgsz.get() or "0"),
-                    project_name=self.project_name.get().strip(),
-                    start_time=self.train_start_ts or end_ts,
-                    end_time=end_ts
-                )
-            except Exception:
-                pass
-
-        self.training_run_dir = None
-        self.stop_monitor.clear()
+                # thread นี้ไม่แตะ widget: ให้ _poll_train ปิดงานใน UI thread
+                progress.events.put(("done", {"error": error}))
 
         self.train_thread = threading.Thread(target=train_worker, daemon=True)
         self.train_thread.start()
-        self.monitor_thread = threading.Thread(target=monitor_worker, daemon=True)
-        self.monitor_thread.start()
-        # self._show_training_graph()
+        self.after(200, self._poll_train, progress)
+
+    def _poll_train(self, progress):
+        if self.train_progress is not progress:
+            return
+        batch_ev = None
+        done = None
+        while True:
+            try:
+                kind, ev = progress.events.get_nowait()
+            except queue.Empty:
+                break
+            if kind in ("start", "end"):
+                self.training_run_dir = ev["save_dir"]
+            elif kind == "batch":
+                batch_ev = ev  # แสดงแค่อันล่าสุดในรอบนี้
+            elif kind == "epoch":
+                batch_ev = None
+                self._show_train_progress(progress, ev["epoch"], progress.nb, ev["eta"])
+                self.metrics_label.configure(text=format_train_metrics(ev["epoch"], ev["metrics"]))
+            elif kind == "done":
+                done = ev
+        if batch_ev is not None:
+            self._show_train_progress(progress, batch_ev["epoch"], batch_ev["batch"], batch_ev["eta"])
+            if batch_ev["loss"]:
+                self.metrics_label.configure(text=format_train_metrics(batch_ev["epoch"], {}, batch_ev["loss"]))
+        if done is None:
+            self.after(200, self._poll_train, progress)
+            return
+        self._finish_train(done["error"])
+
+    def _show_train_progress(self, progress, epoch, batch, eta):
+        done = min(1.0, (epoch * progress.nb + batch) / (progress.epochs * progress.nb))
+        self.progress_bar.set(done)
+        self.progress_label.configure(text=f"ความคืบหน้า: {int(100 * done)}%  epoch {epoch + 1}/{progress.epochs}"
+                                           f"  batch {batch}/{progress.nb}")
+        self.eta_label.configure(text=format_eta(eta))
+
+    def _finish_train(self, error):
+        self.train_progress = None
+        self.train_btn.configure(state="normal")
+        if error:
+            messagebox.showerror("Training ล้มเหลว", error)
+        else:
+            self.eta_label.configure(text=format_eta(0))
+        self._show_training_graph()
+        print("=========================================================")
+        # log session
+        try:
+            end_ts = time.time()
+            self.session_logger.add_train(
+                mode=self.mode_var.get(),
+                model_size=self.model_size.get(),
+                num_classes=int(self.num_classes.get() or "0"),
+                class_names=[s.strip() for s in self.class_names.get().split(",") if s.strip()],
+                epochs=int(self.epochs.get() or "0"),
+                batch=int(self.batch.get() or "0"),
+                imgsz=int(self.imgsz.get() or "0"),
+                project_name=self.project_name.get().strip(),
+                start_time=self.train_start_ts or end_ts,
+                end_time=end_ts
+            )
+        except Exception:
+            pass
 
     def _show_training_graph(self):
         # Try to display results.png, else generate from results.csv
@@ -1528,7 +4740,7 @@ class TrainTestTab(ctk.CTkFrame):
 
     def destroy(self):
         try:
-            self.stop_monitor.set()
+            self.train_progress = None
             self.running_cam = False
         except Exception:
             pass
@@ -1606,6 +4818,251 @@ class YOLOManagerApp(ctk.CTk):
         self.destroy()
 
 
+# ---------- Benchmarks ----------
+# python "Training - Copy.py" --bench <ชื่อ>   (ไม่ใส่ชื่อ = แสดงรายการ)
+BENCHMARKS = {}
+
+def benchmark(name):
+    def register(fn):
+        BENCHMARKS[name] = fn
+        return fn
+    return register
+
+def _timing_line(name, times):
+    times = sorted(times)
+    n = len(times)
+    return f"{name:<22} mean {1000 * sum(times) / n:7.2f} ms  p95 {1000 * times[int(0.95 * (n - 1))]:7.2f} ms"
+
+def _legacy_render(tab):
+    # renderer เดิมของ LabelTab._render_canvas: ผสม overlay เต็มภาพ + LANCZOS ทั้งภาพ + PhotoImage ใหม่
+    disp = tab.base_img.convert("RGBA")
+    for cid, m in tab.mask_by_image.get(tab.base_img_path, {}).items():
+        m_np = np.array(m)
+        if m_np.max() == 0:
+            continue
+        overlay = Image.new("RGBA", disp.size, tab._class_rgb(cid) + (0,))
+        ov_np = np.array(overlay)
+        ov_np[m_np > 0, 3] = int(255 * 0.30)
+        disp = Image.alpha_composite(disp, Image.fromarray(ov_np, "RGBA"))
+    disp = draw_boxes_on_pil(disp.convert("RGB"), tab.boxes_by_image.get(tab.base_img_path, []))
+    if abs(tab.zoom_scale - 1.0) > 1e-3:
+        w, h = disp.size
+        disp = disp.resize((int(w * tab.zoom_scale), int(h * tab.zoom_scale)), Image.LANCZOS)
+    tab.tk_img_handle = ImageTk.PhotoImage(disp)
+    tab.tkcanvas.itemconfig(tab.canvas_img_id, image=tab.tk_img_handle)
+
+@benchmark("brush")
+def bench_brush(dabs=120):
+    """เวลาต่อการลากแปรงหนึ่งครั้ง (paint + วาดจอ) ที่ 1080p และ 4K, zoom 1.0 และ 0.5"""
+    import tempfile
+    root = ctk.CTk()
+    root.geometry("1400x900")
+    tab = LabelTab(root, lambda: [])
+    tab.pack(fill="both", expand=True)
+    tab._set_active_class(0)
+    tmp = tempfile.mkdtemp()
+    rng = np.random.default_rng(0)
+    try:
+        for w, h in [(1920, 1080), (3840, 2160)]:
+            path = os.path.join(tmp, f"bench_{w}x{h}.jpg")
+            noise = cv2.GaussianBlur(rng.integers(0, 255, (h, w, 3), dtype=np.uint8), (0, 0), 3)
+            cv2.imwrite(path, noise)
+            tab.load_folder(tmp)
+            tab._select_index(tab.images.index(path))
+            root.update()
+            for zoom in (1.0, 0.5):
+                tab.zoom_scale = zoom
+                tab._render_canvas()
+                root.update()
+                for name, step in (("ใหม่ (dirty rect)", None), ("เดิม (ทั้งภาพ)", _legacy_render)):
+                    tab.mask_by_image[path] = {}
+                    tab._render_canvas()
+                    times = []
+                    for i in range(dabs):
+                        x = 100 + (i * 13) % (w // 2)
+                        y = 100 + (i * 7) % (h // 2)
+                        t = time.perf_counter()
+                        if step is None:
+                            tab._paint_at(x, y)
+                        else:
+                            mask = tab.mask_by_image[path].setdefault(0, Image.new("L", (w, h), 0))
+                            ImageDraw.Draw(mask).ellipse([x - 18, y - 18, x + 18, y + 18], fill=255)
+                            step(tab)
+                        root.update_idletasks()
+                        times.append(time.perf_counter() - t)
+                    print(_timing_line(f"{w}x{h} z{zoom} {name}", times))
+    finally:
+        root.destroy()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+@benchmark("masks")
+def bench_masks(n_images=1000, size=(3840, 2160), classes=2):
+    """หน่วยความจำของ mask ในงาน segment n_images รูป: dict ของ PIL (แบบเดิม) เทียบกับ MaskStore"""
+    import resource
+    import tempfile
+    rng = np.random.default_rng(0)
+    w, h = size
+    tmp = tempfile.mkdtemp()
+    store = MaskStore(cache_dir=tmp)
+    rss0 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t0 = time.perf_counter()
+    for i in range(n_images):
+        masks = {}
+        for cid in range(classes):
+            m = Image.new("L", size, 0)
+            draw = ImageDraw.Draw(m)
+            for _ in range(int(rng.integers(1, 4))):
+                cx, cy = rng.integers(0, w), rng.integers(0, h)
+                r = int(rng.integers(h // 20, h // 5))
+                draw.ellipse([cx - r, cy - r, cx + r, cy + r], fill=255)
+            masks[cid] = m
+        store[f"/bench/img_{i:05d}.jpg"] = masks
+    elapsed = time.perf_counter() - t0
+    rss1 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    st = store.stats()
+    mb = 1024 * 1024
+    print(f"{n_images} รูป {w}x{h} x {classes} คลาส")
+    print(f"  dict ของ PIL (เดิม): {n_images * classes * w * h / mb:10.1f} MiB")
+    print(f"  MaskStore: hot {st['hot_images']} รูป {st['hot_bytes'] / mb:.1f} MiB | "
+          f"warm {st['warm_images']} รูป {st['warm_bytes'] / mb:.1f} MiB | "
+          f"ดิสก์ {st['cold_images']} รูป {st['cold_bytes'] / mb:.1f} MiB")
+    print(f"  maxrss เพิ่มขึ้น {(rss1 - rss0) / 1024:.1f} MiB, ใช้เวลา {elapsed:.1f} s "
+          f"({1000 * elapsed / n_images:.1f} ms/รูป รวมวาด mask)")
+    t = time.perf_counter()
+    _ = store[f"/bench/img_{0:05d}.jpg"]
+    print(f"  เปิด mask รูปแรกกลับมา (warm/ดิสก์): {1000 * (time.perf_counter() - t):.1f} ms")
+    store.close()
+    shutil.rmtree(tmp, ignore_errors=True)
+
+@benchmark("journal")
+def bench_journal(n_images=3000, size=(3840, 2160)):
+    """เวลาเปิดโปรเจกต์ที่มี label autosave ไว้ n_images รูป (หลัง compact เป็น snapshot แล้ว)"""
+    import tempfile
+    tmp = tempfile.mkdtemp()
+    rng = np.random.default_rng(0)
+    w, h = size
+    try:
+        j = AnnotationJournal(tmp, compact_every=10 ** 9)
+        for i in range(n_images):
+            name = f"img_{i:05d}.jpg"
+            j.record(name, BoxEdit([], [(0, 10.0, 10.0, 200.0, 150.0), (1, 300.0, 300.0, 500.0, 420.0)]), size=size)
+            before = np.zeros((300, 300), np.uint8)
+            after = before.copy()
+            cv2.circle(after, (150, 150), 120, 255, -1)
+            x, y = int(rng.integers(0, w - 300)), int(rng.integers(0, h - 300))
+            j.record(name, MaskEdit(0, (x, y, x + 300, y + 300), before, after), size=size)
+        j.close()
+        t = time.perf_counter()
+        j = AnnotationJournal(tmp)
+        load = time.perf_counter() - t
+        t = time.perf_counter()
+        j.masks_for("img_00000.jpg")
+        first = time.perf_counter() - t
+        print(f"{len(j.state)} รูป: โหลด snapshot {1000 * load:.0f} ms, "
+              f"decode mask รูปแรก {1000 * first:.0f} ms, "
+              f"snapshot {os.path.getsize(j.snapshot_path) / 1024 / 1024:.1f} MiB")
+        j.close()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+@benchmark("export")
+def bench_export(n_images=2000, size=(1280, 720), with_mask=0.3):
+    """export ครั้งแรกเทียบกับ export ซ้ำหลังแก้ label 1% ของรูป"""
+    import tempfile
+    tmp = tempfile.mkdtemp()
+    rng = np.random.default_rng(0)
+    w, h = size
+    try:
+        src = os.path.join(tmp, "src")
+        os.makedirs(src)
+        noise = cv2.GaussianBlur(rng.integers(0, 255, (h, w, 3), dtype=np.uint8), (0, 0), 3)
+        ok, jpg = cv2.imencode(".jpg", noise, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        images = []
+        for i in range(n_images):
+            path = os.path.join(src, f"img_{i:05d}.jpg")
+            with open(path, "wb") as f:
+                f.write(jpg.tobytes())
+            images.append(path)
+        j = AnnotationJournal(src)
+        for i, path in enumerate(images):
+            name = os.path.basename(path)
+            j.record(name, BoxEdit([], [(0, 10.0, 10.0, 200.0, 150.0)]), size=size)
+            if rng.random() < with_mask:
+                before = np.zeros((200, 200), np.uint8)
+                after = before.copy()
+                cv2.circle(after, (100, 100), 80, 255, -1)
+                x, y = int(rng.integers(0, w - 200)), int(rng.integers(0, h - 200))
+                j.record(name, MaskEdit(1, (x, y, x + 200, y + 200), before, after), size=size)
+        j.flush()
+        out = os.path.join(tmp, "out")
+        t = time.perf_counter()
+        stats = export_labels(images, src, j.snapshot_state(), out, min_iou=0.98, min_area=16)
+        first = time.perf_counter() - t
+        print(f"export ครั้งแรก {first:.2f} s ({n_images / first:.0f} รูป/s) {stats}")
+        for path in images[::100]:
+            j.record(os.path.basename(path), BoxEdit([], [(1, 20.0, 20.0, 300.0, 250.0)]), size=size)
+        j.flush()
+        t = time.perf_counter()
+        stats = export_labels(images, src, j.snapshot_state(), out, min_iou=0.98, min_area=16)
+        print(f"export ซ้ำ {1000 * (time.perf_counter() - t):.0f} ms {stats}")
+        j.close()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+@benchmark("grabcut")
+def bench_grabcut(runs=10, size=(1920, 1080)):
+    """เวลา Auto Segment บนภาพ 1080p สังเคราะห์ (วงรีสีต่างจากพื้น) และ IoU กับคำตอบจริง"""
+    rng = np.random.default_rng(0)
+    w, h = size
+    img = cv2.GaussianBlur(rng.integers(0, 255, (h, w, 3), dtype=np.uint8), (0, 0), 5)
+    img = (img * 0.3 + np.array([60, 120, 60])).astype(np.uint8)
+    truth = np.zeros((h, w), np.uint8)
+    cv2.ellipse(truth, (w // 2, h // 2), (w // 7, h // 6), 20, 0, 360, 255, -1)
+    img[truth > 0] = (img[truth > 0] * 0.3 + np.array([200, 60, 40])).astype(np.uint8)
+    x, y, bw, bh = cv2.boundingRect(truth)
+    rect = (x - 10, y - 10, x + bw + 10, y + bh + 10)
+    for name, fg in (("กรอบอย่างเดียว", ()), ("กรอบ + เส้นขีด", [[(w // 2, h // 2), (w // 2 + 40, h // 2)]])):
+        times = []
+        for _ in range(runs):
+            t = time.perf_counter()
+            roi, obj = grabcut_mask(img, rect, fg=fg)
+            times.append(time.perf_counter() - t)
+        full = np.zeros_like(truth)
+        full[roi[1]:roi[3], roi[0]:roi[2]] = obj
+        iou = np.count_nonzero((full > 0) & (truth > 0)) / np.count_nonzero((full > 0) | (truth > 0))
+        print(_timing_line(name, times), f" IoU {iou:.3f}")
+
+
+def self_test():
+    """ตรวจส่วนที่ไม่ต้องเปิดหน้าต่าง: python "Training - Copy.py" --check"""
+    import weakref
+    history = EditHistory(budget=1 << 20)
+    path = "/check/a.jpg"
+    m = np.zeros((200, 200), np.uint8)
+    first = MaskEdit(0, (0, 0, 200, 200), m, m + 255)
+    history.push(path, first)
+    history.push(path, MaskEdit(0, (0, 0, 200, 200), m + 255, m))
+    history.undo(path)
+    ref = weakref.ref(history._redo[path][0])
+    before = history.nbytes
+    history.push(path, BoxEdit([], [(0, 1.0, 1.0, 5.0, 5.0)]))
+    assert ref() is None, "ขั้น redo ที่ถูกทิ้งยังค้างอยู่ใน EditHistory"
+    assert len(history._order) == 2 and history.counts(path) == (2, 0)
+    assert history.nbytes == sum(e.nbytes for _, e in history._order) < before + 1024
+    print("self-test: OK")
+
+
 if __name__ == "__main__":
+    if "--check" in sys.argv:
+        self_test()
+        sys.exit(0)
+    if "--bench" in sys.argv:
+        i = sys.argv.index("--bench")
+        names = sys.argv[i + 1:i + 2] or []
+        if not names or names[0] not in BENCHMARKS:
+            print("benchmarks:", ", ".join(sorted(BENCHMARKS)))
+        else:
+            BENCHMARKS[names[0]]()
+        sys.exit(0)
     app = YOLOManagerApp()
     app.mainloop()
@@ -8,6 +8,10 @@ from ultralytics import YOLO
 import cv2
 import math
 from PlaySound import *
+from CameraSupervisor import CameraSupervisor
+from SharedCapture import SharedCameraSource
+from Ledger import DecisionLedger
+from DisplayBuffer import DisplaySurface
 import RPi.GPIO as GPIO
 
 GPIO.setmode(GPIO.BCM)
@@ -43,6 +47,14 @@ DEFAULT_BG = "#f0f0f0"
 DEFAULT_TEXT = "Input Waste"
 DEFAULT_TEXT2 = "วางขยะได้เลย"
 
+# live preview มุมขวาบน (PREVIEW_FPS = 0 คือปิด)
+PREVIEW_FPS = 5
+PREVIEW_SIZE = (256, 144)
+PREVIEW_BUDGET = 0.05  # สัดส่วน CPU ของหนึ่ง core ที่ preview ใช้ได้
+
+# True = อ่าน/ถอดรหัสกล้องใน process แยกผ่าน shared memory (ไม่แย่ง GIL กับ inference และ Tk)
+USE_CAPTURE_PROCESS = False
+
 # สร้างหน้าต่างหลัก
 root = tk.Tk()
 root.title("Bottle Placement")
@@ -53,11 +65,10 @@ root.configure(bg=DEFAULT_BG)
 
 def quit_app():
     # ปิดกล้องก่อนออก
-    global camera_running
     GPIO.cleanup()
-    camera_running = False
-    if cap.isOpened():
-        cap.release()
+    camera.stop()
+    print(camera.status_text())
+    ledger.close()
     root.destroy()
 
 
@@ -80,6 +91,7 @@ def reset_to_default(z):
     label.configure(text=DEFAULT_TEXT, bg=DEFAULT_BG, fg="black")
     label2.configure(text=DEFAULT_TEXT2, bg=DEFAULT_BG, fg="black")
     label3.configure(text="", bg=DEFAULT_BG, fg="black")
+    last_boxes.clear()
 
 
 def gpio_monitor_loop():
@@ -93,7 +105,17 @@ def gpio_monitor_loop():
 
 def handle_gpio_trigger():
     n = 0
-    z, frame2 = check()
+    result = check()
+    if result is None:
+        return
+    z, frame2 = result
+    if z == 5:
+        n += 1
+        if n == 1:
+            play_sound('Error')
+        root.configure(bg="red")
+        center_frame.configure(bg="red")
+        label.configure(text="กล้องไม่พร้อม", bg="red", fg="white")
     if z == 4:
         n += 1
         if n == 1:
@@ -151,7 +173,17 @@ def handle_keypress(event):
     global label
     if event.char.lower() == 's':
         n = 0
-        z, frame2 = check()
+        result = check()
+        if result is None:
+            return
+        z, frame2 = result
+        if z == 5:
+            n += 1
+            if n == 1:
+                play_sound('Error')
+            root.configure(bg="red")
+            center_frame.configure(bg="red")
+            label.configure(text="กล้องไม่พร้อม", bg="red", fg="white")
         if z == 4:
             n += 1
             if n == 1:
@@ -208,11 +240,9 @@ def reset_gui():
 
 def update_image():
     global label
-    global label
+    frame, frame_ts = camera.latest()
     if frame is not None:
-        img = PIL.ImageTk.PhotoImage(image=PIL.Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)))
-        label.config(image=img)
-        label.image = img
+        label.config(image=display.show(frame))
         label.place(relx=0.5, rely=0.15, anchor="center")  # แสดงภาพ
     else:
         label.config(image='')  # เคลียร์ภาพ
@@ -252,6 +282,12 @@ def start_countdown(seconds, z):
         col = "red"
         col2 = "white"
 
+    if z == 5:
+        status = "Camera unavailable"
+        status2 = "กล้องไม่พร้อม"
+        col = "red"
+        col2 = "white"
+
     if seconds > 0:
         label.place(relx=0.5, rely=0.25, anchor="center")
         label.configure(text=f"{status}", bg=col,fg=col2,font=("Arial", 48))
@@ -262,13 +298,47 @@ def start_countdown(seconds, z):
         reset_to_default(z)
 
 
+# GPIO thread กับปุ่ม s (Tk thread) เรียก check() ได้ทั้งคู่ แต่ SharedCameraSource pin เฟรมได้ช่องเดียว
+check_lock = threading.Lock()
+
+
 def check():
-    global frame, label,imgtk_ref
+    """ตรวจชิ้นงานหนึ่งครั้ง คืน (z, frame) หรือ None ถ้ามีการตรวจอื่นกำลังทำอยู่ (ปฏิเสธ trigger นี้)"""
+    # ไม่รอ lock: Tk thread ห้าม block (check() ใน GPIO thread ก็เรียก widget ผ่าน Tk thread อยู่)
+    if not check_lock.acquire(blocking=False):
+        print("⚠️ กำลังตรวจชิ้นก่อนหน้าอยู่ — ข้าม trigger นี้")
+        return None
+    try:
+        return _check()
+    finally:
+        check_lock.release()
+
+
+def _check():
+    global label,imgtk_ref,last_frame_size
     a = 0
     z = 0
     b = 3
     err = 0
-    results = model1(frame, conf=0.7)
+    detections = []
+    t0 = time.monotonic()
+    frame, frame_ts = camera.latest()
+    if frame is None:
+        # กล้องหลุด/ภาพค้าง: ไม่จัดประเภทจากภาพเก่า
+        print(f"❌ ปฏิเสธ trigger: {camera.status_text()}")
+        ledger.record(5, [], {})
+        return 5, None
+    camera.pause_preview()  # ไม่ทำ preview ระหว่าง inference
+    t1 = time.monotonic()
+    try:
+        # ถ้าใช้ process กล้อง frame คือ view ใน shared memory ส่งเข้าโมเดลได้เลยไม่ต้องคัดลอก
+        results = model1(frame, conf=0.7)
+    finally:
+        camera.resume_preview()  # inference พังก็ต้องเปิด preview คืน
+    t2 = time.monotonic()
+    frame = frame.copy()  # วาดกรอบบนสำเนา ไม่ให้ไปแก้เฟรมที่กล้องถืออยู่
+    t2b = time.monotonic()
+    boxes_for_preview = []
     for i in results:
         classes_names1 = i.names
         boxes = i.boxes
@@ -280,6 +350,8 @@ def check():
             confidence = math.ceil((box.conf[0] * 100)) / 100
             cls = int(box.cls[0])
             class_name = classes_names1[cls]
+            detections.append((class_name, confidence))
+            boxes_for_preview.append((x1, y1, x2, y2, class_name, confidence))
             cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 0, 255), 4)
             cv2.putText(frame, f'{class_name} , {confidence}', (x1, y1), cv2.FONT_HERSHEY_PLAIN, 3,
                         (255, 255, 255), 2)
@@ -310,15 +382,21 @@ def check():
     if b == 3 and err != 1:
         z = 4
 
-    cv2.imwrite("test.jpg", frame)
+    last_boxes[:] = boxes_for_preview
+    last_frame_size = (frame.shape[1], frame.shape[0])
+    # บันทึกลง ledger (ภาพหลักฐานถูกเขียนใน thread ของ ledger ไม่หน่วงการคัดแยก)
+    t3 = time.monotonic()
+    ledger.record(z, detections, {
+        "frame_age": (t0 - frame_ts) * 1000,
+        "inference": (t2 - t1) * 1000,
+        "copy": (t2b - t2) * 1000,
+        "postprocess": (t3 - t2b) * 1000,
+    }, image=frame)
     print(f"b = {b}  err = {err}")
     print(f"z = {z}")
-    frame = cv2.resize(frame, (800, 450))
-    frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-    img = Image.fromarray(frame)
-    imgtk = ImageTk.PhotoImage(image=img)
+    # เขียนทับ PhotoImage เดิมขนาดจอ แทนการสร้าง PIL/PhotoImage ใหม่ทุกชิ้น
+    imgtk = display.show(frame)
     label.config(image=imgtk)
-    label.imgtk = imgtk
     label.place(relx=0.5, rely=0.45, anchor="center")
     label2.configure(text=f"")
     root.after(2000, reset_gui)
@@ -326,33 +404,52 @@ def check():
 
 
 # ---- กล้อง ----
-def camera_loop():
-    global cap, camera_running, frame
-    width = 1920
-    height = 1080
-    cap = cv2.VideoCapture(0)
-    cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc('M', 'J', 'P', 'G'))
-    # ตั้งค่าความกว้างของเฟรมวิดีโอ
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
-    #    ตั้งค่าความสูงของเฟรมวิดีโอ
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
-    if not cap.isOpened():
-        print("❌ ไม่พบกล้อง")
-        return
-    print("❌ เริ่ม")
-    camera_running = True
-    while camera_running:
-        # frame = pic_test
-        # time.sleep(0.5)
-        ret, frame = cap.read()
-        # print("====================================")
-        if not ret:
-            print("❌ ไม่สามารถอ่านภาพจากกล้องได้")
-            break
-        # คุณสามารถเพิ่มการประมวลผล frame ได้ที่นี่ (ถ้าต้องการ)
-        time.sleep(0.03)  # ประมาณ 30 FPS
+# supervisor เปิดกล้องใหม่เองเมื่ออ่านภาพไม่ได้หรือภาพค้าง
+if USE_CAPTURE_PROCESS:
+    camera = SharedCameraSource(index=0, width=1920, height=1080, preview_fps=PREVIEW_FPS,
+                                preview_size=PREVIEW_SIZE, preview_budget=PREVIEW_BUDGET)
+else:
+    camera = CameraSupervisor(index=0, width=1920, height=1080, preview_fps=PREVIEW_FPS,
+                              preview_size=PREVIEW_SIZE, preview_budget=PREVIEW_BUDGET)
+# บันทึกทุกชิ้นที่คัดแยกลง SQLite
+ledger = DecisionLedger()
+
+# ---- live preview ----
+# กรอบของการตัดสินล่าสุด (พิกัดเฟรมเต็ม) วาดทับ preview จนกว่าจะกลับหน้าหลัก
+last_boxes = []
+last_frame_size = (1920, 1080)
+preview_ts = None
+
+
+def preview_tick():
+    global preview_ts
+    cpu = time.thread_time()
+    img, ts = camera.latest_preview()
+    if img is None:
+        preview_label.place_forget()
+    elif ts != preview_ts:
+        preview_ts = ts
+        preview.fill(img)
+        fx = PREVIEW_SIZE[0] / last_frame_size[0]
+        fy = PREVIEW_SIZE[1] / last_frame_size[1]
+        for x1, y1, x2, y2, class_name, confidence in last_boxes:
+            p1 = (int(x1 * fx), int(y1 * fy))
+            p2 = (int(x2 * fx), int(y2 * fy))
+            cv2.rectangle(preview.buffer, p1, p2, (0, 0, 255), 2)
+            cv2.putText(preview.buffer, f'{class_name} {confidence}', (p1[0], max(10, p1[1] - 3)),
+                        cv2.FONT_HERSHEY_PLAIN, 0.9, (255, 255, 255), 1)
+        preview_label.config(image=preview.present())
+        preview_label.place(relx=1.0, rely=0.0, anchor="ne")
+    # งบ CPU ฝั่ง Tk: ถ้าวาดช้ากว่างบ ให้ยืดรอบถัดไปออกไป
+    cost = time.thread_time() - cpu
+    delay = max(1.0 / PREVIEW_FPS, cost / PREVIEW_BUDGET)
+    root.after(int(delay * 1000), preview_tick)
+
 
 # UI Elements
+display = DisplaySurface(800, 450)
+preview = DisplaySurface(*PREVIEW_SIZE)
+
 center_frame = tk.Frame(root, width=800, height=400, bg=DEFAULT_BG)
 center_frame.pack(expand=True)
 
@@ -366,9 +463,12 @@ label3.place(relx=0.5, rely=0.85, anchor="center")
 exit_button = tk.Button(root, text="ออกโปรแกรม", font=("Arial", 18), command=quit_app)
 exit_button.pack(side="bottom", pady=0)
 
+preview_label = tk.Label(root, bd=0)
+
 
-camera_thread = threading.Thread(target=camera_loop, daemon=True)
-camera_thread.start()
+camera.start()
+if PREVIEW_FPS:
+    root.after(1000, preview_tick)
 # ผูก event
 root.bind("<Key>", handle_keypress)
 